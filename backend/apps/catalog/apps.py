@@ -5,5 +5,6 @@ class CatalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.catalog'
 
-
-
+    def ready(self):
+        # Сигналы сброса кэша категорий
+        from . import services  # noqa: F401
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-16 10:12
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rename_duplicate_articles(apps, schema_editor):
+    """Дубли (поставщик, артикул) получают суффикс -<id>, первый товар сохраняет артикул"""
+    Product = apps.get_model('catalog', 'Product')
+    duplicates = (
+        Product.objects.filter(supplier__isnull=False)
+        .values('supplier_id', 'article')
+        .annotate(cnt=Count('id'))
+        .filter(cnt__gt=1)
+    )
+    for dup in duplicates:
+        products = Product.objects.filter(
+            supplier_id=dup['supplier_id'], article=dup['article']
+        ).order_by('id')[1:]
+        for product in products:
+            product.article = f'{product.article}-{product.id}'[:100]
+            product.save(update_fields=['article'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0005_product_price_list'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_articles, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('supplier', 'article'), name='catalog_product_supplier_article_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0006_product_supplier_article_uniq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='missed_imports',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Подряд отсутствует в прайс-листах'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_product_missed_imports'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductBatchUpdate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('selection', models.JSONField(verbose_name='Выбор товаров')),
+                ('changes', models.JSONField(verbose_name='Изменения')),
+                ('status', models.CharField(choices=[('QUEUED', 'В очереди'), ('RUNNING', 'Выполняется'), ('DONE', 'Выполнено'), ('FAILED', 'Ошибка')], default='QUEUED', max_length=20, verbose_name='Статус')),
+                ('updated_count', models.PositiveIntegerField(default=0, verbose_name='Обновлено товаров')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Запущено')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+            ],
+            options={
+                'verbose_name': 'Массовое обновление товаров',
+                'verbose_name_plural': 'Массовые обновления товаров',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
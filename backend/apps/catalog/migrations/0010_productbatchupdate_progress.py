@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productbatchupdate',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Последний сигнал обработчика'),
+        ),
+        migrations.AddField(
+            model_name='productbatchupdate',
+            name='locked_by',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Обработчик'),
+        ),
+        migrations.AddField(
+            model_name='productbatchupdate',
+            name='processed_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Обработано товаров'),
+        ),
+        migrations.AddField(
+            model_name='productbatchupdate',
+            name='product_ids',
+            field=models.JSONField(blank=True, null=True, verbose_name='id выбранных товаров'),
+        ),
+    ]
@@ -31,6 +31,7 @@ class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='products', verbose_name='Категория')
     origin = models.CharField(max_length=20, choices=ORIGIN_CHOICES, default='РФ', verbose_name='Происхождение')
     is_active = models.BooleanField(default=True, verbose_name='Активен')
+    missed_imports = models.PositiveSmallIntegerField(default=0, verbose_name='Подряд отсутствует в прайс-листах')
     is_recommended = models.BooleanField(default=False, verbose_name='Рекомендуемый')
     is_promotional = models.BooleanField(default=False, verbose_name='Акционный')
     base_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Базовая цена')
@@ -44,25 +45,70 @@ class Product(models.Model):
         verbose_name_plural = 'Товары'
         indexes = [
             models.Index(fields=['article']),
-            models.Index(fields=['is_active']),
+            # Keyset-пагинация каталога (apps/catalog/pagination.py): фильтр is_active и порядок (поле, id)
+            models.Index(fields=['is_active', 'name', 'id'], name='catalog_prod_active_name_idx'),
+            models.Index(fields=['is_active', 'final_price', 'id'], name='catalog_prod_active_price_idx'),
+            models.Index(fields=['is_active', 'created_at', 'id'], name='catalog_prod_active_cdate_idx'),
+        ]
+        constraints = [
+            # Ключ для пакетного импорта прайс-листов (bulk_create с update_conflicts)
+            models.UniqueConstraint(fields=['supplier', 'article'], name='catalog_product_supplier_article_uniq'),
         ]
 
     def __str__(self):
         return f'{self.name} ({self.article})'
 
     def save(self, *args, **kwargs):
-        # Автоматический пересчет итоговой цены
-        # Если есть наценка поставщика в сомах, используем её
-        from decimal import Decimal
-        if self.supplier and self.supplier.markup_som:
-            markup = Decimal(str(self.supplier.markup_som))
-            self.final_price = Decimal(str(self.base_price)) + markup
-        elif self.base_price and self.markup_percent:
-            # Если используется процентная наценка (старый способ)
-            markup_percent = Decimal(str(self.markup_percent))
-            self.final_price = Decimal(str(self.base_price)) * (Decimal('1') + markup_percent / Decimal('100'))
-        elif self.base_price:
-            self.final_price = Decimal(str(self.base_price))
+        # Автоматический пересчет итоговой цены по правилам наценки (apps/suppliers/pricing.py):
+        # правило, иначе наценка поставщика в сомах, иначе процентная наценка товара.
+        # Правила кэшируются в процессе и сверяются с БД одним запросом - их меняют и другие процессы
+        from apps.suppliers.pricing import PricingRules
+        final_price = PricingRules.for_product(self.supplier_id).final_price(
+            self.base_price, self.supplier_id, self.category_id, self.markup_percent
+        )
+        # Без базовой цены и наценки итоговая цена остается как есть
+        if final_price or self.base_price:
+            self.final_price = final_price
         super().save(*args, **kwargs)
 
 
+class ProductBatchUpdate(models.Model):
+    """
+    Массовое обновление товаров, отложенное для обработчика очереди (run_pricelist_worker):
+    выбор больше PRODUCT_BATCH_UPDATE_SYNC_LIMIT товаров не обновляется в запросе админки.
+    """
+    STATUS_QUEUED = 'QUEUED'
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_DONE = 'DONE'
+    STATUS_FAILED = 'FAILED'
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Выполнено'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    # {'product_ids': [...]} или {'filters': {...}} - фильтры списка товаров админки
+    selection = models.JSONField(verbose_name='Выбор товаров')
+    changes = models.JSONField(verbose_name='Изменения')
+    # id выбранных товаров, зафиксированные при первом запуске: повтор не пересчитывает фильтры
+    # по уже измененным товарам; processed_count - сколько из них обработано (закоммиченные пачки)
+    product_ids = models.JSONField(null=True, blank=True, verbose_name='id выбранных товаров')
+    processed_count = models.PositiveIntegerField(default=0, verbose_name='Обработано товаров')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, verbose_name='Статус')
+    updated_count = models.PositiveIntegerField(default=0, verbose_name='Обновлено товаров')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    locked_by = models.CharField(max_length=255, blank=True, verbose_name='Обработчик')
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name='Последний сигнал обработчика')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Запущено')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Завершено')
+
+    class Meta:
+        verbose_name = 'Массовое обновление товаров'
+        verbose_name_plural = 'Массовые обновления товаров'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'Массовое обновление {self.id} ({self.get_status_display()})'
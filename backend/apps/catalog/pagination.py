@@ -0,0 +1,197 @@
+"""
+Keyset-пагинация каталога товаров.
+
+Страница выбирается условием по ключу сортировки и id ((name, id) > (последнее name, последний id))
+по составным индексам (is_active, <поле>, id): без OFFSET и без COUNT(*) на каждый запрос, так что
+глубокая прокрутка стоит столько же, сколько первая страница. Курсор непрозрачный (base64 от JSON),
+в нем же сохранена сортировка. Общее число - по запросу (with_count=true) и приближенное: оценка
+планировщика Postgres (pg_class.reltuples), на других БД - обычный COUNT.
+
+Каталог во фронтенде (ProductsPage) листает по курсору из next. Запросы с параметром page
+обслуживаются прежней PageNumberPagination: на нее рассчитан список товаров в админке
+(ProductsManager), которому нужно точное общее число.
+"""
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from typing import Optional, Tuple
+
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def estimate_count(queryset: QuerySet) -> int:
+    """
+    Приближенное число строк queryset без COUNT(*).
+    Без фильтров - pg_class.reltuples таблицы, с фильтрами - оценка строк из EXPLAIN
+    (та же статистика с учетом селективности условий). Не Postgres или таблица еще
+    не анализировалась - точный COUNT.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return queryset.count()
+    queryset = queryset.order_by()
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            estimate = row[0] if row else -1
+        else:
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+    # reltuples = -1 (или 0) у таблицы, по которой еще не собрана статистика
+    return estimate if estimate > 0 else queryset.count()
+
+
+class ProductCursorPagination(BasePagination):
+    """Курсор по (поле сортировки, id) для списков товаров; с page - постраничная пагинация"""
+
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    count_query_param = 'with_count'
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    # Сортировки с составным индексом (is_active, <поле>, id); остальные заменяются на default_ordering
+    orderings = ('name', 'final_price', 'created_at')
+    default_ordering = 'name'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def __init__(self):
+        self.page_number = PageNumberPagination()
+        self.legacy = False
+        self.request = None
+        self.ordering = self.default_ordering
+        self.next_position: Optional[Tuple] = None
+        self.count: Optional[int] = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.page_number.page_query_param in params and self.cursor_query_param not in params:
+            self.legacy = True
+            return self.page_number.paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            self.ordering, value, pk = cursor
+        else:
+            self.ordering = self.get_ordering(request)
+            value = pk = None
+
+        if params.get(self.count_query_param, '').lower() == 'true':
+            self.count = estimate_count(queryset)
+
+        field = self.ordering.lstrip('-')
+        descending = self.ordering.startswith('-')
+        queryset = queryset.order_by(*((f'-{field}', '-id') if descending else (field, 'id')))
+        if cursor is not None:
+            after, after_or_equal = ('lt', 'lte') if descending else ('gt', 'gte')
+            # Лишнее "поле >= значение" дает Postgres диапазон по индексу, OR - порядок внутри равных значений
+            queryset = queryset.filter(**{f'{field}__{after_or_equal}': value}).filter(
+                Q(**{f'{field}__{after}': value}) | Q(**{field: value, f'id__{after}': pk})
+            )
+
+        # Лишняя строка показывает, есть ли следующая страница
+        page = list(queryset[:page_size + 1])
+        if len(page) > page_size:
+            page = page[:page_size]
+            last = page[-1]
+            self.next_position = (getattr(last, field), last.pk)
+        return page
+
+    def get_page_size(self, request) -> int:
+        page_size = api_settings.PAGE_SIZE
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            pass
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering(self, request) -> str:
+        ordering = request.query_params.get(self.ordering_query_param) or self.default_ordering
+        return ordering if ordering.lstrip('-') in self.orderings else self.default_ordering
+
+    def encode_cursor(self, value, pk) -> str:
+        # Значение ключа - строкой полной точности: DjangoJSONEncoder обрезает datetime до миллисекунд,
+        # и товары одной миллисекунды (bulk_create импорта) пропускались бы или повторялись
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        data = json.dumps([self.ordering, value, pk], separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request) -> Optional[Tuple[str, object, int]]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            ordering, value, pk = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')).decode('utf-8'))
+            pk = int(pk)
+            if not isinstance(ordering, str) or ordering.lstrip('-') not in self.orderings:
+                raise ValueError(ordering)
+            value = self.parse_value(ordering.lstrip('-'), value)
+        except (binascii.Error, UnicodeError, ValueError, TypeError, ArithmeticError):
+            raise NotFound(self.invalid_cursor_message)
+        return ordering, value, pk
+
+    @staticmethod
+    def parse_value(field: str, value):
+        """Значение ключа из курсора в тип поля сортировки"""
+        if not isinstance(value, str):
+            raise ValueError(value)
+        if field == 'created_at':
+            parsed = parse_datetime(value)
+            if parsed is None:
+                raise ValueError(value)
+            return parsed
+        if field == 'final_price':
+            return Decimal(value)
+        return value
+
+    def get_next_link(self) -> Optional[str]:
+        if self.next_position is None:
+            return None
+        url = remove_query_param(self.request.build_absolute_uri(), self.ordering_query_param)
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(*self.next_position))
+
+    def get_paginated_response(self, data):
+        if self.legacy:
+            return self.page_number.get_paginated_response(data)
+        response = OrderedDict([('next', self.get_next_link()), ('previous', None)])
+        if self.count is not None:
+            response['count'] = self.count
+            response['count_is_estimate'] = True
+        response['results'] = data
+        return Response(response)
+
+    def get_paginated_response_schema(self, schema):
+        if self.legacy:
+            return self.page_number.get_paginated_response_schema(schema)
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer'},
+                'count_is_estimate': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
@@ -30,6 +30,36 @@ class ProductSerializer(serializers.ModelSerializer):
         return float(obj.final_price) if obj.final_price else 0.0
 
 
+class ProductCatalogSerializer(serializers.ModelSerializer):
+    """
+    Товар в каталоге для клиентов: плоские поля и final_price как price, без агрегатов поставщика.
+    Рассчитан на queryset с select_related('category', 'supplier') - страница без лишних запросов.
+    """
+    supplier = serializers.SerializerMethodField()
+    category = serializers.SerializerMethodField()
+    price = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'article', 'supplier_id', 'supplier', 'unit', 'category_id', 'category',
+                  'origin', 'is_active', 'is_recommended', 'is_promotional', 'price', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+    def get_supplier(self, obj):
+        # Только то, что показывает клиент: без счетчиков прайс-листов и товаров
+        if obj.supplier_id is None:
+            return None
+        return {'id': obj.supplier_id, 'name': obj.supplier.name}
+
+    def get_category(self, obj):
+        if obj.category_id is None:
+            return None
+        return {'id': obj.category_id, 'name': obj.category.name, 'parent': obj.category.parent_id}
+
+    def get_price(self, obj):
+        return float(obj.final_price) if obj.final_price else 0.0
+
+
 class ProductAdminSerializer(serializers.ModelSerializer):
     """Сериализатор товара для админа (показывает base_price - цена поставщика)"""
     category = CategorySerializer(read_only=True)
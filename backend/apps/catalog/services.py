@@ -0,0 +1,372 @@
+"""
+Сервисы каталога: пакетное сопоставление категорий по названию и массовое обновление товаров
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from apps.suppliers.pricing import PricingRules, update_final_prices
+
+from .models import Category, Product, ProductBatchUpdate
+
+logger = logging.getLogger(__name__)
+
+# Категория из парсера: название ('Кровля') или путь от корня (('Лист 1', 'Кровля'))
+CategoryPath = Union[str, Sequence[str]]
+
+
+def category_path(value: Optional[CategoryPath]) -> Tuple[str, ...]:
+    """Нормализованный путь категории: кортеж непустых названий без пробелов по краям"""
+    if not value:
+        return ()
+    if isinstance(value, str):
+        value = (value,)
+    return tuple(name.strip() for name in value if isinstance(name, str) and name.strip())
+
+
+class CategoryCache:
+    """
+    Кэш name -> id уровня процесса.
+
+    Корневые названия ищутся по имени без учета родителя (как раньше get_or_create(name=...)),
+    вложенные - по паре (parent_id, name). Кэш сбрасывается при любой записи Category
+    через ORM (сигналы ниже) и по TTL. Изменения из другого процесса сигналы не видят:
+    id из кэша CategoryResolver перед использованием сверяет с таблицей.
+    Новые значения попадают в кэш только после коммита транзакции.
+    """
+
+    TTL = 300
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._roots: Dict[str, int] = {}
+        self._children: Dict[Tuple[int, str], int] = {}
+        self._reset_at = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._roots = {}
+            self._children = {}
+            self._reset_at = time.monotonic()
+
+    def _expire(self):
+        if time.monotonic() - self._reset_at > self.TTL:
+            self.clear()
+
+    def get_roots(self, names: Iterable[str]) -> Dict[str, int]:
+        self._expire()
+        roots = self._roots
+        return {name: roots[name] for name in names if name in roots}
+
+    def get_children(self, keys: Iterable[Tuple[int, str]]) -> Dict[Tuple[int, str], int]:
+        self._expire()
+        children = self._children
+        return {key: children[key] for key in keys if key in children}
+
+    def store(self, roots: Dict[str, int], children: Dict[Tuple[int, str], int]):
+        """Сохраняет найденные/созданные id после коммита текущей транзакции"""
+        if not roots and not children:
+            return
+
+        def publish():
+            with self._lock:
+                self._roots.update(roots)
+                self._children.update(children)
+
+        transaction.on_commit(publish)
+
+
+category_cache = CategoryCache()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def _invalidate_category_cache(sender, **kwargs):
+    category_cache.clear()
+
+
+class CategoryResolver:
+    """
+    Сопоставление категорий из прайс-листа с таблицей Category.
+
+    Названия обрабатываются по уровням иерархии: на каждом уровне все отсутствующие
+    в кэше названия ищутся одним запросом name__in, недостающие создаются одним
+    bulk_create. Число запросов зависит от глубины вложенности, а не от числа категорий.
+
+    id, взятые из кэша, проверяются одним запросом id__in на весь resolve(): категорию могли
+    удалить, переименовать или перенести в другом процессе (веб-админка при импорте в
+    обработчике очереди), и bulk_create товаров с таким id нарушил бы внешний ключ.
+    Если проверка не прошла, кэш сбрасывается и пути сопоставляются заново без него.
+    """
+
+    def __init__(self, cache: CategoryCache = category_cache):
+        self.cache = cache
+
+    def resolve(self, values: Iterable[CategoryPath]) -> Dict[Tuple[str, ...], int]:
+        """Путь категории -> id для всех переданных названий/путей"""
+        paths = {path for path in map(category_path, values) if path}
+        cached: Dict[int, Tuple[Optional[int], str]] = {}
+        resolved = self._resolve(paths, cached)
+        if cached and not self._cached_valid(cached):
+            logger.info('Кэш категорий устарел (категории изменены в другом процессе), сопоставление заново')
+            self.cache.clear()
+            resolved = self._resolve(paths, None)
+        return resolved
+
+    def _resolve(self, paths: set, cached: Optional[Dict[int, Tuple[Optional[int], str]]]
+                 ) -> Dict[Tuple[str, ...], int]:
+        """
+        Сопоставление по уровням; cached - куда записать id, взятые из кэша
+        (id -> (parent_id или None для корня, название)), None - кэш не читается.
+        """
+        resolved: Dict[Tuple[str, ...], int] = {}
+        depth = max((len(path) for path in paths), default=0)
+
+        for level in range(depth):
+            prefixes = {path[:level + 1] for path in paths if len(path) > level}
+            if level == 0:
+                ids = self._resolve_roots({prefix[0] for prefix in prefixes}, cached)
+                for prefix in prefixes:
+                    resolved[prefix] = ids[prefix[0]]
+            else:
+                keys = {(resolved[prefix[:-1]], prefix[-1]) for prefix in prefixes}
+                ids = self._resolve_children(keys, cached)
+                for prefix in prefixes:
+                    resolved[prefix] = ids[(resolved[prefix[:-1]], prefix[-1])]
+        return resolved
+
+    @staticmethod
+    def _cached_valid(cached: Dict[int, Tuple[Optional[int], str]]) -> bool:
+        """Все id из кэша существуют с тем же названием (и родителем - для вложенных)"""
+        rows = {
+            category_id: (parent_id, name)
+            for category_id, parent_id, name in Category.objects.filter(id__in=cached).values_list('id', 'parent_id', 'name')
+        }
+        for category_id, (parent_id, name) in cached.items():
+            row = rows.get(category_id)
+            # Корень ищется только по названию (parent_id None), вложенная - по родителю и названию
+            if row is None or row[1] != name or (parent_id is not None and row[0] != parent_id):
+                return False
+        return True
+
+    def _resolve_roots(self, names: set, cached: Optional[Dict]) -> Dict[str, int]:
+        ids = self.cache.get_roots(names) if cached is not None else {}
+        if cached is not None:
+            cached.update((category_id, (None, name)) for name, category_id in ids.items())
+        missing = names - ids.keys()
+        if not missing:
+            return ids
+
+        found: Dict[str, int] = {}
+        # Корневые категории в приоритете, среди одноименных - самая старая
+        rows = Category.objects.filter(name__in=missing).order_by(
+            F('parent').asc(nulls_first=True), 'id'
+        ).values_list('name', 'id')
+        for name, category_id in rows:
+            found.setdefault(name, category_id)
+
+        created = self._create([Category(name=name) for name in sorted(missing - found.keys())])
+        created_ids = {category.name: category.id for category in created}
+        self.cache.store({**found, **created_ids}, {})
+        ids.update(found)
+        ids.update(created_ids)
+        return ids
+
+    def _resolve_children(self, keys: set, cached: Optional[Dict]) -> Dict[Tuple[int, str], int]:
+        ids = self.cache.get_children(keys) if cached is not None else {}
+        if cached is not None:
+            cached.update((category_id, key) for key, category_id in ids.items())
+        missing = keys - ids.keys()
+        if not missing:
+            return ids
+
+        found: Dict[Tuple[int, str], int] = {}
+        rows = Category.objects.filter(
+            parent_id__in={parent_id for parent_id, _ in missing},
+            name__in={name for _, name in missing},
+        ).order_by('id').values_list('parent_id', 'name', 'id')
+        for parent_id, name, category_id in rows:
+            if (parent_id, name) in missing:
+                found.setdefault((parent_id, name), category_id)
+
+        created = self._create([
+            Category(name=name, parent_id=parent_id)
+            for parent_id, name in sorted(missing - found.keys())
+        ])
+        created_ids = {(category.parent_id, category.name): category.id for category in created}
+        self.cache.store({}, {**found, **created_ids})
+        ids.update(found)
+        ids.update(created_ids)
+        return ids
+
+    @staticmethod
+    def _create(categories: List[Category]) -> List[Category]:
+        if not categories:
+            return []
+        # bulk_create не вызывает сигналы, так что кэш не сбрасывается собственными вставками
+        return Category.objects.bulk_create(categories)
+
+
+def _is_true(value) -> bool:
+    """Флаг из query-параметра ('true') или JSON (true)"""
+    return str(value).lower() == 'true'
+
+
+def filter_admin_products(params: Mapping) -> QuerySet:
+    """
+    Товары по фильтрам списка админки: search, is_recommended, is_promotional, is_active, supplier_id.
+    По умолчанию только активные, is_active=false - все товары.
+    Используется списком ProductViewSet и выбором "все по фильтру" в массовом обновлении.
+    """
+    is_active = params.get('is_active', None)
+    if is_active is not None and str(is_active).lower() == 'false':
+        queryset = Product.objects.all()
+    else:
+        queryset = Product.objects.filter(is_active=True)
+
+    # Поиск по названию и артикулу
+    search = params.get('search', None)
+    if search:
+        queryset = queryset.filter(Q(name__icontains=search) | Q(article__icontains=search))
+
+    is_recommended = params.get('is_recommended', None)
+    if is_recommended is not None:
+        queryset = queryset.filter(is_recommended=_is_true(is_recommended))
+
+    is_promotional = params.get('is_promotional', None)
+    if is_promotional is not None:
+        queryset = queryset.filter(is_promotional=_is_true(is_promotional))
+
+    supplier_id = params.get('supplier_id', None)
+    if supplier_id:
+        queryset = queryset.filter(supplier_id=supplier_id)
+    return queryset
+
+
+# Поля, от которых зависит final_price (pricing.PricingRules)
+PRICE_FIELDS = ('markup_percent', 'supplier_id')
+
+
+def batch_update_products(products: QuerySet, changes: Dict, chunk_size: Optional[int] = None) -> int:
+    """
+    Применяет changes (markup_percent, supplier_id, is_recommended, is_promotional, is_active)
+    к выбранным товарам и пересчитывает их final_price - без save() на каждый товар.
+
+    id выбора читаются один раз, так что изменение полей из фильтра (например, is_active)
+    не меняет выбор между пачками. Возвращает число обновленных товаров.
+    """
+    ids = list(products.order_by('id').values_list('id', flat=True))
+    return update_products_by_ids(ids, changes, chunk_size)
+
+
+def update_products_by_ids(ids: Sequence[int], changes: Dict, chunk_size: Optional[int] = None,
+                           start: int = 0, on_chunk=None) -> int:
+    """
+    Обновляет товары ids[start:] пачками по chunk_size: на каждую пачку в одной транзакции
+    два UPDATE - поля и final_price (CASE по правилам и наценкам поставщиков; второй - после
+    первого, потому что цена считается от новых наценки и поставщика).
+    on_chunk(позиция после пачки, обновлено строк) вызывается внутри транзакции пачки:
+    исключение из него откатывает пачку. Возвращает число обновленных товаров.
+    """
+    chunk_size = chunk_size or settings.PRODUCT_BATCH_UPDATE_CHUNK_SIZE
+    price = PricingRules.load().expression() if any(field in changes for field in PRICE_FIELDS) else None
+    updated = 0
+    for position in range(start, len(ids), chunk_size):
+        chunk = Product.objects.filter(id__in=ids[position:position + chunk_size])
+        with transaction.atomic():
+            rows = chunk.update(**changes, updated_at=timezone.now())
+            if price is not None:
+                update_final_prices(chunk, price, None)
+            if on_chunk is not None:
+                on_chunk(min(position + chunk_size, len(ids)), rows)
+        updated += rows
+    return updated
+
+
+def products_for_selection(selection: Dict) -> QuerySet:
+    """Товары по ProductBatchUpdate.selection: явные id или фильтры списка админки"""
+    if 'filters' in selection:
+        return filter_admin_products(selection['filters'])
+    return Product.objects.filter(id__in=selection.get('product_ids', []))
+
+
+class BatchUpdateLost(Exception):
+    """Задание массового обновления перехвачено другим обработчиком"""
+
+
+def run_pending_batch_update(worker_id: Optional[str] = None) -> Optional[ProductBatchUpdate]:
+    """
+    Выполняет следующее отложенное массовое обновление (для обработчика очереди).
+
+    При первом запуске id выбранных товаров фиксируются в задании (product_ids), после каждой
+    пачки в той же транзакции сохраняется processed_count. Пока задание выполняется, Heartbeat
+    обновляет heartbeat_at; задание без сигнала дольше PRICELIST_JOB_STALE_SECONDS считается
+    брошенным и продолжается другим обработчиком с первой незакоммиченной пачки, по тем же id.
+    Прежний обработчик, если он жив, на следующей пачке видит чужой locked_by, откатывает ее
+    и прекращает работу. Возвращает выполненное задание или None.
+    """
+    from apps.suppliers.jobs import Heartbeat, worker_name
+
+    worker_id = worker_id or worker_name()
+    cutoff = timezone.now() - timedelta(seconds=settings.PRICELIST_JOB_STALE_SECONDS)
+    with transaction.atomic():
+        job = (
+            ProductBatchUpdate.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(status=ProductBatchUpdate.STATUS_QUEUED)
+                | Q(status=ProductBatchUpdate.STATUS_RUNNING, heartbeat_at__lt=cutoff)
+                | Q(status=ProductBatchUpdate.STATUS_RUNNING, heartbeat_at__isnull=True)
+            )
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        if job.status == ProductBatchUpdate.STATUS_RUNNING:
+            logger.warning(f'Массовое обновление {job.id}: обработчик {job.locked_by} не отвечает, продолжаем '
+                           f'с товара {job.processed_count}')
+        if job.product_ids is None:
+            job.product_ids = list(
+                products_for_selection(job.selection).order_by('id').values_list('id', flat=True)
+            )
+        now = timezone.now()
+        job.status = ProductBatchUpdate.STATUS_RUNNING
+        job.locked_by = worker_id
+        job.heartbeat_at = now
+        job.started_at = job.started_at or now
+        job.save(update_fields=['product_ids', 'status', 'locked_by', 'heartbeat_at', 'started_at'])
+
+    owned = ProductBatchUpdate.objects.filter(
+        pk=job.pk, status=ProductBatchUpdate.STATUS_RUNNING, locked_by=worker_id
+    )
+
+    def chunk_done(position: int, rows: int):
+        if not owned.update(
+            processed_count=position, updated_count=F('updated_count') + rows, heartbeat_at=timezone.now()
+        ):
+            raise BatchUpdateLost(job.id)
+
+    try:
+        with Heartbeat(job):
+            update_products_by_ids(job.product_ids, job.changes, start=job.processed_count, on_chunk=chunk_done)
+    except BatchUpdateLost:
+        logger.warning(f'Массовое обновление {job.id} перехвачено другим обработчиком')
+        return None
+    except Exception as e:
+        logger.exception(f'Ошибка массового обновления товаров {job.id}')
+        owned.update(status=ProductBatchUpdate.STATUS_FAILED, error=str(e), finished_at=timezone.now())
+    else:
+        owned.update(status=ProductBatchUpdate.STATUS_DONE, finished_at=timezone.now())
+    job.refresh_from_db()
+    if job.status == ProductBatchUpdate.STATUS_DONE:
+        logger.info(f'Массовое обновление {job.id}: обновлено товаров {job.updated_count}')
+    return job
@@ -0,0 +1,245 @@
+"""
+Тесты массовых операций с товарами в админке
+"""
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.catalog.models import Category, Product, ProductBatchUpdate
+from apps.catalog import services
+from apps.catalog.services import run_pending_batch_update
+from apps.suppliers.models import Supplier
+
+
+class ProductBatchUpdateTestCase(TestCase):
+    """Массовое обновление без save() на каждый товар"""
+
+    def setUp(self):
+        self.supplier = Supplier.objects.create(name='ЕвроГипс', internal_code='EG', markup_som=10)
+        self.other = Supplier.objects.create(name='Стройдвор', internal_code='SD')
+        Product.objects.bulk_create([
+            Product(name=f'ГКЛ {i}', article=f'G{i}', supplier=self.other, base_price=100, final_price=100)
+            for i in range(30)
+        ] + [Product(name='Саморез', article='S1', supplier=self.other, base_price=2, final_price=2)])
+        admin = get_user_model().objects.create_user(
+            email='admin@example.com', password='testpass123', full_name='Admin', role='ADMIN'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=admin)
+
+    def test_markup_by_ids_uses_constant_queries(self):
+        ids = list(Product.objects.filter(name__startswith='ГКЛ').values_list('id', flat=True))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/catalog/products-admin/batch-update/', {
+                'product_ids': ids, 'markup_percent': '12.5', 'is_promotional': True,
+            }, format='json')
+
+        self.assertEqual((response.status_code, response.data['updated_count']), (200, 30))
+        self.assertLess(len(queries.captured_queries), 15)
+        self.assertEqual(
+            set(Product.objects.filter(id__in=ids).values_list('final_price', 'markup_percent', 'is_promotional')),
+            {(Decimal('112.50'), Decimal('12.50'), True)},
+        )
+        self.assertEqual(Product.objects.get(article='S1').final_price, Decimal('2.00'))
+
+    def test_select_all_by_filter_and_supplier_markup(self):
+        response = self.client.post('/api/catalog/products-admin/batch-update/', {
+            'select_all': True, 'filters': {'search': 'ГКЛ'}, 'supplier_id': self.supplier.id, 'is_active': False,
+        }, format='json')
+
+        self.assertEqual(response.data['updated_count'], 30)
+        # Цена пересчитана по наценке нового поставщика, хотя товары выпали из фильтра (is_active)
+        self.assertEqual(
+            set(Product.objects.filter(name__startswith='ГКЛ').values_list('supplier_id', 'final_price', 'is_active')),
+            {(self.supplier.id, Decimal('110.00'), False)},
+        )
+
+    @override_settings(PRODUCT_BATCH_UPDATE_SYNC_LIMIT=10, PRODUCT_BATCH_UPDATE_CHUNK_SIZE=7)
+    def test_large_selection_runs_in_background(self):
+        response = self.client.post('/api/catalog/products-admin/batch-update/', {
+            'select_all': True, 'filters': {'supplier_id': self.other.id}, 'markup_percent': 10,
+        }, format='json')
+
+        self.assertEqual((response.status_code, response.data['selected_count']), (202, 31))
+        self.assertEqual(Product.objects.filter(markup_percent=10).count(), 0)
+
+        job = run_pending_batch_update()
+        self.assertEqual((job.id, job.status, job.updated_count), (response.data['job_id'], 'DONE', 31))
+        self.assertEqual(Product.objects.get(article='S1').final_price, Decimal('2.20'))
+        self.assertIsNone(run_pending_batch_update())
+        status_response = self.client.get(f'/api/catalog/products-admin/batch-update/{job.id}/')
+        self.assertEqual(status_response.data['status'], ProductBatchUpdate.STATUS_DONE)
+
+    @override_settings(PRODUCT_BATCH_UPDATE_CHUNK_SIZE=7)
+    def test_abandoned_job_resumes_from_snapshot(self):
+        # Фильтр по is_active, который само обновление и меняет: повтор не должен терять товары
+        job = ProductBatchUpdate.objects.create(
+            selection={'filters': {'supplier_id': self.other.id, 'is_active': 'true'}},
+            changes={'is_active': False, 'markup_percent': 10},
+        )
+        selected = sorted(Product.objects.filter(supplier=self.other).values_list('id', flat=True))
+        # Первый обработчик зафиксировал выбор, закоммитил две пачки и умер
+        ProductBatchUpdate.objects.filter(pk=job.pk).update(
+            status=ProductBatchUpdate.STATUS_RUNNING, product_ids=selected, processed_count=14,
+            updated_count=14, locked_by='dead:1', started_at=timezone.now() - timedelta(hours=1),
+            heartbeat_at=timezone.now() - timedelta(hours=1),
+        )
+        done_at = timezone.now() - timedelta(hours=1)
+        Product.objects.filter(id__in=selected[:14]).update(is_active=False, markup_percent=10, updated_at=done_at)
+
+        job = run_pending_batch_update('alive:2')
+
+        self.assertEqual((job.status, job.processed_count, job.updated_count), ('DONE', 31, 31))
+        self.assertEqual(job.locked_by, 'alive:2')
+        self.assertFalse(Product.objects.filter(supplier=self.other, is_active=True).exists())
+        self.assertEqual(Product.objects.filter(markup_percent=10).count(), 31)
+        # Уже закоммиченные пачки не обновляются повторно
+        self.assertEqual(Product.objects.filter(id__in=selected[:14], updated_at=done_at).count(), 14)
+
+    def test_running_job_with_fresh_heartbeat_is_not_reclaimed(self):
+        job = ProductBatchUpdate.objects.create(
+            selection={'product_ids': [Product.objects.get(article='S1').id]}, changes={'is_promotional': True},
+            status=ProductBatchUpdate.STATUS_RUNNING, locked_by='busy:1',
+            started_at=timezone.now() - timedelta(hours=1), heartbeat_at=timezone.now(),
+        )
+        self.assertIsNone(run_pending_batch_update('other:2'))
+
+        ProductBatchUpdate.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        job = run_pending_batch_update('other:2')
+        self.assertEqual((job.status, job.updated_count), ('DONE', 1))
+        self.assertTrue(Product.objects.get(article='S1').is_promotional)
+
+    @override_settings(PRODUCT_BATCH_UPDATE_CHUNK_SIZE=7)
+    def test_reclaimed_job_stops_previous_worker(self):
+        job = ProductBatchUpdate.objects.create(
+            selection={'filters': {'supplier_id': self.other.id}}, changes={'markup_percent': 10},
+        )
+        original = services.update_products_by_ids
+
+        def taken_over(ids, changes, chunk_size=None, start=0, on_chunk=None):
+            # Пока первый обработчик работал, задание перехватил другой
+            ProductBatchUpdate.objects.filter(pk=job.pk).update(locked_by='other:2')
+            return original(ids, changes, chunk_size, start, on_chunk)
+
+        with mock.patch.object(services, 'update_products_by_ids', taken_over):
+            self.assertIsNone(run_pending_batch_update('slow:1'))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.processed_count), ('RUNNING', 'other:2', 0))
+        self.assertEqual(Product.objects.filter(markup_percent=10).count(), 0)
+
+
+class ProductCatalogListTestCase(TestCase):
+    """Каталог для клиентов: число запросов на страницу не зависит от числа товаров"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            email='client@example.com', password='testpass123', full_name='Client', role='CLIENT'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=user)
+        self.roofing = Category.objects.create(name='Кровля')
+
+    def _add_products(self, count, start=0):
+        for i in range(start, start + count):
+            supplier = Supplier.objects.create(name=f'Поставщик {i}', internal_code=f'S{i}')
+            category = Category.objects.create(name=f'Категория {i}', parent=self.roofing)
+            Product.objects.bulk_create([Product(name=f'Товар {i}', article=f'A{i}', supplier=supplier,
+                                                 category=category, base_price=100, final_price=110)])
+
+    def test_page_uses_constant_queries(self):
+        self._add_products(3)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get('/api/catalog/products/')
+        self._add_products(20, start=3)
+        # Одна выборка страницы вместе с поставщиком и категорией, без COUNT(*)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/catalog/products/')
+
+        self.assertEqual(len(few.captured_queries), 1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 23)
+        product = response.data['results'][0]
+        self.assertEqual(product['supplier'], {'id': product['supplier_id'], 'name': 'Поставщик 0'})
+        self.assertEqual(product['category']['parent'], self.roofing.id)
+        self.assertEqual(product['price'], 110.0)
+        self.assertNotIn('products_count', product['supplier'])
+
+    def test_search_uses_constant_queries(self):
+        self._add_products(5)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/catalog/search/', {'q': 'Товар'})
+        self.assertEqual(len(response.data['results']), 5)
+
+
+class ProductCatalogPaginationTestCase(TestCase):
+    """Keyset-пагинация: курсор по (поле сортировки, id) без OFFSET и COUNT(*)"""
+
+    def setUp(self):
+        supplier = Supplier.objects.create(name='ЕвроГипс', internal_code='EG')
+        # Повторяющиеся названия и цены - порядок внутри них задает id
+        Product.objects.bulk_create([
+            Product(name=f'Товар {i % 3}', article=f'A{i}', supplier=supplier,
+                    base_price=100, final_price=100 + i % 4, is_active=i != 7)
+            for i in range(11)
+        ])
+        admin = get_user_model().objects.create_user(
+            email='admin@example.com', password='testpass123', full_name='Admin', role='ADMIN'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=admin)
+
+    def _walk(self, url, params):
+        ids, pages = [], 0
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+            while True:
+                self.assertEqual(response.status_code, 200)
+                ids += [product['id'] for product in response.data['results']]
+                pages += 1
+                if not response.data['next']:
+                    break
+                response = self.client.get(response.data['next'])
+        # Ни OFFSET, ни COUNT(*) по списку товаров (счетчики вложенного поставщика админки - не пагинация)
+        for sql in (q['sql'] for q in queries.captured_queries):
+            self.assertNotIn('OFFSET', sql)
+            self.assertFalse('COUNT(' in sql and '"catalog_product"."is_active"' in sql, sql)
+        return ids, pages
+
+    def test_cursor_walks_every_ordering_with_ties(self):
+        # Товары одного импорта: время создания с разницей в 100 мкс, по два в одной микросекунде
+        started = timezone.now().replace(microsecond=0)
+        for i, pk in enumerate(Product.objects.order_by('id').values_list('id', flat=True)):
+            Product.objects.filter(pk=pk).update(created_at=started + timedelta(microseconds=100 * (i // 2)))
+        active = Product.objects.filter(is_active=True)
+
+        for field in ('name', 'final_price', 'created_at'):
+            for ordering in (field, f'-{field}'):
+                with self.subTest(ordering=ordering):
+                    ids, pages = self._walk('/api/catalog/products/', {'page_size': 3, 'ordering': ordering})
+                    key = (ordering, '-id' if ordering.startswith('-') else 'id')
+                    self.assertEqual(ids, list(active.order_by(*key).values_list('id', flat=True)))
+                    self.assertEqual(pages, 4)
+
+    def test_admin_list_uses_cursor_and_keeps_page_numbers(self):
+        ids, _ = self._walk('/api/catalog/products-admin/', {'page_size': 4, 'ordering': '-name'})
+        self.assertEqual(ids, list(Product.objects.filter(is_active=True).order_by('-name', '-id')
+                                   .values_list('id', flat=True)))
+
+        # С page - прежняя постраничная выдача с точным count
+        response = self.client.get('/api/catalog/products-admin/', {'page': 1})
+        self.assertEqual(response.data['count'], 10)
+
+    def test_optional_count_and_invalid_cursor(self):
+        response = self.client.get('/api/catalog/products/', {'with_count': 'true', 'is_promotional': 'false'})
+        self.assertEqual((response.data['count'], response.data['count_is_estimate']), (10, True))
+        self.assertNotIn('count', self.client.get('/api/catalog/products/').data)
+        self.assertEqual(self.client.get('/api/catalog/products/', {'cursor': 'мусор'}).status_code, 404)
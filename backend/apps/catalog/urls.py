@@ -12,9 +12,11 @@ router.register(r'categories', CategoryViewSet, basename='category')
 app_name = 'catalog'
 
 urlpatterns = [
+    # Массовые операции - ДО include(router.urls): иначе batch-update забирает маршрут products-admin/<pk>/
+    path('products-admin/batch-update/', ProductBatchUpdateView.as_view(), name='products-batch-update'),
+    path('products-admin/batch-update/<int:pk>/', ProductBatchUpdateView.as_view(), name='products-batch-update-status'),
+    path('products-admin/batch-delete/', ProductBatchDeleteView.as_view(), name='products-batch-delete'),
     path('', include(router.urls)),
     path('products/', ProductListView.as_view(), name='products'),
     path('search/', ProductSearchView.as_view(), name='search'),
-    path('products-admin/batch-update/', ProductBatchUpdateView.as_view(), name='products-batch-update'),
-    path('products-admin/batch-delete/', ProductBatchDeleteView.as_view(), name='products-batch-delete'),
 ]
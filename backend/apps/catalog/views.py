@@ -4,14 +4,20 @@ from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
+from django.conf import settings
 from django.db import models
+from decimal import Decimal, InvalidOperation
+from apps.suppliers.models import Supplier
 from apps.users.permissions import IsAdminRole
-from .models import Product, Category
-from .serializers import ProductSerializer, ProductAdminSerializer, ProductCreateUpdateSerializer, CategorySerializer
+from .models import Product, Category, ProductBatchUpdate
+from .pagination import ProductCursorPagination
+from .services import batch_update_products, filter_admin_products, products_for_selection
+from .serializers import ProductCatalogSerializer, ProductAdminSerializer, ProductCreateUpdateSerializer, CategorySerializer
 
 
 class ProductViewSet(ModelViewSet):
     permission_classes = [IsAdminRole]
+    pagination_class = ProductCursorPagination
 
     def get_serializer_class(self):
         if self.action in ['create', 'update', 'partial_update']:
@@ -20,50 +26,10 @@ class ProductViewSet(ModelViewSet):
         return ProductAdminSerializer
 
     def get_queryset(self):
-        # По умолчанию показываем только активные товары (как для клиентов)
-        # Админ может увидеть неактивные, если явно передаст is_active=false
-        queryset = Product.objects.filter(is_active=True)
-        
-        # Поиск по названию и артикулу
-        search = self.request.query_params.get('search', None)
-        if search:
-            queryset = queryset.filter(
-                models.Q(name__icontains=search) | models.Q(article__icontains=search)
-            )
-        
-        # Фильтрация по рекомендованным товарам
-        is_recommended = self.request.query_params.get('is_recommended', None)
-        if is_recommended is not None:
-            queryset = queryset.filter(is_recommended=is_recommended.lower() == 'true')
-        
-        # Фильтрация по акционным товарам
-        is_promotional = self.request.query_params.get('is_promotional', None)
-        if is_promotional is not None:
-            queryset = queryset.filter(is_promotional=is_promotional.lower() == 'true')
-        
-        # Фильтрация по активности (админ может показать неактивные, передав is_active=false)
-        is_active = self.request.query_params.get('is_active', None)
-        if is_active is not None:
-            if is_active.lower() == 'false':
-                # Если явно запрошены неактивные, показываем все
-                queryset = Product.objects.all()
-                # Применяем остальные фильтры
-                if search:
-                    queryset = queryset.filter(
-                        models.Q(name__icontains=search) | models.Q(article__icontains=search)
-                    )
-                if is_recommended is not None:
-                    queryset = queryset.filter(is_recommended=is_recommended.lower() == 'true')
-                if is_promotional is not None:
-                    queryset = queryset.filter(is_promotional=is_promotional.lower() == 'true')
-            elif is_active.lower() == 'true':
-                queryset = queryset.filter(is_active=True)
-        
-        # Фильтрация по поставщику
-        supplier_id = self.request.query_params.get('supplier_id', None)
-        if supplier_id:
-            queryset = queryset.filter(supplier_id=supplier_id)
-        
+        # По умолчанию показываем только активные товары (как для клиентов);
+        # админ может увидеть неактивные, если явно передаст is_active=false
+        queryset = filter_admin_products(self.request.query_params)
+
         # Сортировка по умолчанию - по названию (алфавит)
         ordering = self.request.query_params.get('ordering', 'name')
         if ordering:
@@ -76,11 +42,13 @@ class ProductViewSet(ModelViewSet):
 
 class ProductListView(ListAPIView):
     """Публичный список товаров для клиентов (показывает final_price - цена с наценкой)"""
-    serializer_class = ProductSerializer  # Для клиентов используем ProductSerializer (показывает final_price)
+    serializer_class = ProductCatalogSerializer  # Плоский товар без агрегатов поставщика (показывает final_price)
     permission_classes = [IsAuthenticated]
+    # Курсор по (name, id) вместо OFFSET и COUNT(*); с параметром page - постранично, как раньше
+    pagination_class = ProductCursorPagination
 
     def get_queryset(self):
-        queryset = Product.objects.filter(is_active=True)
+        queryset = Product.objects.filter(is_active=True).select_related('category', 'supplier')
         
         # Фильтрация по рекомендованным товарам
         is_recommended = self.request.query_params.get('is_recommended', None)
@@ -114,12 +82,12 @@ class ProductSearchView(APIView):
         # Пока простой поиск по названию и артикулу
         products = Product.objects.filter(
             is_active=True
-        ).filter(
+        ).select_related('category', 'supplier').filter(
             models.Q(name__icontains=query) | models.Q(article__icontains=query)
         )[:10]
         
-        # Для поиска клиентов используем ProductSerializer (показывает final_price)
-        serializer = ProductSerializer(products, many=True)
+        # Для поиска клиентов - тот же плоский товар, что и в каталоге (показывает final_price)
+        serializer = ProductCatalogSerializer(products, many=True)
         return Response({'results': serializer.data})
 
 
@@ -130,81 +98,86 @@ class CategoryViewSet(ModelViewSet):
 
 
 class ProductBatchUpdateView(APIView):
-    """Массовое обновление товаров"""
+    """
+    Массовое обновление товаров: явные product_ids или select_all с filters (фильтры списка админки).
+    Поля и final_price обновляются несколькими UPDATE без save() на каждый товар; выбор больше
+    PRODUCT_BATCH_UPDATE_SYNC_LIMIT товаров уходит обработчику очереди (ответ 202 с job_id).
+    """
     permission_classes = [IsAdminRole]
 
-    def post(self, request):
-        product_ids = request.data.get('product_ids', [])
-        if not product_ids:
-            return Response(
-                {'error': 'Не указаны ID товаров'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+    def get(self, request, pk):
+        """Состояние отложенного массового обновления"""
+        job = ProductBatchUpdate.objects.filter(pk=pk).values(
+            'id', 'status', 'processed_count', 'updated_count', 'error', 'created_at', 'started_at', 'finished_at',
+        ).first()
+        if job is None:
+            return Response({'error': 'Задание не найдено'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job)
 
-        # Получаем товары
-        products = Product.objects.filter(id__in=product_ids)
-        if not products.exists():
-            return Response(
-                {'error': 'Товары не найдены'},
-                status=status.HTTP_404_NOT_FOUND
-            )
+    def post(self, request):
+        if request.data.get('select_all'):
+            filters = request.data.get('filters') or {}
+            if not isinstance(filters, dict):
+                return Response({'error': 'filters должен быть объектом'}, status=status.HTTP_400_BAD_REQUEST)
+            selection = {'filters': filters}
+        else:
+            product_ids = request.data.get('product_ids', [])
+            if not product_ids:
+                return Response(
+                    {'error': 'Не указаны ID товаров'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            selection = {'product_ids': product_ids}
 
         # Параметры для обновления
-        update_data = {}
-        
+        changes = {}
+
         # Наценка
         if 'markup_percent' in request.data:
             markup_percent = request.data.get('markup_percent')
             if markup_percent is not None:
-                update_data['markup_percent'] = markup_percent
-        
+                try:
+                    changes['markup_percent'] = str(Decimal(str(markup_percent)))
+                except InvalidOperation:
+                    return Response({'error': 'Неверная наценка'}, status=status.HTTP_400_BAD_REQUEST)
+
         # Поставщик
         if 'supplier_id' in request.data:
             supplier_id = request.data.get('supplier_id')
             if supplier_id:
-                from apps.suppliers.models import Supplier
-                try:
-                    supplier = Supplier.objects.get(id=supplier_id)
-                    update_data['supplier'] = supplier
-                except Supplier.DoesNotExist:
+                if not Supplier.objects.filter(id=supplier_id).exists():
                     return Response(
                         {'error': 'Поставщик не найден'},
                         status=status.HTTP_404_NOT_FOUND
                     )
+                changes['supplier_id'] = supplier_id
             elif supplier_id is None:
-                update_data['supplier'] = None
-        
+                changes['supplier_id'] = None
+
         # Метки
-        if 'is_recommended' in request.data:
-            update_data['is_recommended'] = request.data.get('is_recommended')
-        
-        if 'is_promotional' in request.data:
-            update_data['is_promotional'] = request.data.get('is_promotional')
-        
-        if 'is_active' in request.data:
-            update_data['is_active'] = request.data.get('is_active')
-
-        # Обновляем товары
-        # Если обновляется наценка, нужно пересчитать final_price
-        if 'markup_percent' in update_data:
-            # Обновляем через цикл, чтобы вызвать save() и пересчитать final_price
-            updated_count = 0
-            for product in products:
-                product.markup_percent = update_data['markup_percent']
-                if 'supplier' in update_data:
-                    product.supplier = update_data['supplier']
-                if 'is_recommended' in update_data:
-                    product.is_recommended = update_data['is_recommended']
-                if 'is_promotional' in update_data:
-                    product.is_promotional = update_data['is_promotional']
-                if 'is_active' in update_data:
-                    product.is_active = update_data['is_active']
-                product.save()  # Это вызовет пересчет final_price в методе save()
-                updated_count += 1
-        else:
-            # Для остальных обновлений можно использовать bulk_update
-            updated_count = products.update(**update_data)
+        for field in ('is_recommended', 'is_promotional', 'is_active'):
+            if field in request.data:
+                changes[field] = request.data.get(field)
 
+        products = products_for_selection(selection)
+        count = products.count()
+        if not count:
+            return Response(
+                {'error': 'Товары не найдены'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        if not changes:
+            return Response({'error': 'Не указаны поля для обновления'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if count > settings.PRODUCT_BATCH_UPDATE_SYNC_LIMIT:
+            job = ProductBatchUpdate.objects.create(selection=selection, changes=changes)
+            return Response({
+                'message': f'Обновление {count} товаров поставлено в очередь',
+                'job_id': job.id,
+                'selected_count': count,
+            }, status=status.HTTP_202_ACCEPTED)
+
+        updated_count = batch_update_products(products, changes)
         return Response({
             'message': f'Обновлено товаров: {updated_count}',
             'updated_count': updated_count
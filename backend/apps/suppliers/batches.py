@@ -0,0 +1,159 @@
+"""
+Компактное представление распознанных товаров прайс-листа.
+
+Вместо словаря на каждую строку товары хранятся по колонкам: названия и артикулы -
+списки строк, цены - array('d'), единицы и категории - коды в array('i') по общей
+для всего прайс-листа таблице строк (StringTable). Повторяющиеся категории и единицы
+хранятся один раз. Словари (формат parse()['products']) собираются только на выходе
+(API, parse()) через ProductBatch.to_dicts().
+"""
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+NO_CODE = -1
+
+ProductRow = Tuple[str, str, Optional[str], float, Optional[str]]
+
+
+class StringTable:
+    """Таблица интернированных строк: строка <-> целочисленный код"""
+
+    __slots__ = ('values', '_codes')
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def code(self, value: Optional[str]) -> int:
+        if value is None:
+            return NO_CODE
+        if isinstance(value, list):
+            # Путь категории после JSON приходит списком
+            value = tuple(value)
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+    def value(self, code: int) -> Optional[str]:
+        return None if code == NO_CODE else self.values[code]
+
+
+class ProductBatch:
+    """
+    Пачка товаров по колонкам: name, article, unit, price, category.
+
+    Пачки одного прайс-листа разделяют таблицы units и categories, поэтому
+    одинаковые значения в разных пачках не дублируются.
+    """
+
+    __slots__ = ('names', 'articles', 'unit_codes', 'prices', 'category_codes', 'units', 'categories')
+
+    FIELDS = ('name', 'article', 'unit', 'price', 'category')
+
+    def __init__(self, units: Optional[StringTable] = None, categories: Optional[StringTable] = None):
+        self.names: List[str] = []
+        self.articles: List[str] = []
+        self.unit_codes = array('i')
+        self.prices = array('d')
+        self.category_codes = array('i')
+        self.units = units if units is not None else StringTable()
+        self.categories = categories if categories is not None else StringTable()
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def append(self, name: str, article: str, unit: Optional[str], price: float, category: Optional[str]):
+        self.names.append(name)
+        self.articles.append(article)
+        self.unit_codes.append(self.units.code(unit))
+        self.prices.append(price)
+        self.category_codes.append(self.categories.code(category))
+
+    def empty_like(self) -> 'ProductBatch':
+        """Пустая пачка с теми же таблицами строк"""
+        return ProductBatch(self.units, self.categories)
+
+    def extend(self, other: 'ProductBatch'):
+        if other.units is self.units and other.categories is self.categories:
+            self.names.extend(other.names)
+            self.articles.extend(other.articles)
+            self.unit_codes.extend(other.unit_codes)
+            self.prices.extend(other.prices)
+            self.category_codes.extend(other.category_codes)
+        else:
+            for row in other.rows():
+                self.append(*row)
+
+    def __getitem__(self, index: slice) -> 'ProductBatch':
+        if not isinstance(index, slice):
+            raise TypeError('ProductBatch поддерживает только срезы')
+        batch = self.empty_like()
+        batch.names = self.names[index]
+        batch.articles = self.articles[index]
+        batch.unit_codes = self.unit_codes[index]
+        batch.prices = self.prices[index]
+        batch.category_codes = self.category_codes[index]
+        return batch
+
+    def rows(self) -> Iterator[ProductRow]:
+        """Строки (name, article, unit, price, category)"""
+        unit = self.units.value
+        category = self.categories.value
+        for name, article, unit_code, price, category_code in zip(
+            self.names, self.articles, self.unit_codes, self.prices, self.category_codes
+        ):
+            yield name, article, unit(unit_code), price, category(category_code)
+
+    def category_names(self) -> List[str]:
+        """Категории, встречающиеся в пачке (каждая один раз)"""
+        return [self.categories.values[code] for code in set(self.category_codes) if code != NO_CODE]
+
+    def to_dicts(self) -> List[Dict]:
+        """Товары в формате parse()['products']"""
+        return [dict(zip(self.FIELDS, row)) for row in self.rows()]
+
+    @classmethod
+    def from_dicts(cls, products: Iterable[Dict], units: Optional[StringTable] = None,
+                   categories: Optional[StringTable] = None) -> 'ProductBatch':
+        """Пачка из словарей формата parse()['products'] (отсутствующий артикул - пустая строка)"""
+        batch = cls(units, categories)
+        for product in products:
+            batch.append(
+                product.get('name') or '',
+                product.get('article') or '',
+                product.get('unit', 'шт'),
+                _to_float(product.get('price')),
+                product.get('category'),
+            )
+        return batch
+
+    def to_columns(self) -> Dict[str, list]:
+        """Колонки для сериализации (кэш парсинга)"""
+        return {
+            'name': self.names,
+            'article': self.articles,
+            'unit': [self.units.value(code) for code in self.unit_codes],
+            'price': self.prices.tolist(),
+            'category': [self.categories.value(code) for code in self.category_codes],
+        }
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, list], units: Optional[StringTable] = None,
+                     categories: Optional[StringTable] = None) -> 'ProductBatch':
+        batch = cls(units, categories)
+        batch.names = list(columns['name'])
+        batch.articles = list(columns['article'])
+        batch.unit_codes = array('i', map(batch.units.code, columns['unit']))
+        batch.prices = array('d', columns['price'])
+        batch.category_codes = array('i', map(batch.categories.code, columns['category']))
+        return batch
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
@@ -0,0 +1,432 @@
+"""
+Очередь фоновой обработки прайс-листов.
+
+Задания хранятся в таблице PriceListJob и забираются обработчиками
+(manage.py run_pricelist_worker) через SELECT ... FOR UPDATE SKIP LOCKED.
+Одновременно выполняется не больше одного задания на поставщика, упавшие задания
+повторяются с экспоненциальной задержкой, задания обработчика, переставшего
+подавать сигналы (перезапуск, OOM), возвращаются в очередь.
+
+Отмена (cancel_price_list) снимает задание из очереди сразу, а у выполняющегося
+выставляет cancel_requested: обработчик проверяет флаг на границах пачек и между
+листами, откатывает только текущую пачку и завершает задание со статусом CANCELLED.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from apps.catalog.services import run_pending_batch_update
+
+from .models import PriceList, PriceListJob
+from .parse_cache import ParseCache, file_sha256
+from .parse_pool import parse_isolated, parse_sheets, shutdown_executor
+from .parsers import CsvPriceListParser, ExcelPriceListParser, PdfPriceListParser
+from .pricing import run_pending_recompute
+from .progress import ImportProgress
+from .services import ImportCancelled, PriceListImporter, format_import_log, prefetch, save_detected_layout
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRY_DELAY = 3600
+
+# Парсеры по PriceList.parsing_method
+PARSERS = {
+    'EXCEL': ExcelPriceListParser,
+    'CSV': CsvPriceListParser,
+    'PDF': PdfPriceListParser,
+}
+
+
+def worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def enqueue_price_list(price_list: PriceList) -> PriceListJob:
+    """
+    Ставит прайс-лист в очередь обработки и возвращает задание.
+    Если для прайс-листа уже есть активное задание - возвращается оно.
+    """
+    with transaction.atomic():
+        PriceList.objects.select_for_update().filter(pk=price_list.pk).first()
+        job = PriceListJob.objects.filter(
+            price_list=price_list, status__in=PriceListJob.ACTIVE_STATUSES
+        ).first()
+        if job is None:
+            job = PriceListJob.objects.create(
+                price_list=price_list,
+                supplier_id=price_list.supplier_id,
+                max_attempts=settings.PRICELIST_JOB_MAX_ATTEMPTS,
+            )
+            price_list.status = 'PROCESSING'
+            price_list.log = 'В очереди на обработку'
+            # Новое задание импортирует файл с начала; повторы того же задания продолжают с контрольной точки
+            price_list.import_checkpoint = 0
+            price_list.import_summary = {}
+            price_list.parse_progress = {}
+            price_list.progress = {'phase': ImportProgress.PHASE_QUEUED}
+            price_list.save(update_fields=[
+                'status', 'log', 'import_checkpoint', 'import_summary', 'parse_progress', 'progress',
+            ])
+    logger.info(f'Прайс-лист {price_list.id} поставлен в очередь, задание {job.id}')
+    return job
+
+
+def enqueue_orphaned_price_lists() -> int:
+    """Прайс-листы в статусе PROCESSING без активного задания (например, после падения потоков старой схемы)"""
+    orphaned = PriceList.objects.filter(status='PROCESSING').exclude(
+        jobs__status__in=PriceListJob.ACTIVE_STATUSES
+    )
+    count = 0
+    for price_list in orphaned:
+        enqueue_price_list(price_list)
+        count += 1
+    return count
+
+
+def claim_job(worker_id: str) -> Optional[PriceListJob]:
+    """
+    Забирает следующее готовое задание. Задания, заблокированные другими обработчиками,
+    пропускаются (SKIP LOCKED); поставщики, у которых уже выполняется задание, - тоже.
+    Гонку двух обработчиков за одного поставщика закрывает частичный уникальный индекс.
+    """
+    now = timezone.now()
+    running_suppliers = PriceListJob.objects.filter(
+        status=PriceListJob.STATUS_RUNNING
+    ).values('supplier_id')
+
+    with transaction.atomic():
+        job = (
+            PriceListJob.objects.select_for_update(skip_locked=True)
+            .filter(status=PriceListJob.STATUS_QUEUED, run_after__lte=now)
+            .exclude(supplier_id__in=running_suppliers)
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = PriceListJob.STATUS_RUNNING
+        job.attempts += 1
+        job.locked_by = worker_id
+        job.started_at = now
+        job.heartbeat_at = now
+        try:
+            with transaction.atomic():
+                job.save(update_fields=['status', 'attempts', 'locked_by', 'started_at', 'heartbeat_at'])
+        except IntegrityError:
+            logger.info(f'Поставщик задания {job.id} уже обрабатывается другим обработчиком')
+            return None
+    return job
+
+
+def retry_delay(attempts: int) -> int:
+    """Задержка перед повтором в секундах: backoff * 2^(попытка - 1), не больше часа"""
+    return min(settings.PRICELIST_JOB_RETRY_BACKOFF * 2 ** max(attempts - 1, 0), MAX_RETRY_DELAY)
+
+
+def fail_job(job: PriceListJob, error: str, retry: bool = True):
+    """Возвращает задание в очередь с задержкой или, если попытки исчерпаны, помечает FAILED"""
+    now = timezone.now()
+    active = PriceListJob.objects.filter(
+        pk=job.pk, status=PriceListJob.STATUS_RUNNING, locked_by=job.locked_by
+    )
+    if retry and job.attempts < job.max_attempts:
+        delay = retry_delay(job.attempts)
+        if active.update(
+            status=PriceListJob.STATUS_QUEUED,
+            run_after=now + timedelta(seconds=delay),
+            locked_by='',
+            heartbeat_at=None,
+            last_error=error,
+        ):
+            PriceList.objects.filter(pk=job.price_list_id).update(
+                status='PROCESSING',
+                log=f'Попытка {job.attempts} из {job.max_attempts} не удалась: {error}. Повтор через {delay} с',
+            )
+            logger.warning(f'Задание {job.id} вернется в очередь через {delay} с: {error}')
+        return
+
+    if active.update(status=PriceListJob.STATUS_FAILED, finished_at=now, last_error=error):
+        PriceList.objects.filter(pk=job.price_list_id).update(status='FAILED', log=error)
+        logger.error(f'Задание {job.id} завершилось ошибкой после {job.attempts} попыток: {error}')
+
+
+def cancel_job(job: PriceListJob, log: str) -> bool:
+    """Помечает активное задание и его прайс-лист отмененными; False - задание уже не активно"""
+    now = timezone.now()
+    cancelled = PriceListJob.objects.filter(pk=job.pk, status__in=PriceListJob.ACTIVE_STATUSES).update(
+        status=PriceListJob.STATUS_CANCELLED, finished_at=now, locked_by='', heartbeat_at=None,
+    )
+    if cancelled:
+        PriceList.objects.filter(pk=job.price_list_id).update(status='CANCELLED', log=log)
+        logger.info(f'Задание {job.id} отменено: {log}')
+    return bool(cancelled)
+
+
+def cancel_price_list(price_list: PriceList) -> Optional[PriceListJob]:
+    """
+    Отменяет обработку прайс-листа. Задание из очереди отменяется сразу, у выполняющегося
+    выставляется cancel_requested - обработчик остановится на границе пачки.
+    Возвращает задание или None, если прайс-лист не обрабатывается.
+    """
+    with transaction.atomic():
+        job = (
+            PriceListJob.objects.select_for_update()
+            .filter(price_list=price_list, status__in=PriceListJob.ACTIVE_STATUSES)
+            .first()
+        )
+        if job is None:
+            return None
+        if job.status == PriceListJob.STATUS_QUEUED:
+            cancel_job(job, 'Обработка отменена до начала')
+            job.refresh_from_db()
+        elif not job.cancel_requested:
+            job.cancel_requested = True
+            job.save(update_fields=['cancel_requested'])
+            PriceList.objects.filter(pk=price_list.pk).update(log='Запрошена отмена обработки')
+    return job
+
+
+def cancellation_check(job: PriceListJob):
+    """Функция для парсера и импорта: бросает ImportCancelled, если для задания запрошена отмена"""
+
+    def check_cancelled():
+        if PriceListJob.objects.filter(pk=job.pk, cancel_requested=True).exists():
+            raise ImportCancelled()
+
+    return check_cancelled
+
+
+def cancelled_log(error: ImportCancelled) -> str:
+    """Строка для PriceList.log отмененной обработки: что уже успели записать"""
+    summary = error.summary
+    return (
+        f"Обработка отменена. Уже записано строк: {error.rows_written} "
+        f"(создано: {summary.get('created', 0)}, обновлено: {summary.get('updated', 0)}, "
+        f"без изменений: {summary.get('unchanged', 0)})"
+    )
+
+
+def recover_stale_jobs() -> int:
+    """
+    Задания RUNNING без сигнала дольше PRICELIST_JOB_STALE_SECONDS считаются упавшими;
+    если для них была запрошена отмена - отменяются, а не повторяются.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.PRICELIST_JOB_STALE_SECONDS)
+    with transaction.atomic():
+        stale = list(
+            PriceListJob.objects.select_for_update(skip_locked=True)
+            .filter(status=PriceListJob.STATUS_RUNNING, heartbeat_at__lt=cutoff)
+        )
+        for job in stale:
+            if job.cancel_requested:
+                cancel_job(job, 'Обработка отменена')
+            else:
+                fail_job(job, f'Обработчик {job.locked_by} перестал отвечать')
+    return len(stale)
+
+
+class Heartbeat:
+    """
+    Фоновый поток, обновляющий heartbeat_at задания, пока оно выполняется.
+    Подходит для любой модели заданий с полями status, locked_by, heartbeat_at и STATUS_RUNNING
+    (PriceListJob, ProductBatchUpdate).
+    """
+
+    def __init__(self, job, interval: Optional[float] = None):
+        self.job = job
+        self.interval = interval or settings.PRICELIST_JOB_HEARTBEAT_INTERVAL
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                model = type(self.job)
+                model.objects.filter(
+                    pk=self.job.pk, status=model.STATUS_RUNNING, locked_by=self.job.locked_by
+                ).update(heartbeat_at=timezone.now())
+        except Exception as e:
+            logger.error(f'Ошибка обновления сигнала задания {self.job.id}: {str(e)}')
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def report_sheet_progress(pl: PriceList, progress: Dict):
+    """Ход многолистового парсинга в PriceList.parse_progress и лог"""
+    pl.parse_progress = progress
+    pl.log = f'Разобрано листов: {progress["sheets_done"]} из {progress["sheets_total"]}'
+    PriceList.objects.filter(pk=pl.pk).update(parse_progress=progress, log=pl.log)
+
+
+def process_price_list(pl_id: int, job: Optional[PriceListJob] = None):
+    """
+    Парсинг файла прайс-листа и импорт товаров. Исключения пробрасываются в обработчик очереди;
+    если для задания job запрошена отмена - ImportCancelled.
+
+    Парсинг идет вне транзакции в отдельном потоке и отдает товары пачками через
+    ограниченную очередь (prefetch), импорт пишет их по мере поступления короткими
+    транзакциями (PriceListImporter.run_stream). Так первая запись в БД не ждет конца
+    файла, строки каталога не блокируются на все время импорта, а повтор задания
+    продолжает с последней закоммиченной пачки.
+    """
+    pl = PriceList.objects.select_related('supplier').get(pk=pl_id)
+
+    # Получаем путь к файлу
+    try:
+        file_path = pl.file.path
+    except Exception:
+        # Если .path не работает, используем .name и получаем полный путь
+        file_path = os.path.join(settings.MEDIA_ROOT, pl.file.name)
+
+    # Проверяем метод парсинга
+    parsing_method = pl.parsing_method or 'EXCEL'
+
+    parser_class = PARSERS.get(parsing_method)
+    if parser_class is not None:
+        if not pl.file_hash:
+            pl.file_hash = file_sha256(file_path)
+            pl.save(update_fields=['file_hash'])
+
+        check_cancelled = cancellation_check(job) if job is not None else None
+        logger.info(f'Начинаем парсинг файла: {file_path}')
+        progress = ImportProgress(pl.id)
+        progress.start_phase(ImportProgress.PHASE_PARSE)
+        parser = parser_class.for_supplier(file_path, pl.supplier)
+        # Парсинг в дочернем процессе с лимитами памяти и времени (parse_pool)
+        if parser.sheets:
+            stream = parse_sheets(
+                parser, pl.file_hash,
+                on_progress=lambda progress: report_sheet_progress(pl, progress),
+                check_cancelled=check_cancelled,
+            )
+        else:
+            stream = parse_isolated(parser, pl.file_hash)
+        cache_hit = stream.cache_hit
+        progress.track(stream)
+
+        # Импортируем товары в базу данных по мере парсинга
+        summary = PriceListImporter(pl.supplier, pl, progress=progress, check_cancelled=check_cancelled).run_stream(
+            prefetch(stream, settings.PRICELIST_PIPELINE_QUEUE_CHUNKS, on_wait=check_cancelled),
+            categories=lambda: stream.categories,
+            resume=True,
+            source=stream.key,
+        )
+        imported_count = summary['total']
+        found_count = stream.total_products
+        # При попадании в кэш парсер не запускался и раскладки нет
+        save_detected_layout(pl.supplier, parser.detected_layout)
+        logger.info(f'Парсинг завершен{" (из кэша)" if cache_hit else ""}. Найдено товаров: {found_count}, категорий: {len(stream.categories)}')
+
+        pl.status = 'PROCESSED'
+        pl.processed_at = timezone.now()
+        pl.products_count = imported_count
+        progress.finish()
+        rate = progress.rows_per_sec()
+        pl.log = (
+            f'{format_import_log(found_count, summary)}. Кэш парсинга: {"попадание" if cache_hit else "промах"}'
+            + (f'. Скорость импорта: {rate:.0f} строк/с' if rate else '')
+        )
+        # Только эти поля: контрольную точку и ход обработки уже записал импорт
+        pl.save(update_fields=['status', 'processed_at', 'products_count', 'log'])
+
+        logger.info(f'Прайс-лист {pl_id} успешно обработан. Импортировано товаров: {imported_count}')
+    else:
+        # Для других методов парсинга пока не реализовано
+        pl.status = 'PROCESSED'
+        pl.processed_at = timezone.now()
+        pl.products_count = 0
+        pl.log = f"Метод парсинга {parsing_method} пока не реализован"
+        pl.save(update_fields=['status', 'processed_at', 'products_count', 'log'])
+        logger.warning(f'Метод парсинга {parsing_method} не реализован для прайс-листа {pl_id}')
+
+
+def run_job(job: PriceListJob):
+    """Выполняет забранное задание и фиксирует результат"""
+    logger.info(f'Задание {job.id}: обработка прайс-листа {job.price_list_id}, попытка {job.attempts}')
+    try:
+        with Heartbeat(job):
+            process_price_list(job.price_list_id, job)
+    except ImportCancelled as e:
+        cancel_job(job, cancelled_log(e))
+    except PriceList.DoesNotExist:
+        fail_job(job, f'Прайс-лист {job.price_list_id} не найден в базе данных', retry=False)
+    except Exception as e:
+        logger.exception(f'Ошибка обработки прайс-листа {job.price_list_id}')
+        fail_job(job, str(e))
+    else:
+        PriceListJob.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+            status=PriceListJob.STATUS_DONE, finished_at=timezone.now(), last_error=''
+        )
+
+
+def prune_parse_cache(last_run: Optional[float] = None) -> float:
+    """
+    Чистка кэша парсинга (ParseCache.prune), если с прошлой прошло больше
+    PRICELIST_PARSE_CACHE_PRUNE_INTERVAL. Возвращает время последней чистки (time.monotonic).
+    """
+    now = time.monotonic()
+    if last_run is not None and now - last_run < settings.PRICELIST_PARSE_CACHE_PRUNE_INTERVAL:
+        return last_run
+    try:
+        ParseCache().prune()
+    except OSError as e:
+        logger.error(f'Ошибка очистки кэша парсинга: {str(e)}')
+    return now
+
+
+def run_worker(stop_event: threading.Event, poll_interval: Optional[float] = None, once: bool = False):
+    """
+    Цикл обработчика: восстановление зависших заданий, затем выполнение готовых;
+    между заданиями - отложенные пересчеты цен после смены наценки (pricing) и
+    массовые обновления товаров из админки, при пустой очереди - чистка кэша парсинга.
+    Останавливается после текущего задания, когда выставлен stop_event.
+    """
+    poll_interval = poll_interval or settings.PRICELIST_WORKER_POLL_INTERVAL
+    worker_id = worker_name()
+    logger.info(f'Обработчик прайс-листов {worker_id} запущен')
+    cache_pruned_at = None
+
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            recovered = recover_stale_jobs()
+            if recovered:
+                logger.warning(f'Возвращено в очередь зависших заданий: {recovered}')
+            job = claim_job(worker_id)
+        except Exception as e:
+            logger.error(f'Ошибка получения задания из очереди: {str(e)}')
+            job = None
+
+        if job is not None:
+            run_job(job)
+            continue
+        try:
+            if run_pending_recompute() is not None or run_pending_batch_update(worker_id) is not None:
+                continue
+        except Exception as e:
+            logger.error(f'Ошибка отложенного обновления цен и товаров: {str(e)}')
+        if once:
+            break
+        cache_pruned_at = prune_parse_cache(cache_pruned_at)
+        stop_event.wait(poll_interval)
+
+    shutdown_executor()
+    connection.close()
+    logger.info(f'Обработчик прайс-листов {worker_id} остановлен')
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from apps.suppliers.pricing import apply_pricing, preview_pricing
+
+
+class Command(BaseCommand):
+    help = 'Пересчет итоговых цен всего каталога по активным правилам наценки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, сколько цен изменится и как изменится наценка')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Ширина диапазона id на один UPDATE (по умолчанию SUPPLIER_PRICE_RECOMPUTE_BATCH_SIZE)')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            preview = preview_pricing()
+            for group in preview['by_rule']:
+                self.stdout.write(
+                    f"{group['rule_name']}: товаров {group['products']}, изменится {group['changed']}, "
+                    f"наценка {group['margin_before']} -> {group['margin_after']} ({group['margin_delta']:+})"
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f"Итого: товаров {preview['products']}, изменится {preview['changed']}, "
+                f"наценка {preview['margin_before']} -> {preview['margin_after']} ({preview['margin_delta']:+})"
+            ))
+            return
+
+        summary = apply_pricing(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Пересчитано цен: {summary['rows']} (правил {summary['rules']}, запросов {summary['batches']}, "
+            f"{summary['seconds']} с)"
+        ))
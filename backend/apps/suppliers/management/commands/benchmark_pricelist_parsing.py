@@ -0,0 +1,234 @@
+import csv
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import openpyxl
+from openpyxl.styles import PatternFill
+from django.core.management.base import BaseCommand, CommandError
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import PageBreak, SimpleDocTemplate, Table, TableStyle
+
+from apps.suppliers.batches import ProductBatch, StringTable
+from apps.suppliers.parsers import (
+    CsvPriceListParser, ExcelPriceListParser, PdfPriceListParser, PRODUCT_CHUNK_SIZE,
+)
+
+
+UNITS = ['шт', 'м2', 'м²', 'кг', 'т', 'л', 'м.куб', 'м', 'упак']
+CATEGORY_FILL = PatternFill('solid', start_color='FFFFD700')
+
+# Шрифты с кириллицей: стандартные шрифты PDF ее не содержат, и текст не извлекается
+CYRILLIC_FONTS = (
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/TTF/DejaVuSans.ttf',
+    '/Library/Fonts/Arial Unicode.ttf',
+    'C:\\Windows\\Fonts\\arial.ttf',
+)
+PDF_ROWS_PER_PAGE = 40
+
+
+def build_sample_workbook(path: str, rows: int, seed: int = 42, colored: bool = True):
+    """Создает синтетический прайс-лист формата EuroGips: категории (с заливкой) и товары"""
+    rnd = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet('Прайс')
+    worksheet.append(['Прайс-лист поставщика'])
+    worksheet.append(['№', 'Товар', 'Ед.изм', 'Цена'])
+    for i in range(rows):
+        if rnd.random() < 0.05:
+            cell = openpyxl.cell.WriteOnlyCell(worksheet, value=f'Категория {i % 50}')
+            if colored:
+                cell.fill = CATEGORY_FILL
+            worksheet.append([cell, f'Категория {i % 50}'])
+        else:
+            worksheet.append([i, f'Товар {i} ГКЛ {rnd.randint(1, 999)}', rnd.choice(UNITS), round(rnd.uniform(1, 5000), 2)])
+    workbook.save(path)
+
+
+def export_csv(workbook_path: str, csv_path: str, encoding: str = 'utf-8', delimiter: str = ';'):
+    """Сохраняет первый лист книги в CSV, как это делают выгрузки поставщиков"""
+    workbook = openpyxl.load_workbook(workbook_path, read_only=True, data_only=True)
+    try:
+        with open(csv_path, 'w', newline='', encoding=encoding) as f:
+            writer = csv.writer(f, delimiter=delimiter)
+            for row in workbook.worksheets[0].iter_rows(values_only=True):
+                writer.writerow(['' if value is None else value for value in row])
+    finally:
+        workbook.close()
+
+
+def find_cyrillic_font(font_path: str = None) -> str:
+    for path in ((font_path,) if font_path else CYRILLIC_FONTS):
+        if os.path.exists(path):
+            return path
+    raise CommandError('Не найден TTF шрифт с кириллицей, укажите его через --font')
+
+
+def build_sample_pdf(path: str, pages: int, font_path: str, seed: int = 42):
+    """
+    Создает синтетический PDF прайс-лист: на каждой странице таблица с сеткой и повтором
+    заголовка, категории иногда стоят последней строкой страницы (товары - на следующей)
+    """
+    rnd = random.Random(seed)
+    pdfmetrics.registerFont(TTFont('PriceListFont', font_path))
+    doc = SimpleDocTemplate(path, pagesize=A4, topMargin=20, bottomMargin=20)
+    style = TableStyle([
+        ('FONTNAME', (0, 0), (-1, -1), 'PriceListFont'),
+        ('FONTSIZE', (0, 0), (-1, -1), 8),
+        ('GRID', (0, 0), (-1, -1), 0.5, (0, 0, 0)),
+        ('TOPPADDING', (0, 0), (-1, -1), 1),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 1),
+    ])
+    story = []
+    number = 0
+    for page in range(pages):
+        rows = [['Товар', 'Ед.изм', 'Цена']]
+        for i in range(PDF_ROWS_PER_PAGE):
+            number += 1
+            if rnd.random() < 0.05 or (i == PDF_ROWS_PER_PAGE - 1 and page % 7 == 0):
+                rows.append([f'Категория {number % 50}', '', ''])
+            else:
+                rows.append([
+                    f'Товар {number} ГКЛ {rnd.randint(1, 999)}', rnd.choice(UNITS),
+                    f'{rnd.uniform(1, 5000):.2f}'.replace('.', ','),
+                ])
+        story.append(Table(rows, colWidths=[300, 60, 80], style=style))
+        if page < pages - 1:
+            story.append(PageBreak())
+    doc.build(story)
+
+
+class Command(BaseCommand):
+    help = 'Бенчмарк парсинга Excel прайс-листов на синтетическом файле'
+
+    CASES = ('streaming', 'memory', 'csv', 'pdf')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--case', choices=self.CASES, default='streaming',
+                            help='streaming - потоковый режим против DataFrame; '
+                                 'memory - память на товары: словари против ProductBatch; '
+                                 'csv - тот же прайс-лист в CSV против потокового Excel; '
+                                 'pdf - извлечение таблиц PDF по страницам параллельно против последовательного')
+        parser.add_argument('--rows', type=int, default=None,
+                            help='Количество строк в синтетическом прайс-листе '
+                                 '(по умолчанию 100000, для memory 300000; для pdf - страниц, 500)')
+        parser.add_argument('--file', type=str, default=None, help='Готовый файл вместо синтетического')
+        parser.add_argument('--font', type=str, default=None, help='TTF шрифт с кириллицей для синтетического PDF')
+        parser.add_argument('--workers', type=int, default=None, help='Процессов извлечения PDF')
+
+    def handle(self, *args, **options):
+        case = options['case']
+        rows = options['rows'] or {'memory': 300000, 'pdf': 500}.get(case, 100000)
+        if case == 'memory':
+            # Файл не нужен: сравниваются только представления распознанных товаров
+            self._bench_memory(rows)
+            return
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = options['file']
+            if case == 'pdf':
+                if not file_path:
+                    file_path = os.path.join(tmp_dir, 'pricelist.pdf')
+                    self.stdout.write(f'Генерация PDF прайс-листа на {rows} страниц...')
+                    build_sample_pdf(file_path, rows, find_cyrillic_font(options['font']))
+                self._bench_pdf(file_path, options['workers'])
+                return
+            if not file_path:
+                file_path = os.path.join(tmp_dir, 'pricelist.xlsx')
+                self.stdout.write(f'Генерация прайс-листа на {rows} строк...')
+                build_sample_workbook(file_path, rows)
+
+            getattr(self, f'_bench_{case}')(file_path)
+
+    def _report(self, title: str, baseline: float, optimized: float):
+        self.stdout.write(self.style.SUCCESS(f'{title}: {baseline / optimized:.1f}x'))
+
+    def _bench_streaming(self, file_path: str):
+        timings = {}
+        results = {}
+        for mode, streaming in (('dataframe', False), ('streaming', True)):
+            started = time.perf_counter()
+            results[mode] = ExcelPriceListParser(file_path, streaming=streaming).parse()
+            timings[mode] = time.perf_counter() - started
+            self.stdout.write(f'{mode}: {timings[mode]:.2f} с, товаров: {results[mode]["total_products"]}')
+
+        if results['dataframe'] != results['streaming']:
+            self.stdout.write(self.style.ERROR('Результаты режимов различаются!'))
+        self._report('Ускорение потокового режима', timings['dataframe'], timings['streaming'])
+
+    def _bench_csv(self, file_path: str):
+        csv_path = os.path.join(os.path.dirname(file_path), 'pricelist.csv')
+        export_csv(file_path, csv_path)
+        timings = {}
+        results = {}
+        for mode, parser in (('excel', ExcelPriceListParser(file_path, streaming=True)),
+                             ('csv', CsvPriceListParser(csv_path))):
+            started = time.perf_counter()
+            results[mode] = parser.parse()
+            timings[mode] = time.perf_counter() - started
+            self.stdout.write(f'{mode}: {timings[mode]:.2f} с, товаров: {results[mode]["total_products"]}')
+
+        if results['excel'] != results['csv']:
+            self.stdout.write(self.style.ERROR('Результаты различаются!'))
+        self._report('Ускорение CSV против потокового Excel', timings['excel'], timings['csv'])
+
+    def _bench_pdf(self, file_path: str, workers: int = None):
+        timings = {}
+        results = {}
+        for mode, parser in (('sequential', PdfPriceListParser(file_path, workers=1)),
+                             ('parallel', PdfPriceListParser(file_path, workers=workers))):
+            started = time.perf_counter()
+            results[mode] = parser.parse()
+            timings[mode] = time.perf_counter() - started
+            self.stdout.write(
+                f'{mode} ({parser.workers} проц.): {timings[mode]:.2f} с, товаров: {results[mode]["total_products"]}, '
+                f'категорий: {len(results[mode]["categories"])}'
+            )
+
+        if results['sequential'] != results['parallel']:
+            self.stdout.write(self.style.ERROR('Результаты различаются!'))
+        self._report('Ускорение параллельного извлечения PDF', timings['sequential'], timings['parallel'])
+
+    def _bench_memory(self, rows: int):
+        parser = ExcelPriceListParser('pricelist.xlsx')
+
+        def product_rows():
+            # Те же значения, что дал бы потоковый парсер на build_sample_workbook
+            rnd = random.Random(42)
+            category = None
+            for i in range(rows):
+                if rnd.random() < 0.05:
+                    category = f'Категория {i % 50}'
+                    continue
+                yield parser._product_row(
+                    f'Товар {i} ГКЛ {rnd.randint(1, 999)}', rnd.choice(UNITS), round(rnd.uniform(1, 5000), 2), category
+                )
+
+        def measure(build):
+            tracemalloc.start()
+            result = build()
+            size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            return result, size
+
+        dicts, dicts_size = measure(lambda: [dict(zip(ProductBatch.FIELDS, row)) for row in product_rows()])
+        self.stdout.write(f'словари: {dicts_size / 2 ** 20:.1f} МБ, товаров: {len(dicts)}')
+        del dicts
+
+        def build_batches():
+            units, categories = StringTable(), StringTable()
+            batches = [ProductBatch(units, categories)]
+            for row in product_rows():
+                if len(batches[-1]) == PRODUCT_CHUNK_SIZE:
+                    batches.append(ProductBatch(units, categories))
+                batches[-1].append(*row)
+            return batches
+
+        batches, batches_size = measure(build_batches)
+        self.stdout.write(f'ProductBatch: {batches_size / 2 ** 20:.1f} МБ, товаров: {sum(map(len, batches))}')
+        self.stdout.write(self.style.SUCCESS(f'Экономия памяти: {dicts_size / batches_size:.1f}x'))
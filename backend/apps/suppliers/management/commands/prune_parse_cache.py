@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from apps.suppliers.parse_cache import ParseCache
+
+
+class Command(BaseCommand):
+    help = 'Очистка кэша парсинга прайс-листов: старые записи и самые давно использованные сверх размера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-age-days', type=float, default=None,
+                            help='Удалить записи, не использованные дольше N дней '
+                                 '(по умолчанию PRICELIST_PARSE_CACHE_MAX_AGE_DAYS, 0 - без ограничения)')
+        parser.add_argument('--max-mb', type=int, default=None,
+                            help='Предельный размер кэша, МБ (по умолчанию PRICELIST_PARSE_CACHE_MAX_MB, 0 - без ограничения)')
+
+    def handle(self, *args, **options):
+        max_age = options['max_age_days'] * 24 * 60 * 60 if options['max_age_days'] is not None else None
+        max_bytes = options['max_mb'] * 1024 * 1024 if options['max_mb'] is not None else None
+        cache = ParseCache()
+        removed, freed = cache.prune(max_age=max_age, max_bytes=max_bytes)
+        self.stdout.write(self.style.SUCCESS(
+            f'Кэш парсинга {cache.root}: удалено файлов {removed}, освобождено {freed // (1024 * 1024)} МБ'
+        ))
@@ -0,0 +1,79 @@
+import multiprocessing
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from apps.suppliers.jobs import enqueue_orphaned_price_lists, run_worker
+
+
+def _install_stop_handlers(stop_event: threading.Event):
+    def handle(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, handle)
+    signal.signal(signal.SIGINT, handle)
+
+
+def _worker_process(poll_interval: float):
+    stop_event = threading.Event()
+    _install_stop_handlers(stop_event)
+    run_worker(stop_event, poll_interval=poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Обработчик очереди прайс-листов: парсинг и импорт загруженных файлов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+                            help='Количество процессов-обработчиков (по умолчанию PRICELIST_WORKER_PROCESSES)')
+        parser.add_argument('--poll-interval', type=float, default=None,
+                            help='Пауза между опросами пустой очереди, секунд')
+        parser.add_argument('--once', action='store_true',
+                            help='Обработать все готовые задания в текущем процессе и выйти')
+
+    def handle(self, *args, **options):
+        processes = options['processes'] or settings.PRICELIST_WORKER_PROCESSES
+        poll_interval = options['poll_interval'] or settings.PRICELIST_WORKER_POLL_INTERVAL
+
+        orphaned = enqueue_orphaned_price_lists()
+        if orphaned:
+            self.stdout.write(self.style.WARNING(f'Поставлено в очередь прайс-листов без задания: {orphaned}'))
+
+        stop_event = threading.Event()
+        if options['once'] or processes == 1:
+            if not options['once']:
+                _install_stop_handlers(stop_event)
+            self.stdout.write(self.style.SUCCESS('Обработчик прайс-листов запущен'))
+            run_worker(stop_event, poll_interval=poll_interval, once=options['once'])
+            return
+
+        # Соединения с БД не должны наследоваться дочерними процессами
+        connections.close_all()
+        _install_stop_handlers(stop_event)
+        workers = {}
+        self.stdout.write(self.style.SUCCESS(f'Запуск {processes} обработчиков прайс-листов'))
+
+        while not stop_event.is_set():
+            # Перезапускаем упавшие процессы; их задания вернет recover_stale_jobs
+            for slot in range(processes):
+                worker = workers.get(slot)
+                if worker is None or not worker.is_alive():
+                    if worker is not None:
+                        self.stdout.write(self.style.WARNING(
+                            f'Обработчик {worker.pid} завершился с кодом {worker.exitcode}, перезапуск'
+                        ))
+                    worker = multiprocessing.Process(target=_worker_process, args=(poll_interval,), daemon=False)
+                    worker.start()
+                    workers[slot] = worker
+            stop_event.wait(1)
+
+        self.stdout.write('Остановка обработчиков после текущих заданий...')
+        for worker in workers.values():
+            if worker.is_alive():
+                worker.terminate()  # SIGTERM: обработчик завершает текущее задание и выходит
+        for worker in workers.values():
+            worker.join()
+        self.stdout.write(self.style.SUCCESS('Обработчики остановлены'))
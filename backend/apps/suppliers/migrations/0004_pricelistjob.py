@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-16 21:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0003_supplier_markup_som'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceListJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('QUEUED', 'В очереди'), ('RUNNING', 'Выполняется'), ('DONE', 'Выполнено'), ('FAILED', 'Ошибка')], default='QUEUED', max_length=20, verbose_name='Статус')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попыток')),
+                ('max_attempts', models.PositiveIntegerField(default=3, verbose_name='Максимум попыток')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Не раньше')),
+                ('locked_by', models.CharField(blank=True, max_length=255, verbose_name='Обработчик')),
+                ('heartbeat_at', models.DateTimeField(blank=True, null=True, verbose_name='Последний сигнал обработчика')),
+                ('last_error', models.TextField(blank=True, verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Запущено')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+                ('price_list', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='jobs', to='suppliers.pricelist', verbose_name='Прайс-лист')),
+                ('supplier', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='price_list_jobs', to='suppliers.supplier', verbose_name='Поставщик')),
+            ],
+            options={
+                'verbose_name': 'Задание обработки прайс-листа',
+                'verbose_name_plural': 'Задания обработки прайс-листов',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='suppliers_job_status_run_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='pricelistjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'RUNNING')), fields=('supplier',), name='suppliers_job_one_running_per_supplier'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-16 21:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0004_pricelistjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricelist',
+            name='import_checkpoint',
+            field=models.PositiveIntegerField(default=0, verbose_name='Импортировано строк (контрольная точка)'),
+        ),
+        migrations.AddField(
+            model_name='pricelist',
+            name='import_summary',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Сводка импорта на контрольной точке'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 21:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0005_pricelist_import_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricelist',
+            name='file_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, verbose_name='SHA-256 файла'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0006_pricelist_file_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricelist',
+            name='diff_summary',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Сравнение с текущим каталогом поставщика'),
+        ),
+    ]
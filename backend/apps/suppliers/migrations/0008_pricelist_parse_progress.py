@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0007_pricelist_diff_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricelist',
+            name='parse_progress',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Ход парсинга по листам'),
+        ),
+    ]
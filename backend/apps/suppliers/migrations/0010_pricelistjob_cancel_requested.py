@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-16 22:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0009_pricelist_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pricelistjob',
+            name='cancel_requested',
+            field=models.BooleanField(default=False, verbose_name='Запрошена отмена'),
+        ),
+        migrations.AlterField(
+            model_name='pricelist',
+            name='status',
+            field=models.CharField(choices=[('NEW', 'Новый'), ('PROCESSING', 'Обрабатывается'), ('PROCESSED', 'Обработан'), ('FAILED', 'Ошибка'), ('CANCELLED', 'Отменен')], default='NEW', max_length=20, verbose_name='Статус'),
+        ),
+        migrations.AlterField(
+            model_name='pricelistjob',
+            name='status',
+            field=models.CharField(choices=[('QUEUED', 'В очереди'), ('RUNNING', 'Выполняется'), ('DONE', 'Выполнено'), ('FAILED', 'Ошибка'), ('CANCELLED', 'Отменено')], default='QUEUED', max_length=20, verbose_name='Статус'),
+        ),
+    ]
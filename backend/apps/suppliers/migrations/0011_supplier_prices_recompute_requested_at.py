@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0010_pricelistjob_cancel_requested'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='supplier',
+            name='prices_recompute_requested_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Запрошен пересчет цен'),
+        ),
+    ]
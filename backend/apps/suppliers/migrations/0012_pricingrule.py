@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_product_missed_imports'),
+        ('suppliers', '0011_supplier_prices_recompute_requested_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PricingRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Название')),
+                ('priority', models.PositiveIntegerField(default=100, verbose_name='Приоритет (меньше - раньше)')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активно')),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Базовая цена от')),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Базовая цена до')),
+                ('markup_percent', models.DecimalField(decimal_places=2, default=0, max_digits=6, verbose_name='Наценка (%)')),
+                ('markup_som', models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Наценка (сом)')),
+                ('round_to', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True, verbose_name='Шаг округления')),
+                ('rounding', models.CharField(choices=[('NEAREST', 'До ближайшего'), ('UP', 'Вверх'), ('DOWN', 'Вниз')], default='NEAREST', max_length=10, verbose_name='Округление')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='pricing_rules', to='catalog.category', verbose_name='Категория')),
+                ('supplier', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='pricing_rules', to='suppliers.supplier', verbose_name='Поставщик')),
+            ],
+            options={
+                'verbose_name': 'Правило наценки',
+                'verbose_name_plural': 'Правила наценки',
+                'ordering': ['priority', 'id'],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-16 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suppliers', '0012_pricingrule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='supplier',
+            name='prices_recompute_attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='Попыток пересчета цен'),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='prices_recompute_error',
+            field=models.TextField(blank=True, verbose_name='Ошибка пересчета цен'),
+        ),
+        migrations.AddField(
+            model_name='supplier',
+            name='prices_recompute_run_after',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Пересчет цен не раньше'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class Supplier(models.Model):
@@ -22,6 +23,12 @@ class Supplier(models.Model):
     parsing_config = models.JSONField(default=dict, blank=True, verbose_name='Конфигурация парсинга')
     markup_som = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Наценка (сом)')
     is_active = models.BooleanField(default=True, verbose_name='Активен')
+    # Наценка изменена, цены товаров ждут пересчета обработчиком очереди (apps/suppliers/pricing.py)
+    prices_recompute_requested_at = models.DateTimeField(null=True, blank=True, verbose_name='Запрошен пересчет цен')
+    # Пересчет забран обработчиком или отложен после ошибки: до этого времени другие его не берут
+    prices_recompute_run_after = models.DateTimeField(null=True, blank=True, verbose_name='Пересчет цен не раньше')
+    prices_recompute_attempts = models.PositiveIntegerField(default=0, verbose_name='Попыток пересчета цен')
+    prices_recompute_error = models.TextField(blank=True, verbose_name='Ошибка пересчета цен')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -34,24 +41,20 @@ class Supplier(models.Model):
     
     def save(self, *args, **kwargs):
         # Сохраняем старое значение наценки для сравнения
-        if self.pk:
-            old_instance = Supplier.objects.get(pk=self.pk)
-            old_markup = old_instance.markup_som
+        update_fields = kwargs.get('update_fields')
+        if self.pk and (update_fields is None or 'markup_som' in update_fields):
+            old_markup = Supplier.objects.filter(pk=self.pk).values_list('markup_som', flat=True).first()
         else:
             old_markup = None
-        
+
         super().save(*args, **kwargs)
-        
-        # Если наценка изменилась, пересчитываем цены всех товаров поставщика
+
+        # Если наценка изменилась, пересчитываем цены всех товаров поставщика;
+        # сводка пересчета остается в price_recompute для ответа API
+        self.price_recompute = None
         if old_markup is not None and old_markup != self.markup_som:
-            from apps.catalog.models import Product
-            from decimal import Decimal
-            markup = Decimal(str(self.markup_som or 0))
-            products = Product.objects.filter(supplier=self)
-            for product in products:
-                base = Decimal(str(product.base_price))
-                product.final_price = base + markup
-                product.save(update_fields=['final_price'])
+            from .pricing import request_price_recompute
+            self.price_recompute = request_price_recompute(self)
 
 
 class PriceList(models.Model):
@@ -60,6 +63,7 @@ class PriceList(models.Model):
         ('PROCESSING', 'Обрабатывается'),
         ('PROCESSED', 'Обработан'),
         ('FAILED', 'Ошибка'),
+        ('CANCELLED', 'Отменен'),
     ]
 
     PARSING_METHOD_CHOICES = [
@@ -80,6 +84,12 @@ class PriceList(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='NEW', verbose_name='Статус')
     log = models.TextField(blank=True, verbose_name='Лог обработки')
     products_count = models.IntegerField(default=0, verbose_name='Количество товаров')
+    file_hash = models.CharField(max_length=64, blank=True, db_index=True, verbose_name='SHA-256 файла')
+    import_checkpoint = models.PositiveIntegerField(default=0, verbose_name='Импортировано строк (контрольная точка)')
+    import_summary = models.JSONField(default=dict, blank=True, verbose_name='Сводка импорта на контрольной точке')
+    diff_summary = models.JSONField(default=dict, blank=True, verbose_name='Сравнение с текущим каталогом поставщика')
+    parse_progress = models.JSONField(default=dict, blank=True, verbose_name='Ход парсинга по листам')
+    progress = models.JSONField(default=dict, blank=True, verbose_name='Ход обработки')
 
     class Meta:
         verbose_name = 'Прайс-лист'
@@ -90,4 +100,95 @@ class PriceList(models.Model):
         return f'{self.supplier.name} - {self.uploaded_at.strftime("%Y-%m-%d")}'
 
 
+class PriceListJob(models.Model):
+    """Задание очереди фоновой обработки прайс-листа (выполняется manage.py run_pricelist_worker)"""
+
+    STATUS_QUEUED = 'QUEUED'
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_DONE = 'DONE'
+    STATUS_FAILED = 'FAILED'
+    STATUS_CANCELLED = 'CANCELLED'
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Выполнено'),
+        (STATUS_FAILED, 'Ошибка'),
+        (STATUS_CANCELLED, 'Отменено'),
+    ]
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+    price_list = models.ForeignKey(PriceList, on_delete=models.CASCADE, related_name='jobs', verbose_name='Прайс-лист')
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, related_name='price_list_jobs', verbose_name='Поставщик')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, verbose_name='Статус')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попыток')
+    max_attempts = models.PositiveIntegerField(default=3, verbose_name='Максимум попыток')
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='Не раньше')
+    locked_by = models.CharField(max_length=255, blank=True, verbose_name='Обработчик')
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name='Последний сигнал обработчика')
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    # Выставляется действием cancel; обработчик проверяет флаг на границах пачек
+    cancel_requested = models.BooleanField(default=False, verbose_name='Запрошена отмена')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='Запущено')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name='Завершено')
+
+    class Meta:
+        verbose_name = 'Задание обработки прайс-листа'
+        verbose_name_plural = 'Задания обработки прайс-листов'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='suppliers_job_status_run_idx'),
+        ]
+        constraints = [
+            # Прайс-листы одного поставщика обрабатываются строго по очереди
+            models.UniqueConstraint(
+                fields=['supplier'],
+                condition=models.Q(status='RUNNING'),
+                name='suppliers_job_one_running_per_supplier',
+            ),
+        ]
+
+    def __str__(self):
+        return f'Задание {self.id} ({self.get_status_display()}) - прайс-лист {self.price_list_id}'
+
+
+class PricingRule(models.Model):
+    """
+    Правило наценки: товары поставщика и/или категории (вместе с подкатегориями)
+    в диапазоне базовой цены [min_price, max_price) получают процентную и фиксированную
+    наценку, итог округляется до шага round_to. Из активных правил к товару применяется
+    первое подходящее по priority; без подходящего правила действует наценка поставщика
+    (apps/suppliers/pricing.py).
+    """
+    ROUNDING_NEAREST = 'NEAREST'
+    ROUNDING_UP = 'UP'
+    ROUNDING_DOWN = 'DOWN'
+
+    ROUNDING_CHOICES = [
+        (ROUNDING_NEAREST, 'До ближайшего'),
+        (ROUNDING_UP, 'Вверх'),
+        (ROUNDING_DOWN, 'Вниз'),
+    ]
+
+    name = models.CharField(max_length=255, verbose_name='Название')
+    priority = models.PositiveIntegerField(default=100, verbose_name='Приоритет (меньше - раньше)')
+    is_active = models.BooleanField(default=True, verbose_name='Активно')
+    supplier = models.ForeignKey(Supplier, on_delete=models.CASCADE, null=True, blank=True, related_name='pricing_rules', verbose_name='Поставщик')
+    category = models.ForeignKey('catalog.Category', on_delete=models.CASCADE, null=True, blank=True, related_name='pricing_rules', verbose_name='Категория')
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name='Базовая цена от')
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name='Базовая цена до')
+    markup_percent = models.DecimalField(max_digits=6, decimal_places=2, default=0, verbose_name='Наценка (%)')
+    markup_som = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Наценка (сом)')
+    round_to = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name='Шаг округления')
+    rounding = models.CharField(max_length=10, choices=ROUNDING_CHOICES, default=ROUNDING_NEAREST, verbose_name='Округление')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Правило наценки'
+        verbose_name_plural = 'Правила наценки'
+        ordering = ['priority', 'id']
 
+    def __str__(self):
+        return self.name
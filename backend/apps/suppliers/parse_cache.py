@@ -0,0 +1,413 @@
+"""
+Кэш результатов парсинга прайс-листов по содержимому файла.
+
+Ключ - SHA-256 файла, версия парсера и его настройки. Результат хранится
+сжатым (gzip) построчным JSON в PRICELIST_PARSE_CACHE_DIR (по умолчанию MEDIA_ROOT/pricelist_cache):
+заголовок, по строке на пачку товаров (колонки ProductBatch) и итоговая строка с категориями.
+Так кэш пишется и читается пачками, не собирая весь прайс в памяти, а повторная
+обработка или повторная загрузка того же файла не парсит его заново.
+
+Запись, которую пишет дочерний процесс парсинга, родитель читает по мере записи (CacheTail):
+писатель с sync=True сбрасывает сжатый поток после каждой пачки.
+
+Каждая новая версия файла, парсера или настроек оставляет отдельную запись, поэтому кэш
+чистится (ParseCache.prune): записи старше PRICELIST_PARSE_CACHE_MAX_AGE_DAYS и самые давно
+использованные сверх PRICELIST_PARSE_CACHE_MAX_MB удаляются обработчиком очереди между
+заданиями и командой prune_parse_cache. Попадание обновляет время изменения записи.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+import zlib
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+from .batches import ProductBatch, StringTable
+from .parsers import PRODUCT_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+CACHE_FORMAT = 3
+CACHE_SUFFIX = '.jsonl.gz'
+# Временные файлы старше этого брошены упавшим писателем (парсинг ограничен PRICELIST_PARSE_TIMEOUT)
+TMP_MAX_AGE_SECONDS = 24 * 60 * 60
+
+
+def file_sha256(file_path: str) -> str:
+    """SHA-256 файла, читается блоками без загрузки целиком в память"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def uploaded_file_sha256(uploaded_file) -> str:
+    """SHA-256 загруженного файла (UploadedFile) по его chunks(), позиция чтения сбрасывается"""
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def _dump_line(data: Dict) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n'
+
+
+class ParseCacheError(ValueError):
+    """Файл кэша оборван или поврежден"""
+
+
+class CacheReader:
+    """Чтение записи кэша пачками ProductBatch; categories и total_products известны после исчерпания"""
+
+    def __init__(self, path: str, f):
+        self.path = path
+        self._file = f
+        self.categories: List[str] = []
+        self.total_products = 0
+
+    def __iter__(self) -> Iterator[ProductBatch]:
+        unit_table, category_table = StringTable(), StringTable()
+        try:
+            for line in self._file:
+                data = json.loads(line)
+                if 'categories' in data:
+                    self.categories = data['categories']
+                    self.total_products = data['total_products']
+                    return
+                yield ProductBatch.from_columns(data, unit_table, category_table)
+            raise ParseCacheError(f'Кэш парсинга {self.path} оборван')
+        except (OSError, EOFError, ValueError) as e:
+            # Удаляем, чтобы повтор задания распарсил файл заново
+            logger.warning(f'Поврежденный кэш парсинга {self.path}: {str(e)}')
+            self._file.close()
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            raise ParseCacheError(str(e)) from e
+        finally:
+            self._file.close()
+
+
+class CacheWriter:
+    """
+    Запись пачками во временный файл; commit() атомарно публикует его под ключом.
+    tmp_path - уже созданный временный файл (CacheTail.tmp_path), sync=True - сжатый поток
+    сбрасывается на диск после каждой пачки, чтобы ее мог прочитать CacheTail.
+    """
+
+    def __init__(self, path: str, tmp_path: Optional[str] = None, sync: bool = False):
+        self.path = path
+        self.sync = sync
+        if tmp_path is None:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            self._raw = os.fdopen(fd, 'wb')
+        else:
+            self.tmp_path = tmp_path
+            self._raw = open(tmp_path, 'wb')
+        self._file = gzip.GzipFile(fileobj=self._raw, mode='wb', compresslevel=6)
+        self._file.write(_dump_line({'format': CACHE_FORMAT}))
+
+    def write(self, batch: ProductBatch):
+        if len(batch):
+            self._file.write(_dump_line(batch.to_columns()))
+            if self.sync:
+                self._file.flush(zlib.Z_SYNC_FLUSH)
+
+    def commit(self, categories: List[str], total_products: int):
+        self._file.write(_dump_line({'categories': categories, 'total_products': total_products}))
+        self._close()
+        # Атомарная замена: параллельный читатель не увидит половину файла
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self):
+        try:
+            self._close()
+        finally:
+            if os.path.exists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+    def _close(self):
+        try:
+            self._file.close()
+        finally:
+            self._raw.close()
+
+
+class CacheTail:
+    """
+    Чтение записи кэша, которую в это же время пишет другой процесс (CacheWriter(tmp_path=..., sync=True)).
+
+    Временный файл создается здесь и сразу открывается на чтение, поэтому читатель не теряет его,
+    когда писатель публикует запись (os.replace) или удаляет ее при ошибке. read(poll) отдает пачки
+    по мере записи; poll() вызывается, когда новых данных нет: ждет писателя и возвращает False,
+    если тот завершился (ошибку писателя poll() пробрасывает сам). categories и total_products
+    заполнены после исчерпания.
+    """
+
+    READ_SIZE = 1024 * 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        self._file = os.fdopen(fd, 'rb')
+        self.categories: List[str] = []
+        self.total_products = 0
+
+    def read(self, poll: Callable[[], bool]) -> Iterator[ProductBatch]:
+        unit_table, category_table = StringTable(), StringTable()
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        pending = b''
+        header_read = False
+        writer_running = True
+        while True:
+            data = self._file.read(self.READ_SIZE)
+            if not data:
+                if not writer_running:
+                    raise ParseCacheError(f'Кэш парсинга {self.path} оборван')
+                writer_running = poll()
+                continue
+            *lines, pending = (pending + decompressor.decompress(data)).split(b'\n')
+            for line in lines:
+                record = json.loads(line)
+                if not header_read:
+                    if record.get('format') != CACHE_FORMAT:
+                        raise ParseCacheError(f'Кэш парсинга {self.path}: неизвестный формат')
+                    header_read = True
+                elif 'categories' in record:
+                    self.categories = record['categories']
+                    self.total_products = record['total_products']
+                    return
+                else:
+                    yield ProductBatch.from_columns(record, unit_table, category_table)
+
+    def close(self):
+        """Закрывает файл и удаляет временную запись, если писатель ее не опубликовал"""
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class ParseCache:
+    """Файловый кэш результатов парсинга"""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or settings.PRICELIST_PARSE_CACHE_DIR or os.path.join(settings.MEDIA_ROOT, 'pricelist_cache')
+
+    @staticmethod
+    def key(file_hash: str, parser, sheet_name: Optional[str] = None) -> str:
+        options = json.dumps(
+            {'sheet_name': sheet_name, **parser.cache_options()}, sort_keys=True, ensure_ascii=False
+        )
+        options_hash = hashlib.sha256(options.encode('utf-8')).hexdigest()[:16]
+        return f'{type(parser).__name__}-v{parser.VERSION}-{file_hash}-{options_hash}'
+
+    def path(self, key: str) -> str:
+        file_hash = key.split('-')[2]
+        return os.path.join(self.root, file_hash[:2], f'{key}{CACHE_SUFFIX}')
+
+    def open(self, key: str) -> Optional[CacheReader]:
+        """Читатель записи или None, если ее нет (или она в другом формате)"""
+        path = self.path(key)
+        try:
+            f = gzip.open(path, 'rt', encoding='utf-8')
+        except FileNotFoundError:
+            return None
+        try:
+            header = json.loads(f.readline())
+        except (OSError, EOFError, ValueError) as e:
+            f.close()
+            logger.warning(f'Поврежденный кэш парсинга {path}: {str(e)}')
+            return None
+        if header.get('format') != CACHE_FORMAT:
+            f.close()
+            return None
+        try:
+            # Время изменения - время последнего использования: prune удаляет давно не нужные записи
+            os.utime(path)
+        except OSError:
+            pass
+        return CacheReader(path, f)
+
+    def writer(self, key: str) -> CacheWriter:
+        return CacheWriter(self.path(key))
+
+    def get(self, key: str) -> Optional[Dict]:
+        reader = self.open(key)
+        if reader is None:
+            return None
+        try:
+            products = [product for batch in reader for product in batch.to_dicts()]
+        except ParseCacheError:
+            return None
+        return {'products': products, 'categories': reader.categories, 'total_products': reader.total_products}
+
+    def prune(self, max_age: Optional[float] = None, max_bytes: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Удаляет записи, не использованные дольше max_age секунд, затем самые давно использованные,
+        пока размер кэша больше max_bytes, и брошенные временные файлы. None - по настройкам
+        PRICELIST_PARSE_CACHE_MAX_AGE_DAYS и PRICELIST_PARSE_CACHE_MAX_MB, 0 - без ограничения.
+        Возвращает (удалено файлов, освобождено байт).
+        """
+        if max_age is None:
+            max_age = settings.PRICELIST_PARSE_CACHE_MAX_AGE_DAYS * 24 * 60 * 60
+        if max_bytes is None:
+            max_bytes = settings.PRICELIST_PARSE_CACHE_MAX_MB * 1024 * 1024
+        now = time.time()
+        entries = []
+        stale = []
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                age = now - stat.st_mtime
+                if name.endswith('.tmp'):
+                    if age > TMP_MAX_AGE_SECONDS:
+                        stale.append((path, stat.st_size))
+                elif name.endswith(CACHE_SUFFIX):
+                    if max_age and age > max_age:
+                        stale.append((path, stat.st_size))
+                    else:
+                        entries.append((stat.st_mtime, path, stat.st_size))
+
+        if max_bytes:
+            total = sum(size for _, _, size in entries)
+            for _, path, size in sorted(entries):
+                if total <= max_bytes:
+                    break
+                stale.append((path, size))
+                total -= size
+
+        removed = freed = 0
+        for path, size in stale:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+            freed += size
+        if removed:
+            logger.info(f'Кэш парсинга: удалено файлов {removed}, освобождено {freed // (1024 * 1024)} МБ')
+        return removed, freed
+
+    def put(self, key: str, result: Dict):
+        writer = self.writer(key)
+        try:
+            writer.write(ProductBatch.from_dicts(result.get('products', [])))
+            writer.commit(result.get('categories', []), result.get('total_products', len(result.get('products', []))))
+        except BaseException:
+            writer.discard()
+            raise
+
+
+class ParseStream:
+    """
+    Товары прайс-листа пачками ProductBatch: из кэша при попадании, иначе из parser.iter_products()
+    с записью пачек в кэш по ходу парсинга.
+
+    categories и total_products заполнены после исчерпания итератора (total_products
+    растет по ходу чтения); stored - есть ли после этого результат в кэше.
+    timings - время чтения и разбора (при попадании - только чтение кэша).
+    """
+
+    # Общее число строк заранее неизвестно: парсинг идет одновременно с импортом
+    expected_total = None
+
+    def __init__(self, parser, file_hash: Optional[str] = None, sheet_name: Optional[str] = None,
+                 cache: Optional[ParseCache] = None, chunk_size: int = PRODUCT_CHUNK_SIZE):
+        self.parser = parser
+        self.sheet_name = sheet_name
+        self.chunk_size = chunk_size
+        self.cache = cache or ParseCache()
+        self.key = self.cache.key(file_hash or file_sha256(parser.file_path), parser, sheet_name)
+        self.categories: List[str] = []
+        self.total_products = 0
+        self._reader = self.cache.open(self.key)
+        self.cache_hit = self._reader is not None
+        self.stored = self.cache_hit
+        self.timings = {'read': 0.0, 'classify': 0.0} if self.cache_hit else parser.timings
+
+    def __iter__(self) -> Iterator[ProductBatch]:
+        if self._reader is not None:
+            logger.info(f'Кэш парсинга: попадание {self.key}')
+            batches = iter(self._reader)
+            while True:
+                started = time.perf_counter()
+                batch = next(batches, None)
+                self.timings['read'] += time.perf_counter() - started
+                if batch is None:
+                    break
+                self.total_products += len(batch)
+                yield batch
+            self.categories = self._reader.categories
+            self.total_products = self._reader.total_products
+            return
+
+        writer = self._open_writer()
+        try:
+            for chunk in self.parser.iter_products(self.sheet_name, self.chunk_size):
+                self.total_products += len(chunk)
+                writer = self._write(writer, chunk)
+                yield chunk
+            self.categories = list(self.parser.categories)
+            if writer is not None:
+                try:
+                    writer.commit(self.categories, self.total_products)
+                except OSError as e:
+                    logger.warning(f'Не удалось сохранить кэш парсинга {self.key}: {str(e)}')
+                else:
+                    writer = None
+                    self.stored = True
+        finally:
+            if writer is not None:
+                writer.discard()
+
+    def _open_writer(self) -> Optional[CacheWriter]:
+        try:
+            return self.cache.writer(self.key)
+        except OSError as e:
+            # Кэш - оптимизация, его недоступность не должна ломать обработку
+            logger.warning(f'Не удалось сохранить кэш парсинга {self.key}: {str(e)}')
+            return None
+
+    def _write(self, writer: Optional[CacheWriter], chunk: ProductBatch) -> Optional[CacheWriter]:
+        if writer is None:
+            return None
+        try:
+            writer.write(chunk)
+            return writer
+        except OSError as e:
+            logger.warning(f'Не удалось сохранить кэш парсинга {self.key}: {str(e)}')
+            writer.discard()
+            return None
+
+
+def parse_cached(parser, file_hash: Optional[str] = None, sheet_name: Optional[str] = None,
+                 cache: Optional[ParseCache] = None) -> Tuple[Dict, bool]:
+    """
+    Результат в формате parser.parse() из кэша или с парсингом и сохранением.
+    Возвращает (результат, попадание в кэш).
+    """
+    stream = ParseStream(parser, file_hash, sheet_name, cache)
+    products = [product for batch in stream for product in batch.to_dicts()]
+    return {
+        'products': products,
+        'categories': stream.categories,
+        'total_products': stream.total_products,
+    }, stream.cache_hit
@@ -0,0 +1,409 @@
+"""
+Парсинг прайс-листов в отдельном процессе.
+
+pandas/openpyxl оставляют после большого файла раздутую кучу, которую процесс не
+возвращает системе, а поврежденная книга может повесить парсер. Поэтому файл
+разбирается в дочернем процессе ProcessPoolExecutor (spawn) с ограничением памяти
+(RLIMIT_AS), процессорного времени (RLIMIT_CPU) и времени ожидания; процесс пересоздается после
+PRICELIST_PARSE_MAX_TASKS_PER_CHILD файлов. Товары дочерний процесс пишет пачками в кэш
+парсинга (parse_cache), а в родителя возвращает только сводку. Родитель читает эту запись
+по мере записи (CacheTail), так что импорт идет одновременно с парсингом, как и в текущем
+процессе. Если кэш записать не удалось - ParseProcessError: передавать все товары
+через канал между процессами дороже, чем повторить задание.
+
+Книги с прайс-листом на нескольких листах (parsing_config['sheets']) разбираются
+по листу на задачу, до PRICELIST_PARSE_SHEET_WORKERS листов одновременно; результат
+собирается в порядке листов книги независимо от порядка завершения. Импорт такой книги
+начинается после разбора всех листов: листы разбираются параллельно, а не вместе с записью.
+
+Пока родитель ждет листы многолистовой книги, раз в CANCEL_POLL_SECONDS он вызывает check_cancelled():
+если обработку отменили, процессы пула останавливаются, исключение уходит вызывающему. Поток товаров
+из дочернего процесса (ChildParseStream) читается в потоке prefetch, отмену проверяет импорт;
+если он прекратил чтение раньше конца (ошибка, отмена), дочерний процесс тоже останавливается.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+from .batches import ProductBatch, StringTable
+from .parse_cache import CacheTail, CacheWriter, ParseCache, ParseCacheError, ParseStream, file_sha256
+from .parsers import ExcelPriceListParser
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+CANCEL_POLL_SECONDS = 1.0
+# Как часто родитель проверяет, дописал ли дочерний процесс новые пачки
+TAIL_POLL_SECONDS = 0.05
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+class ParseProcessError(RuntimeError):
+    """Дочерний процесс парсинга превысил лимит или аварийно завершился"""
+
+
+def _limit_memory(memory_limit_mb: int):
+    """Инициализатор дочернего процесса: лимит адресного пространства"""
+    if resource is not None and memory_limit_mb:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _limit_cpu(cpu_limit: int):
+    """
+    Лимит процессорного времени на текущую задачу. RLIMIT_CPU считает время процесса
+    целиком, а процесс выполняет несколько задач, поэтому лимит - от уже израсходованного.
+    При превышении процесс получает SIGXCPU и завершается.
+    """
+    if resource is None or not cpu_limit:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(usage.ru_utime + usage.ru_stime) + cpu_limit
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _parse_in_child(parser_class, file_path: str, parser_kwargs: Dict, cache_path: str, cpu_limit: int,
+                    sheet_name: Optional[str] = None, tmp_path: Optional[str] = None) -> Dict:
+    """
+    Выполняется в дочернем процессе: парсит файл (лист) в запись кэша cache_path и возвращает сводку.
+    tmp_path - временный файл, который родитель читает по мере записи (CacheTail).
+    Ошибка записи кэша - ParseProcessError, товары через канал между процессами не передаются.
+    """
+    _limit_cpu(cpu_limit)
+    parser = parser_class(file_path, **parser_kwargs)
+    try:
+        writer = CacheWriter(cache_path, tmp_path=tmp_path, sync=tmp_path is not None)
+    except OSError as e:
+        raise ParseProcessError(f'Не удалось записать кэш парсинга {cache_path}: {str(e)}')
+    total_products = 0
+    try:
+        for chunk in parser.iter_products(sheet_name):
+            total_products += len(chunk)
+            try:
+                writer.write(chunk)
+            except OSError as e:
+                raise ParseProcessError(f'Не удалось записать кэш парсинга {cache_path}: {str(e)}')
+        try:
+            writer.commit(list(parser.categories), total_products)
+        except OSError as e:
+            raise ParseProcessError(f'Не удалось записать кэш парсинга {cache_path}: {str(e)}')
+    except BaseException:
+        writer.discard()
+        raise
+    return {
+        'total_products': total_products,
+        'categories': list(parser.categories),
+        'detected_layout': parser.detected_layout,
+        'timings': parser.timings,
+    }
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=max(settings.PRICELIST_PARSE_SHEET_WORKERS, 1),
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_limit_memory,
+            initargs=(settings.PRICELIST_PARSE_MEMORY_LIMIT_MB,),
+            max_tasks_per_child=settings.PRICELIST_PARSE_MAX_TASKS_PER_CHILD,
+        )
+    return _executor
+
+
+def shutdown_executor(kill: bool = False):
+    """Останавливает пул; kill=True - без ожидания текущего парсинга (зависший процесс)"""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is None:
+        return
+    if kill:
+        # У ProcessPoolExecutor нет отмены выполняющейся задачи - завершаем его процессы
+        for process in list((executor._processes or {}).values()):
+            process.terminate()
+    executor.shutdown(wait=not kill, cancel_futures=True)
+
+
+class SubprocessParseResult:
+    """Лист, разобранный дочерним процессом в кэш, с интерфейсом ParseStream"""
+
+    cache_hit = False
+
+    def __init__(self, key: str, outcome: Dict, cache: ParseCache):
+        self.key = key
+        self.cache = cache
+        self.categories: List[str] = outcome['categories']
+        self.total_products: int = outcome['total_products']
+        # Парсинг уже закончен - число строк известно до импорта
+        self.expected_total = self.total_products
+        self.timings: Dict[str, float] = outcome['timings']
+
+    def __iter__(self) -> Iterator[ProductBatch]:
+        reader = self.cache.open(self.key)
+        if reader is None:
+            raise ParseCacheError(f'Кэш парсинга {self.key} исчез после парсинга')
+        yield from reader
+
+
+class ChildParseStream:
+    """
+    Товары файла, который разбирает дочерний процесс, с интерфейсом ParseStream: пачки читаются
+    из записи кэша по мере того, как дочерний процесс ее пишет, импорт не ждет конца файла.
+
+    categories, total_products и timings окончательные после исчерпания; тогда же parser получает
+    detected_layout и categories, найденные дочерним процессом. Если чтение прекращено раньше,
+    дочерний процесс останавливается.
+    """
+
+    cache_hit = False
+    # Общее число строк известно, когда прочитана итоговая строка записи
+    expected_total = None
+
+    def __init__(self, key: str, future, tail: CacheTail, parser):
+        self.key = key
+        self.categories: List[str] = []
+        self.total_products = 0
+        self.timings: Dict[str, float] = {'read': 0.0, 'classify': 0.0}
+        self._future = future
+        self._tail = tail
+        self._parser = parser
+        self._interrupted = threading.Event()
+        self._timeout = settings.PRICELIST_PARSE_TIMEOUT or None
+        self._deadline = time.monotonic() + self._timeout if self._timeout else None
+
+    def __iter__(self) -> Iterator[ProductBatch]:
+        try:
+            with _child_errors(self._timeout):
+                for batch in self._tail.read(self._poll):
+                    self.total_products += len(batch)
+                    yield batch
+                # Итоговая строка записана - дочерний процесс публикует запись и возвращает сводку
+                _wait_first({self._future}, self._deadline)
+                outcome = self._future.result()
+        finally:
+            if not self._future.done():
+                shutdown_executor(kill=True)
+            self._tail.close()
+        self.categories = self._tail.categories
+        self.total_products = self.expected_total = self._tail.total_products
+        self.timings = outcome['timings']
+        self._parser.detected_layout = outcome['detected_layout']
+        self._parser.categories = outcome['categories']
+
+    def interrupt(self):
+        """Прерывает ожидание дочернего процесса из другого потока (prefetch, когда импорт прекратил чтение)"""
+        self._interrupted.set()
+
+    def _poll(self) -> bool:
+        """Ждет новых пачек; False - дочерний процесс завершился (его ошибка пробрасывается)"""
+        if self._future.done():
+            self._future.result()
+            return False
+        if self._interrupted.is_set():
+            raise ParseProcessError('Чтение товаров из процесса парсинга прервано')
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            raise FutureTimeoutError()
+        wait({self._future}, timeout=TAIL_POLL_SECONDS)
+        return True
+
+
+class WorkbookStream:
+    """
+    Товары нескольких листов подряд в порядке книги с интерфейсом ParseStream.
+    Категория товара - путь (лист, категория листа); categories заполнен после исчерпания.
+    """
+
+    def __init__(self, key: str, sheets: List[Tuple[str, object]]):
+        self.key = key
+        self.sheets = sheets
+        self.cache_hit = all(source.cache_hit for _, source in sheets)
+        self.categories: List[tuple] = []
+        self.total_products = 0
+        totals = [source.expected_total for _, source in sheets]
+        self.expected_total = None if None in totals else sum(totals)
+
+    @property
+    def timings(self) -> Dict[str, float]:
+        return {
+            stage: sum(source.timings[stage] for _, source in self.sheets)
+            for stage in ('read', 'classify')
+        }
+
+    def __iter__(self) -> Iterator[ProductBatch]:
+        units, categories = StringTable(), StringTable()
+        sheet_category = ExcelPriceListParser.sheet_category
+        for sheet_name, source in self.sheets:
+            for batch in source:
+                merged = ProductBatch(units, categories)
+                for name, article, unit, price, category in batch.rows():
+                    merged.append(name, article, unit, price, sheet_category(sheet_name, category))
+                self.total_products += len(merged)
+                yield merged
+            self.categories.append((sheet_name,))
+            self.categories.extend(sheet_category(sheet_name, category) for category in source.categories)
+
+
+@contextmanager
+def _child_errors(timeout: Optional[float]):
+    """Ошибки дочернего процесса -> ParseProcessError; зависший или упавший пул останавливается"""
+    try:
+        yield
+    except FutureTimeoutError:
+        shutdown_executor(kill=True)
+        raise ParseProcessError(f'Парсинг файла не уложился в {timeout} с, процесс остановлен')
+    except BrokenProcessPool:
+        shutdown_executor(kill=True)
+        raise ParseProcessError(
+            'Процесс парсинга аварийно завершился (превышен лимит памяти или процессорного времени?)'
+        )
+    except MemoryError:
+        raise ParseProcessError(
+            f'Парсингу не хватило памяти (лимит {settings.PRICELIST_PARSE_MEMORY_LIMIT_MB} МБ)'
+        )
+
+
+def _wait_first(futures, deadline: Optional[float], check_cancelled: Optional[Callable[[], None]] = None):
+    """
+    wait(FIRST_COMPLETED) с общим сроком deadline (time.monotonic(), None - без срока).
+    Пока ни одна задача не готова, раз в CANCEL_POLL_SECONDS вызывается check_cancelled();
+    его исключение останавливает пул и уходит вызывающему.
+    """
+    while True:
+        remaining = max(deadline - time.monotonic(), 0) if deadline is not None else None
+        step = remaining
+        if check_cancelled is not None:
+            step = CANCEL_POLL_SECONDS if remaining is None else min(remaining, CANCEL_POLL_SECONDS)
+        done, not_done = wait(futures, timeout=step, return_when=FIRST_COMPLETED)
+        if done:
+            return done, not_done
+        if remaining is not None and remaining <= step:
+            raise FutureTimeoutError()
+        try:
+            check_cancelled()
+        except BaseException:
+            shutdown_executor(kill=True)
+            raise
+
+
+def parse_isolated(parser, file_hash: Optional[str] = None, cache: Optional[ParseCache] = None):
+    """
+    Поток пачек товаров для импорта: из кэша при попадании, иначе парсинг в дочернем процессе
+    (с PRICELIST_PARSE_IN_SUBPROCESS=False или без доступного каталога кэша - в текущем, как ParseStream).
+    Пачки из дочернего процесса отдаются по мере парсинга.
+
+    parser.detected_layout заполняется раскладкой, найденной дочерним процессом, после исчерпания потока.
+    Отмену проверяет читатель потока (prefetch(on_wait=check_cancelled)).
+    """
+    stream = ParseStream(parser, file_hash, cache=cache)
+    if stream.cache_hit or not settings.PRICELIST_PARSE_IN_SUBPROCESS:
+        return stream
+
+    cache_path = stream.cache.path(stream.key)
+    try:
+        tail = CacheTail(cache_path)
+    except OSError as e:
+        logger.warning(f'Кэш парсинга {cache_path} недоступен ({str(e)}), файл разбирается в текущем процессе')
+        return stream
+    try:
+        future = _get_executor().submit(
+            _parse_in_child, type(parser), parser.file_path, parser.clone_kwargs(), cache_path,
+            settings.PRICELIST_PARSE_TIMEOUT, None, tail.tmp_path,
+        )
+    except BaseException:
+        tail.close()
+        raise
+    return ChildParseStream(stream.key, future, tail, parser)
+
+
+def parse_sheets(parser, file_hash: Optional[str] = None, cache: Optional[ParseCache] = None,
+                 on_progress: Optional[Callable[[Dict], None]] = None,
+                 check_cancelled: Optional[Callable[[], None]] = None) -> WorkbookStream:
+    """
+    Многолистовой режим: каждый выбранный лист (parser.selected_sheets()) разбирается
+    отдельной задачей пула в кэш парсинга под своим ключом, листы из кэша не разбираются.
+    Возвращает поток товаров всех листов в порядке книги.
+
+    on_progress(progress) вызывается в текущем потоке после каждого разобранного листа:
+    {'sheets_total', 'sheets_done', 'sheets': [{'name', 'status', 'products'}]},
+    status - queued, parsed или cached.
+
+    check_cancelled() вызывается между листами и пока идет ожидание дочерних процессов.
+
+    Раскладка в многолистовом режиме не сохраняется (parser.detected_layout = None):
+    у листов она своя.
+    """
+    cache = cache or ParseCache()
+    file_hash = file_hash or file_sha256(parser.file_path)
+    sheet_names = parser.selected_sheets()
+    parser_class, parser_kwargs = type(parser), parser.clone_kwargs()
+
+    sources: Dict[str, object] = {}
+    keys: Dict[str, str] = {}
+    progress = {'sheets_total': len(sheet_names), 'sheets_done': 0, 'sheets': []}
+    pending: List[str] = []
+    for sheet_name in sheet_names:
+        stream = ParseStream(parser_class(parser.file_path, **parser_kwargs), file_hash, sheet_name, cache)
+        keys[sheet_name] = stream.key
+        if stream.cache_hit:
+            sources[sheet_name] = stream
+            progress['sheets_done'] += 1
+            progress['sheets'].append({'name': sheet_name, 'status': 'cached', 'products': None})
+        else:
+            pending.append(sheet_name)
+            progress['sheets'].append({'name': sheet_name, 'status': 'queued', 'products': None})
+    sheet_progress = {sheet['name']: sheet for sheet in progress['sheets']}
+
+    def sheet_parsed(sheet_name: str, outcome: Dict):
+        sources[sheet_name] = SubprocessParseResult(keys[sheet_name], outcome, cache)
+        sheet_progress[sheet_name].update(status='parsed', products=outcome['total_products'])
+        progress['sheets_done'] += 1
+        if on_progress is not None:
+            on_progress(progress)
+
+    if on_progress is not None:
+        on_progress(progress)
+    logger.info(f'Многолистовой парсинг {parser.file_path}: листов {len(sheet_names)}, из кэша {len(sheet_names) - len(pending)}')
+
+    if pending and not settings.PRICELIST_PARSE_IN_SUBPROCESS:
+        for sheet_name in pending:
+            if check_cancelled is not None:
+                check_cancelled()
+            sheet_parsed(sheet_name, _parse_in_child(
+                parser_class, parser.file_path, parser_kwargs, cache.path(keys[sheet_name]), 0, sheet_name
+            ))
+    elif pending:
+        timeout = settings.PRICELIST_PARSE_TIMEOUT or None
+        deadline = time.monotonic() + timeout if timeout else None
+        executor = _get_executor()
+        futures = {
+            executor.submit(
+                _parse_in_child, parser_class, parser.file_path, parser_kwargs, cache.path(keys[sheet_name]),
+                settings.PRICELIST_PARSE_TIMEOUT, sheet_name,
+            ): sheet_name
+            for sheet_name in pending
+        }
+        not_done = set(futures)
+        with _child_errors(timeout):
+            while not_done:
+                # Общий лимит времени на книгу, а не на каждый лист
+                done, not_done = _wait_first(not_done, deadline, check_cancelled)
+                for future in sorted(done, key=lambda f: sheet_names.index(futures[f])):
+                    sheet_parsed(futures[future], future.result())
+
+    parser.detected_layout = None
+    return WorkbookStream(cache.key(file_hash, parser, sheet_names), [(name, sources[name]) for name in sheet_names])
@@ -1,14 +1,54 @@
 import pandas as pd
 import openpyxl
+import pdfplumber
+import csv
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from openpyxl.styles import PatternFill
-from typing import List, Dict, Optional, Any
+from typing import List, Dict, Optional, Any, Iterable, Iterator, Sequence, Tuple, Union
+from itertools import chain, islice
 import logging
+import os
 import re
 import math
 import hashlib
+import time
+
+from .batches import ProductBatch, ProductRow, StringTable
+from .units import DEFAULT_UNITS, UnitDictionary
 
 logger = logging.getLogger(__name__)
 
+# Сколько первых строк листа потоковый парсер держит в памяти для поиска заголовка
+# и определения колонок. Остальные строки читаются генератором по одной.
+HEADER_SCAN_ROWS = 200
+
+# Размер пачки товаров, которую отдает iter_products()
+PRODUCT_CHUNK_SIZE = 1000
+
+# Сколько байт начала CSV файла читается для определения кодировки и разделителя
+CSV_SNIFF_BYTES = 64 * 1024
+# Возможные разделители CSV в порядке предпочтения при равенстве
+CSV_DELIMITERS = (';', '\t', ',', '|')
+
+# Сколько страниц PDF разбирает одна задача пула; файлы не длиннее - без пула
+PDF_PAGES_PER_TASK = 20
+# Процессов извлечения таблиц из PDF по умолчанию
+PDF_WORKERS = min(os.cpu_count() or 1, 4)
+# Таблица без линий сетки: границы колонок и строк по выравниванию текста
+PDF_TEXT_TABLE_SETTINGS = {'vertical_strategy': 'text', 'horizontal_strategy': 'text'}
+
+# Значения ячеек, которые pandas.read_excel по умолчанию превращает в NaN,
+# плюс коды ошибок Excel. Потоковый парсер трактует их как пустые ячейки,
+# чтобы результат совпадал с чтением через DataFrame.
+EMPTY_CELL_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a',
+    'nan', 'null',
+    '#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!',
+])
+
 # Цвет фона для категорий (золотисто-желтый и похожие оттенки)
 # Формат: RGB в формате AARRGGBB (с префиксом FF для альфа-канала)
 CATEGORY_BACKGROUND_COLORS = [
@@ -196,14 +236,134 @@ class ExcelPriceListParser:
     - Если в колонке 0 есть название И в колонке 2 есть единица измерения - это товар
     """
     
-    def __init__(self, file_path: str):
+    STREAMING_EXTENSIONS = ('.xlsx', '.xlsm')
+    # Версия формата результата; увеличивать при изменениях, влияющих на результат парсинга
+    # (входит в ключ кэша parse_cache)
+    VERSION = 1
+
+    def __init__(self, file_path: str, streaming: Optional[bool] = None,
+                 unit_aliases: Optional[Dict[str, str]] = None, layout: Optional[Dict] = None,
+                 sheets: Optional[Union[str, List[str]]] = None):
+        """
+        Args:
+            file_path: Путь к файлу прайс-листа
+            streaming: Потоковый режим (openpyxl read_only, без DataFrame).
+                None - включается автоматически для .xlsx/.xlsm
+            unit_aliases: Дополнительные написания единиц измерения поставщика
+                ({'рул': 'рулон'}), проверяются до эвристик
+            layout: Раскладка листа, найденная при прошлом импорте (detected_layout).
+                Если строка заголовка совпадает, поиск заголовка и колонок пропускается
+            sheets: Многолистовой режим: 'all' или список названий листов. Листы разбираются
+                по отдельности (parse_pool.parse_sheets), название листа - корневая категория.
+                None - один лист, как раньше
+        """
         self.file_path = file_path
+        self.streaming = streaming
+        self.unit_aliases = dict(unit_aliases or {})
+        self.layout = layout if isinstance(layout, dict) else None
+        self.sheets = sheets if sheets == 'all' or isinstance(sheets, list) else None
+        # Раскладка, по которой разобран файл; сохраняется в Supplier.parsing_config['layout']
+        self.detected_layout: Optional[Dict] = None
+        self.units = UnitDictionary(unit_aliases) if unit_aliases else DEFAULT_UNITS
+        # Время чтения файла и разбора строк в секундах (iter_products), для хода обработки
+        self.timings = {'read': 0.0, 'classify': 0.0}
         self.products = []
         self.categories = []
         self.current_category = None
         self.workbook = None
         self.worksheet = None
         
+    @classmethod
+    def for_supplier(cls, file_path: str, supplier, **kwargs) -> 'ExcelPriceListParser':
+        """Создает парсер с настройками из Supplier.parsing_config"""
+        config = supplier.parsing_config if isinstance(supplier.parsing_config, dict) else {}
+        unit_aliases = config.get('unit_aliases')
+        if isinstance(unit_aliases, dict):
+            kwargs.setdefault('unit_aliases', unit_aliases)
+        kwargs.setdefault('layout', config.get('layout'))
+        kwargs.setdefault('sheets', config.get('sheets'))
+        return cls(file_path, **kwargs)
+
+    def selected_sheets(self) -> List[str]:
+        """Листы многолистового режима в порядке книги (отсутствующие в файле пропускаются)"""
+        workbook = openpyxl.load_workbook(self.file_path, read_only=True)
+        try:
+            sheet_names = list(workbook.sheetnames)
+        finally:
+            workbook.close()
+        if self.sheets == 'all':
+            return sheet_names
+        missing = [name for name in self.sheets if name not in sheet_names]
+        if missing:
+            logger.warning(f"Листы не найдены в файле и пропущены: {', '.join(missing)}")
+        selected = [name for name in sheet_names if name in self.sheets]
+        if not selected:
+            raise ValueError(f"В файле нет ни одного из листов: {', '.join(self.sheets)}")
+        return selected
+
+    @staticmethod
+    def sheet_category(sheet_name: str, category: Optional[Union[str, tuple]]) -> Tuple[str, ...]:
+        """Путь категории товара в многолистовом режиме: лист - корень, категория листа - под ним"""
+        if not category:
+            return (sheet_name,)
+        if isinstance(category, str):
+            return (sheet_name, category)
+        return (sheet_name, *category)
+
+    def clone_kwargs(self) -> Dict:
+        """Аргументы для создания такого же однолистового парсера (например, в дочернем процессе)"""
+        return {
+            'streaming': self.streaming,
+            'unit_aliases': self.unit_aliases or None,
+            'layout': self.layout,
+        }
+
+    def cache_options(self) -> Dict:
+        """
+        Настройки, от которых зависит результат парсинга (часть ключа кэша).
+        layout входит: сохраненная строка заголовка может совпасть с файлом не там,
+        где его нашел бы полный поиск (повтор шапки ниже по листу), и товары будут другими.
+        """
+        return {'unit_aliases': self.unit_aliases, 'layout': self.layout}
+
+    def _layout_sheet_name(self) -> Optional[str]:
+        """Лист из сохраненной раскладки, если он есть в открытом файле"""
+        layout_sheet = self.layout.get('sheet_name') if self.layout else None
+        if layout_sheet and layout_sheet in self.workbook.sheetnames:
+            return layout_sheet
+        return None
+
+    def _layout_columns(self, rows: Sequence[Sequence], sheet_title: str) -> Optional[Tuple[int, tuple]]:
+        """
+        (строка заголовка, колонки) из сохраненной раскладки, если она подходит к файлу:
+        лист тот же, а в строке заголовка на месте колонок те же значения. Иначе None.
+        """
+        layout = self.layout
+        if not layout or (layout.get('sheet_name') and layout['sheet_name'] != sheet_title):
+            return None
+        try:
+            header_row = int(layout['header_row'])
+            columns = (int(layout['product_col']), int(layout['unit_col']), int(layout['price_col']))
+        except (KeyError, TypeError, ValueError):
+            return None
+        if header_row >= len(rows) or self._header_signature(rows[header_row], columns) != layout.get('header'):
+            return None
+        return header_row, columns
+
+    def _header_signature(self, header: Sequence, columns: tuple) -> List[Optional[str]]:
+        return [self._to_str_or_none(header[col]) if col < len(header) else None for col in columns]
+
+    def _remember_layout(self, sheet_title: str, header_row: int, columns: tuple, header: Optional[Sequence]):
+        product_col, unit_col, price_col = columns
+        self.detected_layout = {
+            'sheet_name': sheet_title,
+            'header_row': header_row,
+            'product_col': product_col,
+            'unit_col': unit_col,
+            'price_col': price_col,
+            'header': self._header_signature(header, columns) if header is not None else [None, None, None],
+        }
+    
     def parse(self, sheet_name: str = None) -> Dict:
         """
         Парсит Excel файл и возвращает словарь с товарами и категориями
@@ -221,10 +381,217 @@ class ExcelPriceListParser:
             'total_products': int
         }
         """
+        if not self._use_streaming():
+            return self._parse_dataframe(sheet_name)
+        self.products = [dict(zip(ProductBatch.FIELDS, row)) for row in self._iter_streaming(sheet_name)]
+        return {
+            'products': self.products,
+            'categories': self.categories,
+            'total_products': len(self.products)
+        }
+
+    def iter_products(self, sheet_name: str = None, chunk_size: int = PRODUCT_CHUNK_SIZE) -> Iterator[ProductBatch]:
+        """
+        Товары пачками ProductBatch по chunk_size по мере чтения файла.
+
+        В потоковом режиме первая пачка готова после chunk_size товаров, а не после
+        всего файла, и в памяти держится одна пачка; словари на строку не создаются.
+        Пачки разделяют таблицы единиц и категорий. self.categories заполнен
+        полностью, когда генератор исчерпан. В режиме DataFrame файл разбирается
+        целиком, затем результат отдается пачками.
+        """
+        units, categories = StringTable(), StringTable()
+        timings = self.timings
+        if not self._use_streaming():
+            started = time.perf_counter()
+            products = self._parse_dataframe(sheet_name)['products']
+            # В режиме DataFrame чтение и разбор не разделить - время считается чтением
+            timings['read'] += time.perf_counter() - started
+            for start in range(0, len(products), chunk_size):
+                yield ProductBatch.from_dicts(products[start:start + chunk_size], units, categories)
+            return
+
+        rows = self._iter_streaming(sheet_name)
+        while True:
+            batch = ProductBatch(units, categories)
+            started, read_before = time.perf_counter(), timings['read']
+            for row in islice(rows, chunk_size):
+                batch.append(*row)
+            # Разбор - все время пачки, кроме ожидания строк от файла (_timed_rows)
+            timings['classify'] += time.perf_counter() - started - (timings['read'] - read_before)
+            if not len(batch):
+                return
+            yield batch
+
+    def _use_streaming(self) -> bool:
+        if self.streaming is not None:
+            return self.streaming
+        return os.path.splitext(self.file_path)[1].lower() in self.STREAMING_EXTENSIONS
+
+    def _iter_streaming(self, sheet_name: str = None) -> Iterator[ProductRow]:
+        """
+        Потоковый парсинг: один проход по листу в режиме openpyxl read_only,
+        товары отдаются генератором по одному кортежем (name, article, unit, price, category).
+
+        Первые HEADER_SCAN_ROWS строк буферизуются для поиска заголовка и колонок,
+        дальше строки читаются генератором и сразу классифицируются, поэтому
+        потребление памяти не зависит от размера файла.
+
+        Правила те же, что и в _parse_dataframe. Строки после последней ячейки
+        с ценой не учитываются: найденные там категории откладываются и
+        добавляются только когда ниже встречается ещё одна цена.
+        """
+        try:
+            logger.info(f"Потоковое чтение файла: {self.file_path}")
+            self.workbook = openpyxl.load_workbook(self.file_path, read_only=True, data_only=True)
+            sheet_name = sheet_name or self._layout_sheet_name()
+            if sheet_name:
+                self.worksheet = self.workbook[sheet_name]
+            else:
+                # pandas.read_excel(sheet_name=None) берет первый лист, а не активный
+                self.worksheet = self.workbook.worksheets[0]
+            # Размеры в заголовке XML часто неверные - читаем все строки как есть
+            self.worksheet.reset_dimensions()
+
+            yield from self._iter_table(self._iter_rows(self.worksheet), self.worksheet.title)
+        except Exception as e:
+            logger.error(f"Ошибка парсинга Excel файла: {str(e)}", exc_info=True)
+            raise
+        finally:
+            if self.workbook:
+                self.workbook.close()
+
+    def _iter_table(self, rows: Iterator[Sequence], sheet_title: Optional[str]) -> Iterator[ProductRow]:
+        """
+        Разбор таблицы за один проход: rows - генератор значений строк (пустые ячейки - None).
+        Общая часть потокового парсинга Excel, CSV и PDF.
+        """
+        rows = self._timed_rows(rows)
+        window = []
+        layout = None
+        if self.layout and isinstance(self.layout.get('header_row'), int):
+            # Для проверки сохраненной раскладки достаточно строк до заголовка
+            window.extend(islice(rows, min(self.layout['header_row'] + 1, HEADER_SCAN_ROWS)))
+            layout = self._layout_columns(window, sheet_title)
+
+        if layout is not None:
+            header_row, columns = layout
+            logger.info(f"Используется сохраненная раскладка: заголовок в строке {header_row + 1}")
+        else:
+            window.extend(islice(rows, HEADER_SCAN_ROWS - len(window)))
+            header_row = self._find_header_row_new(window)
+            if header_row is None:
+                logger.warning("Не найдена строка с заголовком 'Наименование' или 'Товар'. Пробуем старый метод.")
+                header_row = self._find_header_row(window)
+                if header_row is None:
+                    header_row = 1  # Fallback: строка 2 (0-based индекс 1) для EuroGips
+
+            # Для умного поиска колонок нужны 20 строк данных после заголовка
+            needed = header_row + 21 - len(window)
+            if needed > 0:
+                window.extend(islice(rows, needed))
+
+            logger.info(f"Найдена строка заголовков: {header_row + 1} (индекс {header_row})")
+
+            header = window[header_row] if header_row < len(window) else None
+            columns = self._find_columns_by_header(header) if header is not None else None
+            if columns is None:
+                logger.warning("Не найдены точные заголовки. Пробуем умный поиск колонок.")
+                n_columns = max((self._row_width(values) for values in window), default=0)
+                columns = self._find_columns_smart(header, window[header_row + 1:header_row + 21], n_columns)
+        self._remember_layout(
+            sheet_title, header_row, columns, window[header_row] if header_row < len(window) else None
+        )
+        product_col, unit_col, price_col = columns
+
+        logger.info(f"Колонки: Товар={product_col}, Ед.изм={unit_col}, Цена={price_col}")
+
+        # Есть ли цена в строках до заголовка (влияет на поведение при полном отсутствии цен)
+        price_seen = any(
+            price_col < len(values) and values[price_col] is not None
+            for values in window[:header_row + 1]
+        )
+        pending_categories: List[str] = []
+        products_count = 0
+        data_rows = chain(window[header_row + 1:], rows)
+        for values in data_rows:
+            product_name = self._to_str_or_none(values[product_col]) if product_col < len(values) else None
+            unit = self._to_str_or_none(values[unit_col]) if unit_col < len(values) else None
+            price_raw = values[price_col] if price_col < len(values) else None
+            price = self._to_float_or_nan(price_raw)
+
+            kind = self._classify_row(product_name, unit, price)
+            if kind == 'category':
+                self.current_category = product_name
+                if product_name not in pending_categories:
+                    pending_categories.append(product_name)
+            elif kind == 'product':
+                products_count += 1
+                yield self._product_row(product_name, unit, price, self.current_category)
+
+            if price_raw is not None:
+                price_seen = True
+                for category in pending_categories:
+                    if category not in self.categories:
+                        self.categories.append(category)
+                pending_categories.clear()
+
+        # Если в колонке цены нет ни одного значения, берем все строки после заголовка
+        if not price_seen:
+            for category in pending_categories:
+                if category not in self.categories:
+                    self.categories.append(category)
+
+        logger.info(f"Парсинг завершен. Товаров: {products_count}, категорий: {len(self.categories)}")
+        if products_count == 0:
+            logger.warning("Не найдено ни одного товара! Проверьте структуру файла.")
+
+    def _timed_rows(self, rows: Iterator[Sequence]) -> Iterator[Sequence]:
+        """Строки из rows; время их получения (чтение файла) добавляется к timings['read']"""
+        timings = self.timings
+        clock = time.perf_counter
+        while True:
+            started = clock()
+            values = next(rows, None)
+            timings['read'] += clock() - started
+            if values is None:
+                return
+            yield values
+
+    def _iter_rows(self, worksheet) -> Iterator[list]:
+        """
+        Генератор значений строк листа (read_only, values_only - без стилей).
+
+        Значения приводятся к тому же виду, что дает pandas.read_excel:
+        пустые ячейки и ошибки - None, целые float - int.
+        """
+        for row in worksheet.iter_rows(values_only=True):
+            yield [self._cell_value(value) for value in row]
+
+    @staticmethod
+    def _cell_value(value):
+        if value is None:
+            return None
+        if isinstance(value, float):
+            return int(value) if value.is_integer() else value
+        if isinstance(value, str) and value in EMPTY_CELL_VALUES:
+            return None
+        return value
+
+    @staticmethod
+    def _row_width(values: Sequence) -> int:
+        width = len(values)
+        while width and values[width - 1] is None:
+            width -= 1
+        return width
+
+    def _parse_dataframe(self, sheet_name: str = None) -> Dict:
+        """Парсинг через pandas DataFrame (режим для .xls и отладки)"""
         try:
             # Открываем Excel файл для чтения цветов
             logger.info(f"Чтение файла: {self.file_path}")
             self.workbook = openpyxl.load_workbook(self.file_path, data_only=True)
+            sheet_name = sheet_name or self._layout_sheet_name()
             if sheet_name:
                 self.worksheet = self.workbook[sheet_name]
             else:
@@ -234,15 +601,16 @@ class ExcelPriceListParser:
             excel_data = pd.read_excel(self.file_path, sheet_name=sheet_name, header=None, engine='openpyxl')
             
             # Проверяем, что получили DataFrame, а не словарь (если несколько листов)
+            df_sheet = sheet_name
             if isinstance(excel_data, dict):
                 # Если словарь, берем первый лист или указанный лист
                 if sheet_name and sheet_name in excel_data:
                     df = excel_data[sheet_name]
                 else:
                     # Берем первый лист
-                    first_sheet = list(excel_data.keys())[0]
-                    df = excel_data[first_sheet]
-                    logger.info(f"Файл содержит несколько листов. Используется лист: {first_sheet}")
+                    df_sheet = list(excel_data.keys())[0]
+                    df = excel_data[df_sheet]
+                    logger.info(f"Файл содержит несколько листов. Используется лист: {df_sheet}")
             else:
                 df = excel_data
             
@@ -252,74 +620,39 @@ class ExcelPriceListParser:
             
             logger.info(f"Файл прочитан. Строк: {len(df)}, Колонок: {len(df.columns) if len(df) > 0 else 0}")
             
-            # Ищем строку с заголовком "Товар"
-            header_row = self._find_header_row_new(df)
+            layout = None
+            if self.layout and isinstance(self.layout.get('header_row'), int):
+                head = df.iloc[:self.layout['header_row'] + 1].values.tolist()
+                layout = self._layout_columns(head, df_sheet)
             
-            if header_row is None:
-                logger.warning("Не найдена строка с заголовком 'Наименование' или 'Товар'. Пробуем старый метод.")
-                header_row = self._find_header_row(df)
-                if header_row is None:
-                    header_row = 1  # Fallback: строка 2 (0-based индекс 1) для EuroGips
-            
-            logger.info(f"Найдена строка заголовков: {header_row + 1} (индекс {header_row})")
-            
-            # Получаем индексы колонок
-            header = df.iloc[header_row]
-            try:
-                # Ищем колонки по различным вариантам названий
-                product_col = None
-                unit_col = None
-                price_col = None
-                
-                # Расширенный список вариантов для названия товара
-                name_keywords = [
-                    'товар', 'наименование', 'название', 'наименование товара',
-                    'название товара', 'наименование продукции', 'продукт', 'изделие',
-                    'материал', 'позиция', 'артикул', 'описание'
-                ]
-                
-                # Ищем колонку с названием товара
-                for idx, val in enumerate(header):
-                    val_str = str(val).strip().lower() if pd.notna(val) else ''
-                    if any(keyword in val_str for keyword in name_keywords):
-                        product_col = idx
-                        break
-                
-                # Расширенный список вариантов для единицы измерения
-                unit_keywords = [
-                    'ед.изм', 'ед изм', 'единица измерения', 'ед', 'единица',
-                    'ед. изм', 'ед.изм.', 'единица', 'измерения', 'размерность'
-                ]
-                
-                # Ищем колонку с единицей измерения
-                for idx, val in enumerate(header):
-                    val_str = str(val).strip().lower() if pd.notna(val) else ''
-                    if any(keyword in val_str for keyword in unit_keywords):
-                        unit_col = idx
-                        break
+            if layout is not None:
+                header_row, columns = layout
+                logger.info(f"Используется сохраненная раскладка: заголовок в строке {header_row + 1}")
+            else:
+                # Ищем строку с заголовком "Товар" (сравнение всей таблицы разом)
+                header_mask = df.eq("Товар").any(axis=1).to_numpy()
+                header_row = int(header_mask.argmax()) if header_mask.any() else None
                 
-                # Расширенный список вариантов для цены
-                price_keywords = [
-                    'цена', 'цена продажи', 'цена за единицу', 'стоимость',
-                    'цена, руб', 'цена руб', 'цена (руб)', 'цена, сом', 'цена сом',
-                    'цена (сом)', 'розничная цена', 'оптовая цена', 'цена без ндс',
-                    'цена с ндс', 'сумма', 'стоимость, руб', 'стоимость, сом'
-                ]
+                if header_row is None:
+                    logger.warning("Не найдена строка с заголовком 'Наименование' или 'Товар'. Пробуем старый метод.")
+                    header_row = self._find_header_row(df.itertuples(index=False, name=None))
+                    if header_row is None:
+                        header_row = 1  # Fallback: строка 2 (0-based индекс 1) для EuroGips
                 
-                # Ищем колонку с ценой
-                for idx, val in enumerate(header):
-                    val_str = str(val).strip().lower() if pd.notna(val) else ''
-                    if any(keyword in val_str for keyword in price_keywords):
-                        price_col = idx
-                        break
+                logger.info(f"Найдена строка заголовков: {header_row + 1} (индекс {header_row})")
                 
-                if product_col is None or unit_col is None or price_col is None:
-                    raise IndexError("Не все колонки найдены по заголовкам")
-                    
-            except (IndexError, KeyError):
-                # Если не нашли точные заголовки, пробуем найти по ключевым словам и содержимому
-                logger.warning("Не найдены точные заголовки. Пробуем умный поиск колонок.")
-                product_col, unit_col, price_col = self._find_columns_smart(df, header_row)
+                # Получаем индексы колонок
+                columns = None
+                if header_row < len(df):
+                    columns = self._find_columns_by_header(df.iloc[header_row].tolist())
+                if columns is None:
+                    # Если не нашли точные заголовки, пробуем найти по ключевым словам и содержимому
+                    logger.warning("Не найдены точные заголовки. Пробуем умный поиск колонок.")
+                    header = df.iloc[header_row].tolist() if header_row < len(df) else None
+                    data_rows = df.iloc[header_row + 1:header_row + 21].values.tolist()
+                    columns = self._find_columns_smart(header, data_rows, len(df.columns))
+            self._remember_layout(df_sheet, header_row, columns, df.iloc[header_row].tolist() if header_row < len(df) else None)
+            product_col, unit_col, price_col = columns
             
             logger.info(f"Колонки: Товар={product_col}, Ед.изм={unit_col}, Цена={price_col}")
             
@@ -353,34 +686,91 @@ class ExcelPriceListParser:
                 self.workbook.close()
             raise
     
-    def _find_header_row_new(self, df: pd.DataFrame) -> Optional[int]:
+    def _find_header_row_new(self, rows: Iterable[Sequence]) -> Optional[int]:
         """Находит строку с заголовком 'Товар' (новый метод)"""
-        for idx, row in df.iterrows():
+        for idx, row in enumerate(rows):
             # Ищем строку, где в любой ячейке есть слово "Товар"
-            if (df.iloc[idx] == "Товар").any():
+            if "Товар" in row:
                 return idx
         return None
     
-    def _find_header_row(self, df: pd.DataFrame) -> Optional[int]:
+    def _find_header_row(self, rows: Iterable[Sequence]) -> Optional[int]:
         """Находит строку с заголовками таблицы (старый метод)"""
         header_keywords = ['товар', 'ед.изм', 'ед', 'цена', 'единица', 'измерения']
         
-        for idx, row in df.iterrows():
-            row_text = ' '.join([str(cell).lower() if pd.notna(cell) else '' for cell in row.values])
+        for idx, row in enumerate(rows):
+            row_text = ' '.join([str(cell).lower() if pd.notna(cell) else '' for cell in row])
             
             # Проверяем, содержит ли строка ключевые слова заголовков
             if any(keyword in row_text for keyword in header_keywords):
                 # Проверяем, что это действительно заголовки (не слишком много пустых ячеек)
-                non_empty = sum(1 for cell in row.values if pd.notna(cell) and str(cell).strip())
+                non_empty = sum(1 for cell in row if pd.notna(cell) and str(cell).strip())
                 if non_empty >= 2:  # Минимум 2 колонки должны быть заполнены
                     return idx
         
         return None
     
-    def _find_columns_smart(self, df: pd.DataFrame, header_row: int) -> tuple:
+    def _find_columns_by_header(self, header: Sequence) -> Optional[tuple]:
+        """Ищет колонки товара, единицы и цены по точным заголовкам. None - если не все найдены"""
+        product_col = None
+        unit_col = None
+        price_col = None
+        
+        # Расширенный список вариантов для названия товара
+        name_keywords = [
+            'товар', 'наименование', 'название', 'наименование товара',
+            'название товара', 'наименование продукции', 'продукт', 'изделие',
+            'материал', 'позиция', 'артикул', 'описание'
+        ]
+        
+        # Ищем колонку с названием товара
+        for idx, val in enumerate(header):
+            val_str = str(val).strip().lower() if pd.notna(val) else ''
+            if any(keyword in val_str for keyword in name_keywords):
+                product_col = idx
+                break
+        
+        # Расширенный список вариантов для единицы измерения
+        unit_keywords = [
+            'ед.изм', 'ед изм', 'единица измерения', 'ед', 'единица',
+            'ед. изм', 'ед.изм.', 'единица', 'измерения', 'размерность'
+        ]
+        
+        # Ищем колонку с единицей измерения
+        for idx, val in enumerate(header):
+            val_str = str(val).strip().lower() if pd.notna(val) else ''
+            if any(keyword in val_str for keyword in unit_keywords):
+                unit_col = idx
+                break
+        
+        # Расширенный список вариантов для цены
+        price_keywords = [
+            'цена', 'цена продажи', 'цена за единицу', 'стоимость',
+            'цена, руб', 'цена руб', 'цена (руб)', 'цена, сом', 'цена сом',
+            'цена (сом)', 'розничная цена', 'оптовая цена', 'цена без ндс',
+            'цена с ндс', 'сумма', 'стоимость, руб', 'стоимость, сом'
+        ]
+        
+        # Ищем колонку с ценой
+        for idx, val in enumerate(header):
+            val_str = str(val).strip().lower() if pd.notna(val) else ''
+            if any(keyword in val_str for keyword in price_keywords):
+                price_col = idx
+                break
+        
+        if product_col is None or unit_col is None or price_col is None:
+            return None
+        return product_col, unit_col, price_col
+    
+    def _find_columns_smart(self, header: Optional[Sequence], data_rows: Sequence[Sequence], n_columns: int) -> tuple:
         """
         Умный поиск колонок на основе анализа заголовков и содержимого данных
         
+        Args:
+            header: Значения строки заголовков (None, если строки нет)
+            data_rows: Первые 20 строк данных после заголовка
+            n_columns: Ширина таблицы
+        
         Алгоритм:
         1. Анализирует заголовки (если есть)
         2. Анализирует содержимое первых 20 строк данных для определения типов колонок
@@ -393,9 +783,7 @@ class ExcelPriceListParser:
         price_col = None
         
         # Сначала пробуем найти по заголовкам
-        if header_row < len(df):
-            header = df.iloc[header_row]
-            
+        if header is not None:
             # Расширенные варианты поиска в заголовках
             name_keywords = ['товар', 'наименование', 'название', 'продукт', 'материал', 'позиция', 'артикул', 'описание']
             unit_keywords = ['ед', 'изм', 'единиц', 'размерност']
@@ -412,10 +800,9 @@ class ExcelPriceListParser:
                         price_col = idx
         
         # Если не нашли все колонки по заголовкам, анализируем содержимое данных
-        data_start = header_row + 1
-        data_end = min(data_start + 20, len(df))  # Анализируем первые 20 строк данных
+        data_rows = data_rows[:20]  # Анализируем первые 20 строк данных
         
-        if data_start < len(df):
+        if data_rows:
             # Анализируем каждую колонку
             column_scores = {
                 'name': {},  # Оценка вероятности быть колонкой с названиями
@@ -423,15 +810,15 @@ class ExcelPriceListParser:
                 'price': {}  # Оценка вероятности быть колонкой с ценами
             }
             
-            for col_idx in range(len(df.columns)):
+            for col_idx in range(n_columns):
                 name_score = 0
                 unit_score = 0
                 price_score = 0
                 valid_rows = 0
                 
-                for row_idx in range(data_start, data_end):
+                for row in data_rows:
                     try:
-                        val = df.iloc[row_idx, col_idx]
+                        val = row[col_idx]
                         if pd.notna(val):
                             val_str = str(val).strip()
                             
@@ -482,14 +869,14 @@ class ExcelPriceListParser:
             # Ищем колонку рядом с названием или ценой
             if price_col is not None and price_col > 0:
                 unit_col = price_col - 1
-            elif product_col is not None and product_col < len(df.columns) - 1:
+            elif product_col is not None and product_col < n_columns - 1:
                 unit_col = product_col + 1
             else:
                 unit_col = 1
             logger.warning(f"Колонка с единицами не найдена, используется колонка {unit_col}")
         if price_col is None:
             # Ищем последнюю числовую колонку
-            price_col = len(df.columns) - 1
+            price_col = n_columns - 1
             logger.warning(f"Колонка с ценами не найдена, используется колонка {price_col}")
         
         return product_col, unit_col, price_col
@@ -591,198 +978,134 @@ class ExcelPriceListParser:
         Правила:
         - Если есть "Наименование", но нет "Ед.изм." и "Цена продажи" - это категория
         - Если есть "Наименование", "Ед.изм." и "Цена продажи" - это товар
-        """
-        current_category: Optional[str] = None
         
+        Строки классифицируются целыми колонками (см. _classify_frame), без iterrows().
+        """
         # Берём только строки с данными (между заголовком и последней ценой)
-        data = df.iloc[start_row:end_row].copy()
+        data = df.iloc[start_row:end_row]
+        frame = self._classify_frame(data, product_col, unit_col, price_col)
         
-        for idx, row in data.iterrows():
-            # Получаем значения из нужных колонок
-            product_name = None
-            unit = None
-            price = None
-            
-            try:
-                if product_col < len(row):
-                    product_name = self._to_str_or_none(row.iloc[product_col])
-            except (IndexError, KeyError):
-                pass
-            
-            try:
-                if unit_col < len(row):
-                    unit = self._to_str_or_none(row.iloc[unit_col])
-            except (IndexError, KeyError):
-                pass
-            
-            try:
-                if price_col < len(row):
-                    price = self._to_float_or_nan(row.iloc[price_col])
-            except (IndexError, KeyError):
-                pass
-            
-            # Пропускаем полностью пустые строки
-            if not product_name and not unit and math.isnan(price):
-                continue
-            
-            # Если есть название, но нет единицы измерения и цены - это категория
-            if product_name and (not unit or not self._is_unit_measurement(unit)) and math.isnan(price):
-                current_category = product_name
-                if current_category not in self.categories:
-                    self.categories.append(current_category)
-                logger.debug(f"Найдена категория: '{current_category}'")
-                continue
-            
-            # Если есть название, единица измерения и цена - это товар
-            if product_name and unit and self._is_unit_measurement(unit) and not math.isnan(price):
-                # Нормализуем единицу измерения
-                unit_normalized = self._normalize_unit(unit)
-                
-                # Генерируем артикул из названия
-                article = self._generate_article(product_name)
-                
-                product = {
-                    'name': product_name,
-                    'article': article,
-                    'unit': unit_normalized,
-                    'price': float(price),
-                    'category': current_category
-                }
-                
-                self.products.append(product)
-                logger.debug(f"Извлечен товар: {product_name}, цена: {price}, единица: {unit_normalized}, категория: {current_category}")
+        for category in pd.unique(frame.loc[frame['is_category'], 'name']):
+            if category not in self.categories:
+                self.categories.append(category)
+        
+        products = frame.loc[frame['is_product']]
+        unit_map = {unit: self._normalize_unit(unit) for unit in products['unit'].unique()}
+        for name, unit, price, category in zip(
+            products['name'], products['unit'], products['price'], products['category']
+        ):
+            self.products.append({
+                'name': name,
+                'article': self._generate_article(name),
+                'unit': unit_map[unit],
+                'price': float(price),
+                'category': category if isinstance(category, str) else None
+            })
         
         logger.info(f"Распознано товаров: {len(self.products)}, категорий: {len(self.categories)}")
         if len(self.products) == 0:
             logger.warning("Не найдено ни одного товара! Проверьте структуру файла.")
     
-    def _parse_data(self, df: pd.DataFrame, start_row: int):
-        """Парсит данные товаров из DataFrame
-        
-        Логика для Стройдвор (реальная структура файла):
-        - Колонка 0 (индекс 0): название товара/категории
-        - Колонка 1 (индекс 1): обычно пустая
-        - Колонка 2 (индекс 2): единица измерения (для товаров) или может быть число (для категорий)
-        - Колонка 3 (индекс 3): цена
+    def _classify_frame(self, data: pd.DataFrame, product_col: int, unit_col: int, price_col: int) -> pd.DataFrame:
+        """
+        Колоночная классификация строк (те же правила, что в _classify_row).
         
-        Правила определения категорий (в порядке приоритета):
-        1. Если ячейка в колонке 0 имеет цвет фона из CATEGORY_BACKGROUND_COLORS - это категория
-        2. Если в колонке 0 есть запись, но в колонке 2 нет единицы измерения - это категория
-        3. Если в колонке 0 есть запись И в колонке 2 есть единица измерения - это товар
+        Возвращает DataFrame с колонками name, unit, price, is_category, is_product
+        и category - текущая категория строки, протянутая вниз через ffill().
         """
-        current_category = None
+        n_columns = len(data.columns)
+        empty = pd.Series(None, index=data.index, dtype=object)
+        names = self._normalize_str_column(data.iloc[:, product_col]) if product_col < n_columns else empty
+        units = self._normalize_str_column(data.iloc[:, unit_col]) if unit_col < n_columns else empty
+        prices = (
+            self._normalize_price_column(data.iloc[:, price_col]) if price_col < n_columns
+            else pd.Series(float('nan'), index=data.index)
+        )
         
-        for idx in range(start_row, len(df)):
-            row = df.iloc[idx]
-            
-            # Пропускаем полностью пустые строки
-            if row.isna().all():
-                continue
-            
-            # Получаем значения конкретных колонок (по индексу)
-            # Колонка 0 (индекс 0) - название товара/категории
-            # Колонка 2 (индекс 2) - единица измерения
-            # Колонка 3 (индекс 3) - цена
-            
-            col0_value = str(row.iloc[0]).strip() if len(row) > 0 and pd.notna(row.iloc[0]) else ''
-            col2_value = str(row.iloc[2]).strip() if len(row) > 2 and pd.notna(row.iloc[2]) else ''
-            col3_value = str(row.iloc[3]).strip() if len(row) > 3 and pd.notna(row.iloc[3]) else ''
-            
-            # Пропускаем строки, где нет названия
-            if not col0_value:
-                continue
-            
-            # ПРИОРИТЕТ 1: Проверяем цвет фона ячейки в колонке 0 (A)
-            # Excel строки начинаются с 1, а pandas индексы с 0, поэтому idx+1
-            is_category_by_color = False
-            if self.worksheet:
-                try:
-                    cell = self.worksheet.cell(row=idx+1, column=1)  # Колонка A (1)
-                    fill = cell.fill
-                    is_category_by_color = is_category_color(fill)
-                    if is_category_by_color:
-                        color_info = 'unknown'
-                        if hasattr(fill.start_color, 'rgb') and fill.start_color.rgb:
-                            color_info = fill.start_color.rgb
-                        elif hasattr(fill.start_color, 'index'):
-                            color_info = f'index={fill.start_color.index}'
-                        logger.debug(f"Найдена категория по цвету фона: '{col0_value}', цвет: {color_info}")
-                except Exception as e:
-                    logger.debug(f"Ошибка чтения цвета ячейки row={idx+1}, col=1: {str(e)}")
-            
-            # Если ячейка имеет цвет категории - это категория, пропускаем проверку единицы измерения
-            if is_category_by_color:
-                current_category = col0_value
-                if current_category not in self.categories:
-                    self.categories.append(current_category)
-                logger.debug(f"Найдена категория (по цвету): {current_category}")
-                continue
-            
-            # ПРИОРИТЕТ 2: Проверяем, является ли значение в колонке 2 единицей измерения
-            is_unit = self._is_unit_measurement(col2_value)
-            
-            # Определяем тип строки по логике
-            # Если есть название (колонка 0), но нет единицы измерения в колонке 2 - это категория
-            if col0_value and not is_unit:
-                # Это категория
-                current_category = col0_value
-                if current_category not in self.categories:
-                    self.categories.append(current_category)
-                logger.debug(f"Найдена категория (по отсутствию единицы): {current_category}")
-                
-            # Если есть название (колонка 0) И есть единица измерения в колонке 2 - это товар
-            elif col0_value and is_unit:
-                # Это товар
-                product = self._extract_product_stroydvor(row, current_category)
-                if product:
-                    self.products.append(product)
+        # _is_unit_measurement вызывается один раз на уникальное значение, а не на строку
+        unit_values = units.dropna().unique()
+        unit_lookup = {unit: self._is_unit_measurement(unit) for unit in unit_values}
+        is_unit = units.map(unit_lookup).fillna(False).astype(bool)
         
-        logger.info(f"Распознано товаров: {len(self.products)}, категорий: {len(self.categories)}")
-        if len(self.products) == 0:
-            logger.warning("Не найдено ни одного товара! Проверьте структуру файла.")
-    
-    def _is_unit_measurement(self, value: str) -> bool:
-        """Проверяет, является ли значение единицей измерения"""
-        if not value:
-            return False
+        has_name = names.notna()
+        has_price = prices.notna()
+        is_category = has_name & ~is_unit & ~has_price
+        is_product = has_name & is_unit & has_price
         
-        value_upper = value.strip().upper()
+        return pd.DataFrame({
+            'name': names,
+            'unit': units,
+            'price': prices,
+            'is_category': is_category,
+            'is_product': is_product,
+            'category': names.where(is_category).ffill(),
+        })
+    
+    @staticmethod
+    def _normalize_str_column(column: pd.Series) -> pd.Series:
+        """Колоночный аналог _to_str_or_none: строки без пробелов по краям, пустые - None"""
+        result = pd.Series(None, index=column.index, dtype=object)
+        present = column.notna()
+        if present.any():
+            stripped = column[present].astype(str).str.strip()
+            result[present] = stripped.where(stripped != '', None)
+        return result
+    
+    def _normalize_price_column(self, column: pd.Series) -> pd.Series:
+        """Колоночный аналог _to_float_or_nan"""
+        if pd.api.types.is_numeric_dtype(column):
+            return column.astype(float)
         
-        # Список единиц измерения
-        units = ['ШТ', 'ШТУК', 'ШТУКИ', 'М', 'МЕТР', 'МЕТРЫ', 'М2', 'М²', 'М.КВ', 'М.КВ.', 'КВ.М', 'КВ.М.', 
-                 'М3', 'М³', 'М.КУБ', 'М.КУБ.', 'КГ', 'КИЛОГРАММ', 'КИЛОГРАММЫ', 'Т', 'ТОННА', 'ТОННЫ',
-                 'Л', 'ЛИТР', 'ЛИТРЫ', 'МЛ', 'МИЛЛИЛИТР']
+        result = pd.Series(float('nan'), index=column.index)
+        is_number = column.map(lambda v: isinstance(v, (int, float)))
+        result[is_number] = column[is_number].astype(float)
         
-        if value_upper in units:
-            return True
+        is_text = column.map(lambda v: isinstance(v, str))
+        if is_text.any():
+            cleaned = column[is_text].str.strip().str.replace(' ', '', regex=False).str.replace(',', '.', regex=False)
+            parsed = pd.to_numeric(cleaned, errors='coerce')
+            # Редкие строки, которые float() понимает, а to_numeric нет (например '1_000')
+            unparsed = parsed.isna() & (cleaned != '')
+            if unparsed.any():
+                parsed[unparsed] = cleaned[unparsed].map(self._to_float_or_nan)
+            result[is_text] = parsed.astype(float)
         
-        # Проверка по содержимому
-        if 'шт' in value.lower():
-            return True
-        elif 'м²' in value or 'м2' in value.upper() or ('кв' in value.lower() and 'м' in value.lower()):
-            return True
-        elif 'м³' in value or 'м3' in value.upper() or 'куб' in value.lower():
-            return True
-        elif 'кг' in value.lower():
-            return True
-        elif 'т' in value.lower() and ('тонн' in value.lower() or len(value) <= 3):
-            return True
-        elif 'л' in value.lower() and 'мл' not in value.lower():
-            return True
-        elif 'мл' in value.lower():
-            return True
-        elif 'м' in value.lower() and len(value) <= 5:  # Короткие значения с "м" могут быть единицами
-            return True
+        other = column.notna() & ~is_number & ~is_text
+        if other.any():
+            result[other] = column[other].map(self._to_float_or_nan)
+        return result
+    
+    def _classify_row(self, product_name: Optional[str], unit: Optional[str], price: float) -> Optional[str]:
+        """
+        Определяет тип строки формата EuroGips: 'category', 'product' или None (пропуск)
         
-        # Если это число, это не единица измерения
-        try:
-            float(re.sub(r'[^\d.]', '', value))
-            return False
-        except:
-            pass
+        - Есть название, но нет единицы измерения и цены - категория
+        - Есть название, единица измерения и цена - товар
+        """
+        # Пропускаем полностью пустые строки
+        if not product_name and not unit and math.isnan(price):
+            return None
         
-        return False
+        is_unit = bool(unit) and self._is_unit_measurement(unit)
+        if product_name and not is_unit and math.isnan(price):
+            return 'category'
+        if product_name and is_unit and not math.isnan(price):
+            return 'product'
+        return None
     
+    def _product_row(self, product_name: str, unit: str, price: float, category: Optional[str]) -> ProductRow:
+        """Строка товара в порядке ProductBatch.FIELDS"""
+        return (
+            product_name,
+            self._generate_article(product_name),
+            self._normalize_unit(unit),
+            float(price),
+            category,
+        )
+    
+    def _is_unit_measurement(self, value: str) -> bool:
+        """Проверяет, является ли значение единицей измерения (см. UnitDictionary)"""
+        return self.units.is_unit(value)
     
     def _extract_product_stroydvor(self, row: pd.Series, category: Optional[str]) -> Optional[Dict]:
         """Извлекает данные товара из строки для формата Стройдвор
@@ -847,62 +1170,7 @@ class ExcelPriceListParser:
     
     def _normalize_unit(self, unit_raw: str) -> str:
         """Нормализует единицу измерения к стандартному формату"""
-        unit_upper = unit_raw.strip().upper()
-        
-        # Прямые совпадения
-        unit_map = {
-            'ШТ': 'шт',
-            'ШТУК': 'шт',
-            'ШТУКИ': 'шт',
-            'М': 'м',
-            'МЕТР': 'м',
-            'МЕТРЫ': 'м',
-            'М2': 'м²',
-            'М²': 'м²',
-            'М.КВ': 'м²',
-            'М.КВ.': 'м²',
-            'КВ.М': 'м²',
-            'КВ.М.': 'м²',
-            'М3': 'м³',
-            'М³': 'м³',
-            'М.КУБ': 'м³',
-            'М.КУБ.': 'м³',
-            'КГ': 'кг',
-            'КИЛОГРАММ': 'кг',
-            'КИЛОГРАММЫ': 'кг',
-            'Т': 'т',
-            'ТОННА': 'т',
-            'ТОННЫ': 'т',
-            'Л': 'л',
-            'ЛИТР': 'л',
-            'ЛИТРЫ': 'л',
-            'МЛ': 'мл',
-            'МИЛЛИЛИТР': 'мл',
-        }
-        
-        if unit_upper in unit_map:
-            return unit_map[unit_upper]
-        
-        # Проверка по содержимому
-        if 'шт' in unit_raw.lower():
-            return 'шт'
-        elif 'м²' in unit_raw or 'м2' in unit_raw.upper() or 'кв' in unit_raw.lower():
-            return 'м²'
-        elif 'м³' in unit_raw or 'м3' in unit_raw.upper() or 'куб' in unit_raw.lower():
-            return 'м³'
-        elif 'кг' in unit_raw.lower():
-            return 'кг'
-        elif 'т' in unit_raw.lower() and 'тонн' in unit_raw.lower():
-            return 'т'
-        elif 'л' in unit_raw.lower() and 'мл' not in unit_raw.lower():
-            return 'л'
-        elif 'мл' in unit_raw.lower():
-            return 'мл'
-        elif 'м' in unit_raw.lower():
-            return 'м'
-        
-        # По умолчанию
-        return unit_raw.lower()
+        return self.units.normalize(unit_raw)
     
     def _generate_article(self, name: str) -> str:
         """Генерирует артикул из названия товара"""
@@ -918,11 +1186,214 @@ class ExcelPriceListParser:
             if article_parts:
                 article = ''.join(article_parts)
                 # Добавляем короткий хеш для уникальности
-                import hashlib
                 hash_part = hashlib.md5(name.encode()).hexdigest()[:4].upper()
                 return f"{article}-{hash_part}"
         
         # Если не получилось, используем хеш
-        import hashlib
         return hashlib.md5(name.encode()).hexdigest()[:8].upper()
 
+
+class CsvPriceListParser(ExcelPriceListParser):
+    """
+    Потоковый парсер CSV прайс-листов.
+
+    Файл читается модулем csv по строке, к строкам применяются те же правила поиска
+    заголовка, колонок и классификации, что и в потоковом режиме Excel (_iter_table),
+    поэтому память не зависит от размера файла. Кодировка (utf-8/cp1251) и разделитель
+    определяются по первым CSV_SNIFF_BYTES байтам, если не заданы явно
+    (parsing_config['csv_encoding'], parsing_config['csv_delimiter']).
+    Цветов в CSV нет: категории - строки с названием без цены.
+    """
+
+    VERSION = 1
+
+    def __init__(self, file_path: str, streaming: Optional[bool] = None,
+                 unit_aliases: Optional[Dict[str, str]] = None, layout: Optional[Dict] = None,
+                 sheets: Optional[Union[str, List[str]]] = None,
+                 encoding: Optional[str] = None, delimiter: Optional[str] = None):
+        # Режима DataFrame и листов у CSV нет
+        super().__init__(file_path, streaming=True, unit_aliases=unit_aliases, layout=layout)
+        self.encoding = encoding
+        self.delimiter = delimiter
+
+    @classmethod
+    def for_supplier(cls, file_path: str, supplier, **kwargs) -> 'CsvPriceListParser':
+        config = supplier.parsing_config if isinstance(supplier.parsing_config, dict) else {}
+        for option in ('encoding', 'delimiter'):
+            value = config.get(f'csv_{option}')
+            if isinstance(value, str) and value:
+                kwargs.setdefault(option, value)
+        return super().for_supplier(file_path, supplier, **kwargs)
+
+    def clone_kwargs(self) -> Dict:
+        return {**super().clone_kwargs(), 'encoding': self.encoding, 'delimiter': self.delimiter}
+
+    def cache_options(self) -> Dict:
+        return {**super().cache_options(), 'encoding': self.encoding, 'delimiter': self.delimiter}
+
+    def selected_sheets(self) -> List[str]:
+        raise ValueError('В CSV файле нет листов')
+
+    def _iter_streaming(self, sheet_name: str = None) -> Iterator[ProductRow]:
+        try:
+            encoding, delimiter = self.detect_format()
+            logger.info(f"Потоковое чтение CSV: {self.file_path} (кодировка {encoding}, разделитель {delimiter!r})")
+            with open(self.file_path, newline='', encoding=encoding, errors='replace') as f:
+                cell = self._csv_value
+                rows = ([cell(value) for value in row] for row in csv.reader(f, delimiter=delimiter))
+                yield from self._iter_table(rows, None)
+        except Exception as e:
+            logger.error(f"Ошибка парсинга CSV файла: {str(e)}", exc_info=True)
+            raise
+
+    def detect_format(self) -> Tuple[str, str]:
+        """(кодировка, разделитель): заданные явно или определенные по началу файла"""
+        with open(self.file_path, 'rb') as f:
+            sample = f.read(CSV_SNIFF_BYTES)
+        truncated = len(sample) == CSV_SNIFF_BYTES
+        encoding = self.encoding or self._detect_encoding(sample, truncated)
+        if self.delimiter:
+            return encoding, self.delimiter
+        lines = sample.decode(encoding, errors='ignore').splitlines()
+        if truncated:
+            # Последняя строка образца может быть оборвана
+            lines = lines[:-1]
+        return encoding, self._detect_delimiter([line for line in lines if line.strip()][:HEADER_SCAN_ROWS])
+
+    @staticmethod
+    def _detect_encoding(sample: bytes, truncated: bool) -> str:
+        if sample.startswith(b'\xef\xbb\xbf'):
+            return 'utf-8-sig'
+        try:
+            sample.decode('utf-8')
+        except UnicodeDecodeError as e:
+            # Образец мог оборваться посреди многобайтового символа
+            if not (truncated and e.start >= len(sample) - 3):
+                return 'cp1251'
+        return 'utf-8'
+
+    @staticmethod
+    def _detect_delimiter(lines: Sequence[str]) -> str:
+        """
+        Разделитель, который встречается в наибольшем числе строк одинаковое число раз.
+        csv.Sniffer здесь не подходит: запятая в ценах (12,50) сбивает его на ','.
+        """
+        best, best_score = CSV_DELIMITERS[0], 0
+        for delimiter in CSV_DELIMITERS:
+            counts = [line.count(delimiter) for line in lines]
+            counts = [count for count in counts if count]
+            if not counts:
+                continue
+            modal = max(set(counts), key=counts.count)
+            score = counts.count(modal)
+            if score > best_score:
+                best, best_score = delimiter, score
+        return best
+
+    @staticmethod
+    def _csv_value(value: str) -> Optional[str]:
+        value = value.strip()
+        if value in EMPTY_CELL_VALUES:
+            return None
+        return value
+
+
+def _pdf_cell(value: Optional[str]) -> Optional[str]:
+    """Ячейка таблицы PDF: перенесенный текст склеивается в строку, пустые значения - None"""
+    if value is None:
+        return None
+    value = ' '.join(value.split())
+    if value in EMPTY_CELL_VALUES:
+        return None
+    return value
+
+
+def extract_pdf_pages(file_path: str, first_page: int, last_page: int) -> List[List[List[Optional[str]]]]:
+    """
+    Строки таблиц страниц [first_page, last_page) по страницам: [страница][строка][ячейка].
+    Таблицы с сеткой ищутся по линиям, страницы без них - по выравниванию текста.
+    Выполняется в процессах пула PdfPriceListParser, поэтому функция модульная.
+    """
+    pages = []
+    with pdfplumber.open(file_path, pages=list(range(first_page + 1, last_page + 1))) as pdf:
+        for page in pdf.pages:
+            tables = page.extract_tables() or page.extract_tables(PDF_TEXT_TABLE_SETTINGS)
+            pages.append([[_pdf_cell(cell) for cell in row] for table in tables for row in table])
+            # pdfplumber кэширует разобранные объекты страницы
+            page.close()
+    return pages
+
+
+class PdfPriceListParser(ExcelPriceListParser):
+    """
+    Парсер PDF прайс-листов (таблицы, pdfplumber).
+
+    Документ делится на диапазоны по pages_per_task страниц, строки таблиц каждого
+    диапазона извлекаются в пуле процессов (самая медленная часть). Результаты
+    склеиваются в порядке страниц и проходят одним потоком через те же правила
+    поиска заголовка, колонок и классификации, что и Excel (_iter_table), поэтому
+    категория в конце страницы продолжается на следующей. Повтор заголовка таблицы
+    в начале страницы пропускается. В памяти держатся строки не больше чем
+    workers * 2 диапазонов.
+    """
+
+    VERSION = 1
+
+    def __init__(self, file_path: str, streaming: Optional[bool] = None,
+                 unit_aliases: Optional[Dict[str, str]] = None, layout: Optional[Dict] = None,
+                 sheets: Optional[Union[str, List[str]]] = None,
+                 workers: Optional[int] = None, pages_per_task: int = PDF_PAGES_PER_TASK):
+        super().__init__(file_path, streaming=True, unit_aliases=unit_aliases, layout=layout)
+        self.workers = workers or PDF_WORKERS
+        self.pages_per_task = max(pages_per_task, 1)
+
+    def clone_kwargs(self) -> Dict:
+        return {**super().clone_kwargs(), 'workers': self.workers, 'pages_per_task': self.pages_per_task}
+
+    def selected_sheets(self) -> List[str]:
+        raise ValueError('В PDF файле нет листов')
+
+    def _iter_streaming(self, sheet_name: str = None) -> Iterator[ProductRow]:
+        try:
+            logger.info(f"Извлечение таблиц из PDF: {self.file_path}")
+            yield from self._iter_table(self._iter_pdf_rows(), None)
+        except Exception as e:
+            logger.error(f"Ошибка парсинга PDF файла: {str(e)}", exc_info=True)
+            raise
+
+    def _iter_pdf_rows(self) -> Iterator[List[Optional[str]]]:
+        """Строки таблиц всех страниц по порядку без повторов заголовка на новых страницах"""
+        header = None
+        for page_rows in self._iter_pages():
+            if header is None:
+                header = next((row for row in page_rows if any(row)), None)
+            elif page_rows and page_rows[0] == header:
+                page_rows = page_rows[1:]
+            yield from page_rows
+
+    def _iter_pages(self) -> Iterator[List[List[Optional[str]]]]:
+        with pdfplumber.open(self.file_path) as pdf:
+            page_count = len(pdf.pages)
+        ranges = [
+            (first, min(first + self.pages_per_task, page_count))
+            for first in range(0, page_count, self.pages_per_task)
+        ]
+        logger.info(f"Страниц PDF: {page_count}, диапазонов: {len(ranges)}")
+        if len(ranges) <= 1 or self.workers <= 1:
+            for first, last in ranges:
+                yield from extract_pdf_pages(self.file_path, first, last)
+            return
+
+        with ProcessPoolExecutor(
+            max_workers=min(self.workers, len(ranges)), mp_context=multiprocessing.get_context('spawn')
+        ) as executor:
+            # Скользящее окно: порядок страниц сохраняется, а готовые диапазоны не копятся в памяти
+            pending = deque()
+            ranges_iter = iter(ranges)
+            for first, last in islice(ranges_iter, self.workers * 2):
+                pending.append(executor.submit(extract_pdf_pages, self.file_path, first, last))
+            while pending:
+                pages = pending.popleft().result()
+                for first, last in islice(ranges_iter, 1):
+                    pending.append(executor.submit(extract_pdf_pages, self.file_path, first, last))
+                yield from pages
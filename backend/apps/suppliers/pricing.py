@@ -0,0 +1,471 @@
+"""
+Расчет итоговых цен товаров (final_price).
+
+Цена считается по правилам наценки (PricingRule): из активных правил к товару применяется
+первое подходящее по priority - по поставщику, категории (с подкатегориями) и диапазону
+базовой цены. Без подходящего правила - базовая цена + наценка поставщика
+(Supplier.markup_som), без нее - процентная наценка товара (старый способ Product.save()).
+
+PricingRules компилирует правила один раз: в одно выражение CASE для пересчета в БД
+(UPDATE ... SET final_price = CASE ... END вместо product.save() на каждый товар) и в
+функцию final_price() для строк, которые пишутся из Python (импорт прайс-листов,
+Product.save()). Строки с уже верной ценой не переписываются, поэтому пересчет можно повторять.
+
+Пересчет поставщика после смены наценки: до SUPPLIER_PRICE_RECOMPUTE_SYNC_LIMIT товаров -
+сразу одним запросом, больше - обработчиком очереди прайс-листов (run_pricelist_worker)
+диапазонами id по SUPPLIER_PRICE_RECOMPUTE_BATCH_SIZE, каждый в своей транзакции.
+Так же диапазонами id идет пересчет всего каталога по правилам (apply_pricing,
+manage.py apply_pricing_rules); preview_pricing - пробный прогон: сколько цен изменится
+и как изменится наценка в сумме, без записи.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+from decimal import ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_UP, Decimal
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    Case, Count, DecimalField, F, FloatField, Func, IntegerField, Max, Min, Q, QuerySet, Subquery, Sum, Value,
+    When,
+)
+from django.db.models.functions import Cast, Ceil, Floor, Round
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from apps.catalog.models import Category, Product
+
+from .models import PricingRule, Supplier
+
+logger = logging.getLogger(__name__)
+
+PRICE_FIELD = DecimalField(max_digits=10, decimal_places=2)
+# Множитель 1 + наценка% / 100: у наценки два знака после запятой, у множителя - четыре (12.5% = 1.1250)
+MULTIPLIER_FIELD = DecimalField(max_digits=10, decimal_places=4)
+CENT = Decimal('0.01')
+
+# Округление до шага правила: в Python и в SQL
+DECIMAL_ROUNDING = {
+    PricingRule.ROUNDING_NEAREST: ROUND_HALF_UP,
+    PricingRule.ROUNDING_UP: ROUND_CEILING,
+    PricingRule.ROUNDING_DOWN: ROUND_FLOOR,
+}
+SQL_ROUNDING = {
+    PricingRule.ROUNDING_NEAREST: Round,
+    PricingRule.ROUNDING_UP: Ceil,
+    PricingRule.ROUNDING_DOWN: Floor,
+}
+
+
+class Divide(Func):
+    """a / b; SQLite делит целые нацело, поэтому там делимое приводится к REAL"""
+
+    arg_joiner = ' / '
+    template = '(%(expressions)s)'
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        dividend, divisor = self.get_source_expressions()
+        return Func(
+            Cast(dividend, FloatField()), divisor,
+            arg_joiner=self.arg_joiner, template=self.template, output_field=FloatField(),
+        ).as_sql(compiler, connection, **extra_context)
+
+
+class PricingRules:
+    """Активные правила наценки и наценки поставщиков, скомпилированные для расчета цен"""
+
+    def __init__(self, rules: List[PricingRule], supplier_markups: Dict[int, Decimal],
+                 category_parents: Dict[int, Optional[int]]):
+        self.rules = rules
+        self.supplier_markups = supplier_markups
+        self._parents = dict(category_parents)
+        self._ancestry: Dict[int, Set[int]] = {}
+
+    @classmethod
+    def load(cls) -> 'PricingRules':
+        rules = list(PricingRule.objects.filter(is_active=True).order_by('priority', 'id'))
+        supplier_markups = {
+            supplier_id: Decimal(str(markup))
+            for supplier_id, markup in Supplier.objects.exclude(markup_som=0).values_list('id', 'markup_som')
+        }
+        # Дерево категорий нужно только правилам по категориям
+        category_parents = (
+            dict(Category.objects.values_list('id', 'parent_id')) if any(rule.category_id for rule in rules) else {}
+        )
+        return cls(rules, supplier_markups, category_parents)
+
+    @classmethod
+    def for_product(cls, supplier_id: Optional[int]) -> 'PricingRules':
+        """Правила для одного товара (Product.save()) из кэша процесса, см. ProductPricingCache"""
+        return product_pricing.get(supplier_id)
+
+    @classmethod
+    def load_for_supplier(cls, supplier_id: Optional[int], markup) -> 'PricingRules':
+        """
+        Правила без поставщика и для supplier_id с наценкой markup этого поставщика; родители
+        категории дочитываются по уровням, только если до правила по категории дошла проверка.
+        """
+        rules = list(
+            PricingRule.objects.filter(is_active=True)
+            .filter(Q(supplier__isnull=True) | Q(supplier_id=supplier_id))
+            .order_by('priority', 'id')
+        )
+        supplier_markups = {supplier_id: Decimal(str(markup))} if markup else {}
+        return cls(rules, supplier_markups, {})
+
+    # Расчет в Python: импорт прайс-листов, Product.save()
+
+    def final_price(self, base_price, supplier_id: Optional[int], category_id: Optional[int],
+                    markup_percent=0) -> Decimal:
+        base_price = Decimal(str(base_price or 0))
+        rule = self.matching_rule(base_price, supplier_id, category_id)
+        if rule is not None:
+            return self._apply_rule(rule, base_price)
+        markup = self.supplier_markups.get(supplier_id)
+        if markup:
+            return base_price + markup
+        markup_percent = Decimal(str(markup_percent or 0))
+        if markup_percent:
+            return (base_price * (1 + markup_percent * CENT)).quantize(CENT, ROUND_HALF_UP)
+        return base_price
+
+    def matching_rule(self, base_price: Decimal, supplier_id: Optional[int],
+                      category_id: Optional[int]) -> Optional[PricingRule]:
+        for rule in self.rules:
+            if rule.supplier_id is not None and rule.supplier_id != supplier_id:
+                continue
+            if rule.category_id is not None and (
+                category_id is None or rule.category_id not in self._category_ancestry(category_id)
+            ):
+                continue
+            if rule.min_price is not None and base_price < rule.min_price:
+                continue
+            if rule.max_price is not None and base_price >= rule.max_price:
+                continue
+            return rule
+        return None
+
+    @staticmethod
+    def _apply_rule(rule: PricingRule, base_price: Decimal) -> Decimal:
+        price = base_price * (1 + rule.markup_percent * CENT) + rule.markup_som
+        if rule.round_to:
+            price = (price / rule.round_to).quantize(Decimal(1), DECIMAL_ROUNDING[rule.rounding]) * rule.round_to
+        return price.quantize(CENT, ROUND_HALF_UP)
+
+    def _category_ancestry(self, category_id: int) -> Set[int]:
+        """Категория и все ее родители; категории, созданные после загрузки правил, дочитываются"""
+        ancestry = self._ancestry.get(category_id)
+        if ancestry is None:
+            ancestry, current = set(), category_id
+            while current is not None and current not in ancestry:
+                ancestry.add(current)
+                if current not in self._parents:
+                    self._parents[current] = (
+                        Category.objects.filter(pk=current).values_list('parent_id', flat=True).first()
+                    )
+                current = self._parents[current]
+            self._ancestry[category_id] = ancestry
+        return ancestry
+
+    # Расчет в БД: одно выражение CASE на все правила
+
+    def expression(self) -> Case:
+        """final_price для UPDATE/annotate: ветки правил по priority, затем наценки поставщиков"""
+        whens, default = [], None
+        for rule, condition in self._conditions():
+            price = self._rule_expression(rule)
+            if condition is None:
+                default = price
+                break
+            whens.append(When(condition, then=price))
+        if default is None:
+            base_price = F('base_price')
+            # Поставщики с одинаковой наценкой - одна ветка
+            by_markup: Dict[Decimal, List[int]] = {}
+            for supplier_id, markup in self.supplier_markups.items():
+                by_markup.setdefault(markup, []).append(supplier_id)
+            for markup, supplier_ids in sorted(by_markup.items()):
+                whens.append(When(supplier_id__in=sorted(supplier_ids),
+                                  then=base_price + Value(markup, output_field=PRICE_FIELD)))
+            with_percent = base_price * (Value(Decimal(1)) + F('markup_percent') * Value(CENT))
+            whens.append(When(~Q(markup_percent=0), then=Round(with_percent, 2)))
+            default = base_price
+        return Case(*whens, default=default, output_field=PRICE_FIELD)
+
+    def rule_expression(self) -> Case:
+        """id правила, по которому считается цена товара (NULL - наценка поставщика)"""
+        whens, default = [], Value(None)
+        for rule, condition in self._conditions():
+            if condition is None:
+                default = Value(rule.id)
+                break
+            whens.append(When(condition, then=Value(rule.id)))
+        return Case(*whens, default=default, output_field=IntegerField())
+
+    def _conditions(self) -> List[Tuple[PricingRule, Optional[Q]]]:
+        """(правило, условие); None - правило без условий, подходит любому товару"""
+        conditions = []
+        for rule in self.rules:
+            condition = Q()
+            if rule.supplier_id is not None:
+                condition &= Q(supplier_id=rule.supplier_id)
+            if rule.category_id is not None:
+                condition &= Q(category_id__in=sorted(self._category_subtree(rule.category_id)))
+            if rule.min_price is not None:
+                condition &= Q(base_price__gte=rule.min_price)
+            if rule.max_price is not None:
+                condition &= Q(base_price__lt=rule.max_price)
+            conditions.append((rule, condition or None))
+        return conditions
+
+    def _category_subtree(self, category_id: int) -> Set[int]:
+        children: Dict[Optional[int], List[int]] = {}
+        for child, parent in self._parents.items():
+            children.setdefault(parent, []).append(child)
+        subtree, stack = set(), [category_id]
+        while stack:
+            current = stack.pop()
+            if current not in subtree:
+                subtree.add(current)
+                stack.extend(children.get(current, ()))
+        return subtree
+
+    @staticmethod
+    def _rule_expression(rule: PricingRule):
+        price = (
+            F('base_price') * Value(1 + rule.markup_percent * CENT, output_field=MULTIPLIER_FIELD)
+            + Value(rule.markup_som, output_field=PRICE_FIELD)
+        )
+        if rule.round_to:
+            step = Value(rule.round_to, output_field=PRICE_FIELD)
+            price = SQL_ROUNDING[rule.rounding](Divide(price, step, output_field=PRICE_FIELD)) * step
+        return Round(price, 2, output_field=PRICE_FIELD)
+
+
+class ProductPricingCache:
+    """
+    Правила для Product.save() по поставщикам в памяти процесса.
+
+    Перед расчетом одним запросом читаются наценка поставщика и отметка правил (число правил
+    и время последнего изменения) - столько же запросов, сколько Product.save() делал до правил.
+    Запись используется, только если отметка совпала, поэтому наценку и правила, измененные
+    другим процессом (веб, обработчик очереди), видно сразу. Родители категорий отметкой
+    не покрыты: изменения дерева сбрасывают кэш сигналом в этом процессе.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[Optional[int], Tuple[tuple, PricingRules]] = {}
+
+    def get(self, supplier_id: Optional[int]) -> PricingRules:
+        stamp = self._stamp(supplier_id)
+        with self._lock:
+            entry = self._entries.get(supplier_id)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        rules = PricingRules.load_for_supplier(supplier_id, stamp[0])
+        with self._lock:
+            self._entries[supplier_id] = (stamp, rules)
+        return rules
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @staticmethod
+    def _stamp(supplier_id: Optional[int]) -> tuple:
+        """(наценка поставщика, число правил, последнее изменение правил) одним запросом"""
+        rules = PricingRule.objects.order_by()
+        rules_count = Subquery(rules.annotate(total=Func(F('id'), function='COUNT')).values('total'))
+        rules_changed = Subquery(rules.order_by('-updated_at').values('updated_at')[:1])
+        if supplier_id is not None:
+            row = Supplier.objects.filter(pk=supplier_id).values_list(
+                'markup_som', rules_count, rules_changed,
+            ).first()
+            if row is not None:
+                return row
+        stamp = PricingRule.objects.aggregate(total=Count('id'), changed=Max('updated_at'))
+        return None, stamp['total'], stamp['changed']
+
+
+product_pricing = ProductPricingCache()
+
+
+@receiver([post_save, post_delete], sender=PricingRule)
+@receiver([post_save, post_delete], sender=Category)
+def _reset_product_pricing(sender, **kwargs):
+    product_pricing.clear()
+
+
+def update_final_prices(products: QuerySet, price, batch_size: Optional[int]) -> Tuple[int, int]:
+    """UPDATE final_price = price для товаров с другой ценой; batch_size - ширина диапазона id"""
+    changed = products.exclude(final_price=price)
+    if not batch_size:
+        return changed.update(final_price=price), 1
+    rows = batches = 0
+    bounds = products.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is not None:
+        for low in range(bounds['low'], bounds['high'] + 1, batch_size):
+            with transaction.atomic():
+                rows += changed.filter(id__gte=low, id__lt=low + batch_size).update(final_price=price)
+            batches += 1
+    return rows, batches
+
+
+def recompute_final_prices(supplier_id: int, batch_size: Optional[int] = None,
+                           rules: Optional[PricingRules] = None) -> Dict:
+    """
+    Пересчитывает final_price товаров поставщика по правилам и его текущей наценке.
+    batch_size - ширина диапазона id на один UPDATE (None - один запрос на всех).
+    Возвращает сводку {'supplier_id', 'markup', 'rows', 'batches', 'seconds', 'deferred'}.
+    """
+    started = time.monotonic()
+    rules = rules or PricingRules.load()
+    markup = rules.supplier_markups.get(supplier_id, Decimal(0))
+    rows, batches = update_final_prices(Product.objects.filter(supplier_id=supplier_id), rules.expression(), batch_size)
+
+    seconds = time.monotonic() - started
+    logger.info(
+        f'Пересчитаны цены поставщика {supplier_id} с наценкой {markup} сом: '
+        f'изменено {rows} товаров, запросов {batches}, {seconds:.2f} с'
+    )
+    return {
+        'supplier_id': supplier_id,
+        'markup': str(markup),
+        'rows': rows,
+        'batches': batches,
+        'seconds': round(seconds, 3),
+        'deferred': False,
+    }
+
+
+def request_price_recompute(supplier: Supplier) -> Dict:
+    """
+    Пересчет после смены наценки: до SUPPLIER_PRICE_RECOMPUTE_SYNC_LIMIT товаров - сразу,
+    больше - отметка prices_recompute_requested_at для обработчика очереди.
+    Повторная смена наценки до пересчета лишь сдвигает отметку: пересчет будет один.
+    """
+    limit = settings.SUPPLIER_PRICE_RECOMPUTE_SYNC_LIMIT
+    if not Product.objects.filter(supplier=supplier)[limit:limit + 1].exists():
+        return recompute_final_prices(supplier.pk)
+
+    supplier.prices_recompute_requested_at = timezone.now()
+    Supplier.objects.filter(pk=supplier.pk).update(prices_recompute_requested_at=supplier.prices_recompute_requested_at)
+    logger.info(f'Пересчет цен поставщика {supplier.pk} поставлен в очередь')
+    return {'supplier_id': supplier.pk, 'markup': str(supplier.markup_som), 'deferred': True}
+
+
+def run_pending_recompute() -> Optional[Dict]:
+    """
+    Выполняет самый старый запрошенный пересчет (для обработчика очереди) и возвращает сводку,
+    None - пересчитывать нечего.
+
+    Поставщик забирается как задания прайс-листов (claim_job): строка блокируется с SKIP LOCKED,
+    и на SUPPLIER_PRICE_RECOMPUTE_LEASE_SECONDS ставится prices_recompute_run_after - другие
+    обработчики этот пересчет не берут, а за упавшим он вернется по истечении срока. Ошибка
+    откладывает повтор (retry_delay), после PRICELIST_JOB_MAX_ATTEMPTS попыток отметка снимается
+    с ошибкой в prices_recompute_error, чтобы поставщик не занимал очередь. Отметка снимается,
+    только если за время пересчета наценку не меняли снова; иначе пересчет повторится со свежей наценкой.
+    """
+    from .jobs import retry_delay
+
+    now = timezone.now()
+    with transaction.atomic():
+        pending = (
+            Supplier.objects.select_for_update(skip_locked=True)
+            .filter(prices_recompute_requested_at__isnull=False)
+            .filter(Q(prices_recompute_run_after__isnull=True) | Q(prices_recompute_run_after__lte=now))
+            .order_by('prices_recompute_requested_at', 'id')
+            .values('id', 'prices_recompute_requested_at', 'prices_recompute_attempts')
+            .first()
+        )
+        if pending is None:
+            return None
+        attempts = pending['prices_recompute_attempts'] + 1
+        Supplier.objects.filter(pk=pending['id']).update(
+            prices_recompute_run_after=now + timedelta(seconds=settings.SUPPLIER_PRICE_RECOMPUTE_LEASE_SECONDS),
+            prices_recompute_attempts=attempts,
+        )
+
+    supplier = Supplier.objects.filter(pk=pending['id'])
+    try:
+        summary = recompute_final_prices(pending['id'], settings.SUPPLIER_PRICE_RECOMPUTE_BATCH_SIZE)
+    except Exception as e:
+        logger.exception(f'Ошибка пересчета цен поставщика {pending["id"]}')
+        if attempts < settings.PRICELIST_JOB_MAX_ATTEMPTS:
+            delay = retry_delay(attempts)
+            supplier.update(prices_recompute_run_after=timezone.now() + timedelta(seconds=delay),
+                            prices_recompute_error=str(e))
+            logger.warning(f'Пересчет цен поставщика {pending["id"]} повторится через {delay} с')
+        else:
+            supplier.filter(prices_recompute_requested_at=pending['prices_recompute_requested_at']).update(
+                prices_recompute_requested_at=None,
+            )
+            supplier.update(prices_recompute_run_after=None, prices_recompute_attempts=0, prices_recompute_error=str(e))
+            logger.error(f'Пересчет цен поставщика {pending["id"]} снят с очереди после {attempts} попыток')
+        return {'supplier_id': pending['id'], 'error': str(e), 'deferred': True}
+
+    supplier.filter(prices_recompute_requested_at=pending['prices_recompute_requested_at']).update(
+        prices_recompute_requested_at=None,
+    )
+    supplier.update(prices_recompute_run_after=None, prices_recompute_attempts=0, prices_recompute_error='')
+    return summary
+
+
+def preview_pricing(rules: Optional[PricingRules] = None) -> Dict:
+    """
+    Пробный прогон правил по всему каталогу без записи, два запроса:
+    сколько цен изменится и сумма наценки (final_price - base_price) до и после,
+    в целом и по правилам (rule_id None - товары без правила, по наценке поставщика).
+    """
+    rules = rules or PricingRules.load()
+    products = Product.objects.annotate(new_price=rules.expression(), rule_id=rules.rule_expression())
+    changed = ~Q(final_price=F('new_price'))
+    totals = {
+        'products': Count('id'),
+        'changed': Count('id', filter=changed),
+        'margin_before': Sum(F('final_price') - F('base_price'), output_field=PRICE_FIELD),
+        'margin_after': Sum(F('new_price') - F('base_price'), output_field=PRICE_FIELD),
+    }
+    by_rule = list(products.values('rule_id').annotate(**totals).order_by('rule_id'))
+    summary = products.aggregate(**totals)
+    names = {rule.id: rule.name for rule in rules.rules}
+    for group in [summary, *by_rule]:
+        group['margin_before'] = group['margin_before'] or Decimal(0)
+        group['margin_after'] = group['margin_after'] or Decimal(0)
+        group['margin_delta'] = group['margin_after'] - group['margin_before']
+    for group in by_rule:
+        group['rule_name'] = names.get(group['rule_id'], 'Наценка поставщика')
+    summary['by_rule'] = by_rule
+    return summary
+
+
+def apply_pricing(batch_size: Optional[int] = None) -> Dict:
+    """Пересчет final_price всего каталога по правилам диапазонами id; сводка как у recompute_final_prices"""
+    started = time.monotonic()
+    rules = PricingRules.load()
+    batch_size = batch_size or settings.SUPPLIER_PRICE_RECOMPUTE_BATCH_SIZE
+    rows, batches = update_final_prices(Product.objects.all(), rules.expression(), batch_size)
+    seconds = time.monotonic() - started
+    logger.info(f'Цены каталога пересчитаны по {len(rules.rules)} правилам: изменено {rows} товаров, {seconds:.2f} с')
+    return {'rules': len(rules.rules), 'rows': rows, 'batches': batches, 'seconds': round(seconds, 3), 'deferred': False}
+
+
+def request_pricing_apply() -> Dict:
+    """
+    Пересчет каталога из админки: небольшой каталог - сразу, большой - отметка на всех
+    поставщиках для обработчика очереди (товары без поставщика пересчитываются сразу)
+    """
+    limit = settings.SUPPLIER_PRICE_RECOMPUTE_SYNC_LIMIT
+    if not Product.objects.all()[limit:limit + 1].exists():
+        return apply_pricing()
+    suppliers = Supplier.objects.update(prices_recompute_requested_at=timezone.now())
+    rows, _ = update_final_prices(
+        Product.objects.filter(supplier__isnull=True), PricingRules.load().expression(),
+        settings.SUPPLIER_PRICE_RECOMPUTE_BATCH_SIZE,
+    )
+    logger.info(f'Пересчет цен каталога поставлен в очередь: поставщиков {suppliers}')
+    return {'suppliers': suppliers, 'rows': rows, 'deferred': True}
@@ -0,0 +1,122 @@
+"""
+Ход обработки прайс-листа для админки.
+
+Фаза, число разобранных и записанных строк, скорость, оценка времени до конца и
+время по этапам: чтение файла (read), разбор строк (classify), сравнение с каталогом
+(diff) и запись в БД (write). Хранится в PriceList.progress и обновляется на границах
+пачек импорта одним UPDATE, не чаще раза в PRICELIST_PROGRESS_INTERVAL секунд.
+"""
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import PriceList
+
+STAGES = ('read', 'classify', 'diff', 'write')
+
+
+class ImportProgress:
+    """Счетчики и таймеры одной обработки прайс-листа; price_list_id=None - без сохранения"""
+
+    PHASE_QUEUED = 'queued'
+    PHASE_PARSE = 'parse'
+    PHASE_IMPORT = 'import'
+    PHASE_SWEEP = 'sweep'
+    PHASE_DONE = 'done'
+
+    def __init__(self, price_list_id: Optional[int] = None, interval: Optional[float] = None):
+        self.price_list_id = price_list_id
+        self.interval = settings.PRICELIST_PROGRESS_INTERVAL if interval is None else interval
+        self.phase = self.PHASE_QUEUED
+        self.rows_written = 0
+        self.durations = dict.fromkeys(STAGES, 0.0)
+        self.phases: Dict[str, float] = {}
+        self.stream = None
+        self._started = time.monotonic()
+        self._phase_started = self._started
+        self._import_started: Optional[float] = None
+        self._saved_at: Optional[float] = None
+
+    def track(self, stream):
+        """Поток товаров (ParseStream и аналоги): из него берутся разобранные строки и время парсера"""
+        self.stream = stream
+
+    def start_phase(self, phase: str):
+        now = time.monotonic()
+        if self.phase != self.PHASE_QUEUED:
+            self.phases[self.phase] = round(self.phases.get(self.phase, 0.0) + now - self._phase_started, 3)
+        self.phase = phase
+        self._phase_started = now
+        if phase == self.PHASE_IMPORT:
+            self._import_started = now
+        self.save(force=True)
+
+    def finish(self):
+        self.start_phase(self.PHASE_DONE)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Время блока добавляется к этапу name (diff, write)"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] += time.perf_counter() - started
+
+    def batch_done(self, rows_written: int):
+        """Граница пачки импорта: rows_written - сколько строк потока обработано"""
+        self.rows_written = rows_written
+        self.save()
+
+    @property
+    def rows_parsed(self) -> int:
+        return self.stream.total_products if self.stream is not None else 0
+
+    @property
+    def rows_total(self) -> Optional[int]:
+        """Сколько строк всего, если парсинг уже закончен (иначе None)"""
+        return self.stream.expected_total if self.stream is not None else None
+
+    def rows_per_sec(self) -> Optional[float]:
+        if self._import_started is None:
+            return None
+        elapsed = time.monotonic() - self._import_started
+        return self.rows_written / elapsed if elapsed > 0 else None
+
+    def eta_seconds(self) -> Optional[float]:
+        rate, total = self.rows_per_sec(), self.rows_total
+        if not rate or total is None or self.phase != self.PHASE_IMPORT:
+            return None
+        return max(total - self.rows_written, 0) / rate
+
+    def as_dict(self) -> Dict:
+        durations = dict(self.durations)
+        timings = getattr(self.stream, 'timings', None) or {}
+        # Чтение и разбор меряет парсер (в том числе в дочернем процессе)
+        for stage in ('read', 'classify'):
+            durations[stage] += timings.get(stage, 0.0)
+        rate, eta = self.rows_per_sec(), self.eta_seconds()
+        return {
+            'phase': self.phase,
+            'rows_parsed': self.rows_parsed,
+            'rows_written': self.rows_written,
+            'rows_total': self.rows_total,
+            'rows_per_sec': round(rate, 1) if rate is not None else None,
+            'eta_seconds': round(eta) if eta is not None else None,
+            'elapsed_seconds': round(time.monotonic() - self._started, 3),
+            'durations': {stage: round(value, 3) for stage, value in durations.items()},
+            'phases': dict(self.phases),
+            'updated_at': timezone.now().isoformat(),
+        }
+
+    def save(self, force: bool = False):
+        if self.price_list_id is None:
+            return
+        now = time.monotonic()
+        if not force and self._saved_at is not None and now - self._saved_at < self.interval:
+            return
+        self._saved_at = now
+        PriceList.objects.filter(pk=self.price_list_id).update(progress=self.as_dict())
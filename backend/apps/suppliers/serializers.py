@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Supplier, PriceList
+from .models import Supplier, PriceList, PricingRule
 
 
 class SupplierSerializer(serializers.ModelSerializer):
@@ -47,6 +47,21 @@ class SupplierCreateUpdateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Наценка не может быть отрицательной")
         return value
 
+    def validate_parsing_config(self, value):
+        """unit_aliases - словарь {написание: единица} из строк"""
+        if value is None:
+            return {}
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Конфигурация парсинга должна быть объектом")
+        unit_aliases = value.get('unit_aliases')
+        if unit_aliases is not None:
+            if not isinstance(unit_aliases, dict) or not all(
+                isinstance(k, str) and isinstance(v, str) and k.strip() and v.strip()
+                for k, v in unit_aliases.items()
+            ):
+                raise serializers.ValidationError("unit_aliases должен быть словарем вида {\"рул\": \"рулон\"}")
+        return value
+
 
 class PriceListSerializer(serializers.ModelSerializer):
     supplier = SupplierSerializer(read_only=True)
@@ -55,8 +70,10 @@ class PriceListSerializer(serializers.ModelSerializer):
     class Meta:
         model = PriceList
         fields = ['id', 'supplier', 'supplier_id', 'file', 'parsing_method', 'parsing_config',
-                  'uploaded_at', 'processed_at', 'status', 'log', 'products_count']
-        read_only_fields = ['uploaded_at', 'processed_at', 'status', 'log', 'products_count']
+                  'uploaded_at', 'processed_at', 'status', 'log', 'products_count', 'diff_summary',
+                  'parse_progress', 'progress']
+        read_only_fields = ['uploaded_at', 'processed_at', 'status', 'log', 'products_count', 'diff_summary',
+                            'parse_progress', 'progress']
 
     def create(self, validated_data):
         supplier_id = validated_data.pop('supplier_id', None)
@@ -71,3 +88,32 @@ class PriceListCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = PriceList
         fields = ['supplier_id', 'file', 'parsing_method', 'parsing_config']
+
+
+class PricingRuleSerializer(serializers.ModelSerializer):
+    supplier_name = serializers.CharField(source='supplier.name', read_only=True, default=None)
+    category_name = serializers.CharField(source='category.name', read_only=True, default=None)
+
+    class Meta:
+        model = PricingRule
+        fields = ['id', 'name', 'priority', 'is_active', 'supplier', 'supplier_name', 'category', 'category_name',
+                  'min_price', 'max_price', 'markup_percent', 'markup_som', 'round_to', 'rounding',
+                  'created_at', 'updated_at']
+        read_only_fields = ['created_at', 'updated_at']
+
+    def validate_markup_percent(self, value):
+        if value <= -100:
+            raise serializers.ValidationError("Наценка должна быть больше -100%")
+        return value
+
+    def validate_round_to(self, value):
+        if value is not None and value <= 0:
+            raise serializers.ValidationError("Шаг округления должен быть положительным")
+        return value
+
+    def validate(self, attrs):
+        min_price = attrs.get('min_price', getattr(self.instance, 'min_price', None))
+        max_price = attrs.get('max_price', getattr(self.instance, 'max_price', None))
+        if min_price is not None and max_price is not None and min_price >= max_price:
+            raise serializers.ValidationError({'max_price': 'Верхняя граница цены должна быть больше нижней'})
+        return attrs
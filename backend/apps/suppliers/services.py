@@ -0,0 +1,468 @@
+"""
+Сервисы импорта прайс-листов в каталог
+"""
+import hashlib
+import logging
+import queue
+import threading
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from apps.catalog.models import Product
+from apps.catalog.services import CategoryPath, CategoryResolver, category_path
+from .batches import ProductBatch, StringTable
+from .models import Supplier, PriceList
+from .pricing import PricingRules
+from .progress import ImportProgress
+
+logger = logging.getLogger(__name__)
+
+PRICE_QUANT = Decimal('0.01')
+
+
+def to_price(value) -> Decimal:
+    """Цена из результата парсера (float/str) в Decimal с двумя знаками"""
+    try:
+        return Decimal(str(value or 0)).quantize(PRICE_QUANT)
+    except (InvalidOperation, ValueError):
+        return Decimal('0.00')
+
+
+class ImportCancelled(Exception):
+    """
+    Обработка прайс-листа отменена. summary - счетчики уже закоммиченных пачек,
+    rows_written - сколько строк потока записано до отмены.
+    """
+
+    def __init__(self, message: str = 'Обработка отменена', summary: Optional[Dict[str, int]] = None,
+                 rows_written: int = 0):
+        super().__init__(message)
+        self.summary = summary or {}
+        self.rows_written = rows_written
+
+
+def content_fingerprint(name: str, unit: str, base_price: Decimal, category_id: Optional[int]) -> bytes:
+    """Отпечаток содержимого товара из прайс-листа: название, единица, цена, категория"""
+    value = f'{name}\x1f{unit}\x1f{base_price}\x1f{category_id}'
+    return hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+
+
+def format_import_log(found_count: int, summary: dict) -> str:
+    """Строка для PriceList.log по сводке импорта"""
+    return (
+        f"Импортировано товаров: {found_count}, обработано: {summary['total']} "
+        f"(создано: {summary['created']}, обновлено: {summary['updated']}, "
+        f"без изменений: {summary['unchanged']}, отсутствуют в прайсе: {summary.get('vanished', 0)}, "
+        f"снято с продажи: {summary.get('deactivated', 0)})"
+    )
+
+
+def save_detected_layout(supplier: Supplier, layout: Optional[dict]):
+    """
+    Сохраняет раскладку листа, найденную парсером, в Supplier.parsing_config['layout'],
+    чтобы следующий импорт поставщика не искал заголовок и колонки заново.
+    """
+    if not layout:
+        return
+    with transaction.atomic():
+        supplier = Supplier.objects.select_for_update().get(pk=supplier.pk)
+        config = supplier.parsing_config if isinstance(supplier.parsing_config, dict) else {}
+        if config.get('layout') == layout:
+            return
+        supplier.parsing_config = {**config, 'layout': layout}
+        supplier.save(update_fields=['parsing_config'])
+    logger.info(f'Сохранена раскладка прайс-листа поставщика {supplier.name}: {layout}')
+
+
+def prefetch(iterable: Iterable, max_items: int, on_wait: Optional[Callable[[], None]] = None,
+             wait_interval: float = 1.0) -> Iterator:
+    """
+    Итерирует iterable в отдельном потоке через очередь на max_items элементов.
+
+    Используется между парсером и импортом: пока импорт пишет пачку в БД, парсер
+    готовит следующие, но не уходит вперед больше чем на max_items пачек.
+    Исключение из iterable пробрасывается потребителю; если потребитель прекращает
+    чтение, поток-производитель останавливается и закрывает iterable, а если у iterable
+    есть interrupt() - он вызывается, чтобы прервать ожидание внутри итерации
+    (parse_pool.ChildParseStream ждет дочерний процесс).
+
+    on_wait() вызывается в потоке потребителя раз в wait_interval секунд, пока очередь
+    пуста (check_cancelled: отмена срабатывает, даже если парсинг долго не отдает пачек);
+    его исключение прекращает чтение.
+    """
+    items: queue.Queue = queue.Queue(maxsize=max_items)
+    stop = threading.Event()
+    done = object()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    producer = threading.Thread(target=produce, name='pricelist-parse', daemon=True)
+    producer.start()
+    try:
+        while True:
+            try:
+                item, error = items.get(timeout=wait_interval if on_wait is not None else None)
+            except queue.Empty:
+                on_wait()
+                continue
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        interrupt = getattr(iterable, 'interrupt', None)
+        if interrupt is not None:
+            interrupt()
+        producer.join()
+
+
+class PriceListImporter:
+    """
+    Пакетный импорт товаров из результата парсинга.
+
+    Перед записью строки сравниваются с текущими товарами поставщика (один запрос)
+    по артикулу и отпечатку содержимого (content_fingerprint): новые, измененные,
+    неизмененные, а товары, которых нет в новом прайсе, - исчезнувшие. Пишутся только
+    новые и измененные - через bulk_create(update_conflicts=True) по уникальному ключу
+    (supplier, article), так что updated_at меняется только у них; неизмененным одним
+    UPDATE проставляется ссылка на прайс-лист (updated_at не трогается). Сводка
+    сравнения сохраняется в PriceList.diff_summary. Запись идет
+    пачками в отдельных транзакциях, без одной длинной транзакции на весь файл.
+    После загрузки товары поставщика, не попавшие в прайс-лист, снимаются с продажи
+    одним UPDATE (_sweep); grace_imports позволяет держать их активными еще N импортов.
+    Пустой прайс-лист или встреченная доля активных товаров меньше PRICELIST_SWEEP_MIN_SHARE
+    снятие не запускают - причина записывается в сводку (sweep_skipped).
+    final_price считается здесь по правилам наценки (pricing.PricingRules), без Product.save().
+    """
+
+    UPDATE_FIELDS = [
+        'name', 'unit', 'category', 'base_price', 'markup_percent',
+        'final_price', 'is_active', 'missed_imports', 'price_list', 'updated_at',
+    ]
+
+    def __init__(self, supplier: Supplier, price_list: Optional[PriceList] = None,
+                 batch_size: Optional[int] = None, grace_imports: Optional[int] = None,
+                 progress: Optional[ImportProgress] = None, check_cancelled: Optional[Callable[[], None]] = None):
+        self.supplier = supplier
+        self.price_list = price_list
+        # Ход импорта (PriceList.progress): время сравнения и записи, строки на границах пачек
+        self.progress = progress or ImportProgress()
+        # Вызывается перед коммитом каждой пачки и снятием с продажи; при отмене бросает ImportCancelled
+        self.check_cancelled = check_cancelled
+        self.batch_size = batch_size or settings.PRICELIST_IMPORT_BATCH_SIZE
+        self.grace_imports = settings.PRICELIST_SWEEP_GRACE_IMPORTS if grace_imports is None else grace_imports
+        self.sweep_min_share = settings.PRICELIST_SWEEP_MIN_SHARE
+        self.pricing = PricingRules.load()
+
+    def run(self, parser_result: dict, resume: bool = False) -> Dict[str, int]:
+        """
+        Импорт готового результата парсинга (формат ExcelPriceListParser.parse()), см. run_stream().
+        """
+        products = parser_result.get('products', [])
+        categories = parser_result.get('categories', [])
+        units, category_table = StringTable(), StringTable()
+        chunks = (
+            ProductBatch.from_dicts(products[i:i + self.batch_size], units, category_table)
+            for i in range(0, len(products), self.batch_size)
+        )
+        return self.run_stream(chunks, categories=lambda: categories, resume=resume, source=len(products))
+
+    def run_stream(self, chunks: Iterable[ProductBatch], categories: Optional[Callable[[], Iterable]] = None,
+                   resume: bool = False, source=None) -> Dict[str, int]:
+        """
+        Импортирует товары по мере поступления пачек и возвращает сводку:
+        {'created', 'updated', 'unchanged', 'vanished', 'deactivated', 'skipped', 'total'}
+
+        chunks - пачки ProductBatch (например, ParseStream);
+        categories вызывается после исчерпания chunks и возвращает все категории
+        прайс-листа, включая те, в которых нет товаров.
+
+        Каждая пачка из batch_size строк пишется в отдельной короткой транзакции вместе
+        с контрольной точкой PriceList.import_checkpoint (сколько строк потока обработано).
+        С resume=True импорт продолжается с последней закоммиченной пачки, если source -
+        идентификатор набора строк (ключ кэша парсинга, число строк) - тот же.
+
+        Отмена (check_cancelled) проверяется внутри транзакции пачки: откатывается только
+        текущая пачка, ImportCancelled несет сводку уже закоммиченных.
+        """
+        summary = {
+            'created': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'vanished': 0,
+            'skipped': 0,
+            'total': 0,
+        }
+        progress = self.progress
+        if progress.phase != ImportProgress.PHASE_IMPORT:
+            progress.start_phase(ImportProgress.PHASE_IMPORT)
+        start = self._load_checkpoint(source, summary) if resume else 0
+        with progress.stage('diff'):
+            existing = self._load_existing()
+        # Артикулы, уже встреченные в потоке: для повторов и подсчета исчезнувших
+        seen = set()
+        position = 0
+        # Строк и сводка на последнем коммите - итог на случай отмены
+        committed = (start, dict(summary))
+
+        try:
+            for batch in self._batches(chunks):
+                # Строки до контрольной точки уже записаны, их нужно только отметить как встреченные
+                done = batch[:max(start - position, 0)]
+                seen.update(article for article in done.articles if article)
+                position += len(done)
+                batch = batch[len(done):]
+                if not batch:
+                    continue
+
+                with progress.stage('diff'):
+                    to_write, relink_ids = self._diff_batch(batch, existing, seen, summary)
+                position += len(batch)
+
+                with progress.stage('write'), transaction.atomic():
+                    if to_write:
+                        Product.objects.bulk_create(
+                            to_write,
+                            update_conflicts=True,
+                            unique_fields=['supplier', 'article'],
+                            update_fields=self.UPDATE_FIELDS,
+                        )
+                    if relink_ids:
+                        Product.objects.filter(id__in=relink_ids).update(price_list=self.price_list, missed_imports=0)
+                    # Внутри транзакции: отмена откатывает только эту пачку
+                    self._check_cancelled()
+                    self._save_checkpoint(position, source, summary)
+                committed = (position, dict(summary))
+                progress.batch_done(position)
+
+            progress.rows_written = position
+            progress.start_phase(ImportProgress.PHASE_SWEEP)
+            if categories is not None:
+                self._resolve_categories(categories())
+            summary['vanished'] = sum(
+                1 for article, current in existing.items() if article not in seen and current[self.IS_ACTIVE]
+            )
+            if 'deactivated' not in summary:
+                active = sum(1 for current in existing.values() if current[self.IS_ACTIVE])
+                skip_reason = self._sweep_skip_reason(position, len(seen), active)
+                if skip_reason:
+                    logger.warning(f'Импорт товаров поставщика {self.supplier.name}: {skip_reason}')
+                    summary['deactivated'] = 0
+                    summary['sweep_skipped'] = skip_reason
+                else:
+                    self._sweep(position, source, summary)
+        except ImportCancelled as e:
+            e.rows_written, e.summary = committed
+            raise
+        summary['total'] = summary['created'] + summary['updated'] + summary['unchanged']
+        if self.price_list is not None:
+            PriceList.objects.filter(pk=self.price_list.pk).update(diff_summary=summary)
+        logger.info(
+            f'Импорт товаров поставщика {self.supplier.name}: создано {summary["created"]}, '
+            f'обновлено {summary["updated"]}, без изменений {summary["unchanged"]}, '
+            f'отсутствуют в прайсе {summary["vanished"]}, снято с продажи {summary["deactivated"]}, '
+            f'пропущено {summary["skipped"]}'
+        )
+        return summary
+
+    def _check_cancelled(self):
+        if self.check_cancelled is not None:
+            self.check_cancelled()
+
+    def _batches(self, chunks: Iterable[ProductBatch]) -> Iterator[ProductBatch]:
+        """Пачки ровно по batch_size строк (последняя - остаток) из пачек произвольного размера"""
+        buffer: Optional[ProductBatch] = None
+        for chunk in chunks:
+            if buffer is None:
+                buffer = chunk.empty_like()
+            buffer.extend(chunk)
+            while len(buffer) >= self.batch_size:
+                yield buffer[:self.batch_size]
+                buffer = buffer[self.batch_size:]
+        if buffer is not None and len(buffer):
+            yield buffer
+
+    def _diff_batch(self, batch: ProductBatch, existing: Dict[str, tuple], seen: set,
+                    summary: Dict[str, int]) -> Tuple[List[Product], List[int]]:
+        """
+        Товары к записи и id неизмененных товаров, которым нужна ссылка на прайс-лист.
+
+        Строки без артикула и повторы артикула считаются пропущенными. При повторе побеждает
+        последняя строка (как при update_or_create): внутри пачки остается она, а повтор
+        артикула из предыдущей пачки перезаписывается без сравнения.
+        """
+        rows: Dict[str, tuple] = {}
+        for row in batch.rows():
+            article = row[1]
+            if not article:
+                summary['skipped'] += 1
+                continue
+            if article in rows or article in seen:
+                summary['skipped'] += 1
+            rows.pop(article, None)
+            rows[article] = row
+
+        # Категории товаров тоже участвуют: парсер может не перечислить их в 'categories'
+        category_map = self._resolve_categories(batch.category_names())
+        price_list_id = self.price_list.id if self.price_list else None
+        to_write: List[Product] = []
+        relink_ids: List[int] = []
+
+        for article, (name, _, unit, price, category) in rows.items():
+            base_price = to_price(price)
+            category_id = category_map.get(category_path(category))
+            product = Product(
+                supplier=self.supplier,
+                article=article,
+                name=name,
+                unit=unit,
+                category_id=category_id,
+                base_price=base_price,
+                markup_percent=0,  # Процентная наценка не используется
+                # Итоговая цена = цена поставщика + наценка по правилу или поставщика в сомах
+                final_price=self.pricing.final_price(base_price, self.supplier.id, category_id),
+                is_active=True,
+                missed_imports=0,
+                price_list=self.price_list,  # Связываем товар с прайс-листом
+            )
+
+            current = existing.get(article)
+            if article in seen:
+                to_write.append(product)
+            elif current is None:
+                summary['created'] += 1
+                to_write.append(product)
+            elif current[self.STATE:] == self._state(product):
+                summary['unchanged'] += 1
+                if current[self.PRICE_LIST_ID] != price_list_id:
+                    relink_ids.append(current[self.ID])
+            else:
+                summary['updated'] += 1
+                to_write.append(product)
+
+        seen.update(rows)
+        return to_write, relink_ids
+
+    def _load_checkpoint(self, source, summary: Dict[str, int]) -> int:
+        """Позиция, с которой продолжать импорт; счетчики сводки восстанавливаются из PriceList"""
+        if self.price_list is None:
+            return 0
+        checkpoint, state = PriceList.objects.filter(pk=self.price_list.pk).values_list(
+            'import_checkpoint', 'import_summary'
+        ).get()
+        if not checkpoint or state.get('source') != source:
+            return 0
+        for key in ('created', 'updated', 'unchanged', 'skipped'):
+            summary[key] = state.get(key, 0)
+        if 'deactivated' in state:
+            # Снятие с продажи уже выполнено этим заданием - повтор не должен снова увеличить счетчики
+            summary['deactivated'] = state['deactivated']
+        logger.info(f'Прайс-лист {self.price_list.id}: импорт продолжается со строки {checkpoint}')
+        return checkpoint
+
+    def _save_checkpoint(self, position: int, source, summary: Dict[str, int]):
+        if self.price_list is None:
+            return
+        state = {
+            'source': source,
+            'created': summary['created'],
+            'updated': summary['updated'],
+            'unchanged': summary['unchanged'],
+            'skipped': summary['skipped'],
+        }
+        if 'deactivated' in summary:
+            state['deactivated'] = summary['deactivated']
+        PriceList.objects.filter(pk=self.price_list.pk).update(import_checkpoint=position, import_summary=state)
+
+    def _sweep_skip_reason(self, position: int, seen: int, active: int) -> Optional[str]:
+        """
+        Причина не снимать товары с продажи или None. Пустой прайс-лист или прайс-лист, в котором
+        встречена лишь малая доля активных товаров, скорее ошибка файла или разметки, чем
+        настоящий ассортимент: снятие по нему увело бы с продажи весь каталог поставщика.
+        """
+        if position == 0:
+            return 'в прайс-листе нет товаров, снятие с продажи пропущено'
+        if seen < active * self.sweep_min_share:
+            return f'в прайс-листе {seen} товаров из {active} активных, снятие с продажи пропущено'
+        return None
+
+    def _sweep(self, position: int, source, summary: Dict[str, int]):
+        """
+        Снятие с продажи товаров поставщика, которых нет в загруженном прайс-листе.
+
+        Отметка "встречен" - ссылка на прайс-лист: импорт проставляет ее всем товарам из файла,
+        так что отсутствующие выбираются одним условием и обновляются одним UPDATE, без
+        удаления и без загрузки строк. Товар, пропавший не более чем в grace_imports
+        импортах подряд, остается активным, у него только растет missed_imports.
+        """
+        if self.price_list is None:
+            summary['deactivated'] = 0
+            return
+        missing = Product.objects.filter(supplier=self.supplier, is_active=True).exclude(price_list=self.price_list)
+        with transaction.atomic():
+            summary['deactivated'] = missing.filter(missed_imports__gte=self.grace_imports).update(
+                is_active=False, missed_imports=F('missed_imports') + 1, updated_at=timezone.now(),
+            )
+            if self.grace_imports:
+                missing.update(missed_imports=F('missed_imports') + 1)
+            # Отмена до коммита: по неверному файлу товары не снимаются с продажи
+            self._check_cancelled()
+            self._save_checkpoint(position, source, summary)
+
+    # Позиции в кортеже из _load_existing; с STATE начинается то, что сравнивается с _state()
+    ID, PRICE_LIST_ID, STATE, IS_ACTIVE = 0, 1, 2, 4
+
+    @staticmethod
+    def _state(product: Product) -> tuple:
+        return (
+            content_fingerprint(product.name, product.unit, product.base_price, product.category_id),
+            product.final_price, product.is_active, Decimal(product.markup_percent),
+        )
+
+    def _load_existing(self) -> Dict[str, tuple]:
+        """
+        article -> (id, price_list_id, *_state) для всех товаров поставщика одним запросом.
+        Вместо названия, единицы, цены и категории хранится их отпечаток.
+        """
+        rows = Product.objects.filter(supplier=self.supplier).values_list(
+            'article', 'id', 'price_list_id', 'name', 'unit', 'base_price', 'category_id',
+            'final_price', 'is_active', 'markup_percent',
+        )
+        return {
+            article: (id_, price_list_id, content_fingerprint(name, unit, base_price, category_id),
+                      final_price, is_active, markup_percent)
+            for article, id_, price_list_id, name, unit, base_price, category_id,
+            final_price, is_active, markup_percent in rows
+        }
+
+    @staticmethod
+    def _resolve_categories(names: Iterable[CategoryPath]) -> Dict[Tuple[str, ...], int]:
+        return CategoryResolver().resolve(names)
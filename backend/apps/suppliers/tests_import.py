@@ -0,0 +1,268 @@
+"""
+Тесты импорта прайс-листов в каталог
+"""
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TestCase
+from django.utils import timezone
+
+from apps.catalog.models import Category, Product
+from apps.catalog.services import CategoryCache, CategoryResolver, category_cache
+from apps.suppliers.batches import ProductBatch
+from apps.suppliers.models import Supplier, PriceList
+from apps.suppliers.progress import ImportProgress
+from apps.suppliers.services import ImportCancelled, PriceListImporter, prefetch
+
+
+class PriceListImporterTestCase(TestCase):
+    """Пакетный импорт товаров"""
+
+    def setUp(self):
+        self.supplier = Supplier.objects.create(name='ЕвроГипс', internal_code='EG', markup_som=Decimal('10'))
+        self.price_list = PriceList.objects.create(supplier=self.supplier, file='pricelists/test.xlsx')
+
+    def _result(self, products, categories=None):
+        return {'products': products, 'categories': categories or [], 'total_products': len(products)}
+
+    def _row(self, article, price, name=None, category='ГКЛ'):
+        return {'name': name or f'Товар {article}', 'article': article, 'unit': 'шт', 'price': price, 'category': category}
+
+    def test_create_update_unchanged(self):
+        importer = PriceListImporter(self.supplier, self.price_list, batch_size=2)
+        summary = importer.run(self._result([self._row('A', 100), self._row('B', 200.5), self._row('C', 300)], ['ГКЛ']))
+
+        self.assertEqual(summary['created'], 3)
+        self.assertEqual(Product.objects.filter(supplier=self.supplier).count(), 3)
+        product = Product.objects.get(article='B')
+        self.assertEqual(product.base_price, Decimal('200.50'))
+        self.assertEqual(product.final_price, Decimal('210.50'))
+        self.assertEqual(product.category.name, 'ГКЛ')
+        self.assertEqual(product.price_list, self.price_list)
+
+        new_price_list = PriceList.objects.create(supplier=self.supplier, file='pricelists/test2.xlsx')
+        summary = PriceListImporter(self.supplier, new_price_list).run(
+            self._result([self._row('A', 100), self._row('B', 250), self._row('C', 300)], ['ГКЛ'])
+        )
+
+        self.assertEqual((summary['created'], summary['updated'], summary['unchanged']), (0, 1, 2))
+        self.assertEqual(Product.objects.get(article='B').final_price, Decimal('260.00'))
+        self.assertEqual(Product.objects.filter(price_list=new_price_list).count(), 3)
+
+    def test_duplicate_articles_last_row_wins(self):
+        summary = PriceListImporter(self.supplier, self.price_list).run(
+            self._result([self._row('A', 100), self._row('A', 150), {'name': 'Без артикула', 'price': 1}])
+        )
+
+        self.assertEqual(summary['created'], 1)
+        self.assertEqual(summary['skipped'], 2)
+        self.assertEqual(Product.objects.get(article='A').base_price, Decimal('150.00'))
+
+    def test_diff_writes_only_changed_rows(self):
+        PriceListImporter(self.supplier, self.price_list).run(
+            self._result([self._row('A', 100), self._row('B', 200), self._row('C', 300), self._row('D', 400)])
+        )
+        Product.objects.update(updated_at=timezone.now() - timedelta(days=7))
+        week_ago = Product.objects.get(article='A').updated_at
+
+        new_price_list = PriceList.objects.create(supplier=self.supplier, file='pricelists/test2.xlsx')
+        summary = PriceListImporter(self.supplier, new_price_list).run(
+            self._result([self._row('A', 100), self._row('B', 210), self._row('C', 300, category='Профили'), self._row('E', 500)])
+        )
+
+        self.assertEqual(
+            (summary['created'], summary['updated'], summary['unchanged'], summary['vanished']), (1, 2, 1, 1)
+        )
+        changed = set(Product.objects.filter(updated_at__gt=week_ago).values_list('article', flat=True))
+        # D исчез из прайса и снят с продажи
+        self.assertEqual(changed, {'B', 'C', 'D', 'E'})
+        self.assertFalse(Product.objects.get(article='D').is_active)
+        self.assertEqual(Product.objects.get(article='A').price_list, new_price_list)
+        new_price_list.refresh_from_db()
+        self.assertEqual(new_price_list.diff_summary, summary)
+
+    def test_sweep_deactivates_missing_after_grace(self):
+        PriceListImporter(self.supplier, self.price_list).run(self._result([self._row('A', 100), self._row('B', 200)]))
+        other = Supplier.objects.create(name='Стройдвор', internal_code='SD')
+        Product.objects.create(supplier=other, article='B', name='Чужой товар', base_price=1)
+
+        for expected_active, expected_deactivated in [(True, 0), (False, 1)]:
+            price_list = PriceList.objects.create(supplier=self.supplier, file='pricelists/next.xlsx')
+            summary = PriceListImporter(self.supplier, price_list, grace_imports=1).run(self._result([self._row('A', 100)]))
+            self.assertEqual(summary['deactivated'], expected_deactivated)
+            self.assertEqual(Product.objects.get(supplier=self.supplier, article='B').is_active, expected_active)
+
+        self.assertTrue(Product.objects.get(supplier=other).is_active)
+
+        # Товар вернулся в прайс - снова активен, счетчик пропусков сброшен
+        price_list = PriceList.objects.create(supplier=self.supplier, file='pricelists/last.xlsx')
+        PriceListImporter(self.supplier, price_list).run(self._result([self._row('A', 100), self._row('B', 200)]))
+        product = Product.objects.get(supplier=self.supplier, article='B')
+        self.assertEqual((product.is_active, product.missed_imports), (True, 0))
+
+    def test_empty_or_partial_price_list_does_not_sweep(self):
+        PriceListImporter(self.supplier, self.price_list).run(
+            self._result([self._row(f'A{i}', 100) for i in range(10)])
+        )
+
+        empty = PriceList.objects.create(supplier=self.supplier, file='pricelists/empty.xlsx')
+        summary = PriceListImporter(self.supplier, empty).run(self._result([]))
+        self.assertEqual(summary['deactivated'], 0)
+        self.assertIn('нет товаров', summary['sweep_skipped'])
+        empty.refresh_from_db()
+        self.assertEqual(empty.diff_summary['sweep_skipped'], summary['sweep_skipped'])
+
+        with self.settings(PRICELIST_SWEEP_MIN_SHARE=0.5):
+            partial = PriceList.objects.create(supplier=self.supplier, file='pricelists/partial.xlsx')
+            summary = PriceListImporter(self.supplier, partial).run(self._result([self._row('A0', 100)]))
+        self.assertEqual((summary['deactivated'], summary['vanished']), (0, 9))
+        self.assertIn('1 товаров из 10', summary['sweep_skipped'])
+        self.assertEqual(Product.objects.filter(supplier=self.supplier, is_active=True).count(), 10)
+
+    def test_run_stream_duplicate_across_batches(self):
+        chunks = [
+            ProductBatch.from_dicts(rows)
+            for rows in ([self._row('A', 100), self._row('B', 200, category='Профили')], [self._row('C', 300)], [self._row('A', 150)])
+        ]
+        summary = PriceListImporter(self.supplier, self.price_list, batch_size=2).run_stream(
+            prefetch(chunks, 1), categories=lambda: ['ГКЛ', 'Пустая категория']
+        )
+
+        self.assertEqual((summary['created'], summary['skipped'], summary['total']), (3, 1, 3))
+        self.assertEqual(Product.objects.get(article='A').base_price, Decimal('150.00'))
+        self.assertTrue(Category.objects.filter(name='Пустая категория').exists())
+
+    def test_progress_is_saved_at_batch_boundaries(self):
+        rows = [self._row(f'A{i}', 100 + i) for i in range(5)]
+        progress = ImportProgress(self.price_list.id, interval=0)
+        progress.track(mock.Mock(total_products=5, expected_total=5, timings={'read': 0.5, 'classify': 0.25}))
+        saved = []
+        with mock.patch.object(ImportProgress, 'as_dict', autospec=True,
+                               side_effect=lambda p: saved.append((p.phase, p.rows_written, p.eta_seconds())) or {}):
+            PriceListImporter(self.supplier, self.price_list, batch_size=2, progress=progress).run(self._result(rows))
+        self.assertEqual([written for phase, written, _ in saved if phase == 'import'], [0, 2, 4, 5])
+        self.assertIsNotNone(saved[1][2])
+        self.assertEqual(saved[-1][:2], ('sweep', 5))
+
+        progress.finish()
+        self.price_list.refresh_from_db()
+        self.assertEqual(self.price_list.progress['phase'], 'done')
+        self.assertEqual(self.price_list.progress['durations']['read'], 0.5)
+        self.assertGreater(self.price_list.progress['durations']['write'], 0)
+
+    def test_prefetch_propagates_producer_error(self):
+        def chunks():
+            yield [self._row('A', 100)]
+            raise ValueError('битый файл')
+
+        stream = prefetch(chunks(), 1)
+        self.assertEqual(next(stream), [self._row('A', 100)])
+        with self.assertRaisesMessage(ValueError, 'битый файл'):
+            next(stream)
+
+    def test_resume_from_checkpoint(self):
+        rows = [self._row(article, 100) for article in 'ABCDE']
+        original_bulk_create = Product.objects.bulk_create
+        calls = []
+
+        def failing_bulk_create(objs, **kwargs):
+            calls.append([obj.article for obj in objs])
+            if len(calls) == 2:
+                raise RuntimeError('обрыв соединения')
+            return original_bulk_create(objs, **kwargs)
+
+        with mock.patch.object(Product.objects, 'bulk_create', side_effect=failing_bulk_create):
+            with self.assertRaises(RuntimeError):
+                PriceListImporter(self.supplier, self.price_list, batch_size=2).run(self._result(rows), resume=True)
+
+        # Первая пачка закоммичена вместе с контрольной точкой, вторая откатилась
+        self.price_list.refresh_from_db()
+        self.assertEqual(self.price_list.import_checkpoint, 2)
+        self.assertEqual(set(Product.objects.values_list('article', flat=True)), {'A', 'B'})
+
+        with mock.patch.object(Product.objects, 'bulk_create', side_effect=failing_bulk_create):
+            summary = PriceListImporter(self.supplier, self.price_list, batch_size=2).run(self._result(rows), resume=True)
+
+        self.assertEqual(calls[2:], [['C', 'D'], ['E']])
+        self.assertEqual((summary['created'], summary['total']), (5, 5))
+        self.price_list.refresh_from_db()
+        self.assertEqual(self.price_list.import_checkpoint, 5)
+
+    def test_cancel_rolls_back_current_batch_only(self):
+        self.supplier.products.create(name='Старый', article='OLD', base_price=1, final_price=1)
+        rows = [self._row(article, 100) for article in 'ABCDE']
+        checks = []
+
+        def check_cancelled():
+            checks.append(len(checks))
+            if len(checks) == 2:
+                raise ImportCancelled()
+
+        importer = PriceListImporter(self.supplier, self.price_list, batch_size=2, grace_imports=0,
+                                     check_cancelled=check_cancelled)
+        with self.assertRaises(ImportCancelled) as cm:
+            importer.run(self._result(rows), resume=True)
+
+        # Первая пачка записана, вторая откатилась, снятия с продажи не было
+        self.assertEqual((cm.exception.rows_written, cm.exception.summary['created']), (2, 2))
+        self.assertEqual(set(Product.objects.filter(supplier=self.supplier).values_list('article', flat=True)),
+                         {'OLD', 'A', 'B'})
+        self.assertTrue(Product.objects.get(article='OLD').is_active)
+        self.price_list.refresh_from_db()
+        self.assertEqual(self.price_list.import_checkpoint, 2)
+
+
+class CategoryResolverTestCase(TestCase):
+    """Пакетное сопоставление категорий"""
+
+    def setUp(self):
+        category_cache.clear()
+        self.addCleanup(category_cache.clear)
+
+    def test_resolves_levels_with_constant_queries(self):
+        existing = Category.objects.create(name='Кровля')
+        paths = [f'Категория {i}' for i in range(50)] + ['Кровля', ('Лист 1', 'Кровля'), ('Лист 1', 'Кровля', 'Металлочерепица')]
+
+        # Уровень: поиск name__in + bulk_create
+        with self.assertNumQueries(6):
+            resolved = CategoryResolver().resolve(paths)
+
+        self.assertEqual(resolved[('Кровля',)], existing.id)
+        nested = Category.objects.get(id=resolved[('Лист 1', 'Кровля')])
+        self.assertEqual(nested.parent.name, 'Лист 1')
+        self.assertEqual(Category.objects.get(id=resolved[('Лист 1', 'Кровля', 'Металлочерепица')]).parent, nested)
+        self.assertEqual(Category.objects.filter(name='Кровля').count(), 2)
+
+        # Повторный импорт находит те же категории, ничего не создавая
+        self.assertEqual(CategoryResolver().resolve(paths), resolved)
+        self.assertEqual(Category.objects.count(), 54)
+
+    def test_cache_is_filled_on_commit_and_reset_on_write(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            resolved = CategoryResolver().resolve(['ГКЛ', ('ГКЛ', 'Влагостойкий')])
+
+        # Из кэша: только проверка, что id еще существуют
+        with self.assertNumQueries(1):
+            self.assertEqual(CategoryResolver().resolve(['ГКЛ', ('ГКЛ', 'Влагостойкий')]), resolved)
+
+        Category.objects.get(id=resolved[('ГКЛ', 'Влагостойкий')]).delete()
+        # Кэш сброшен целиком: оба уровня ищутся заново, удаленная категория создается снова
+        with self.assertNumQueries(3):
+            self.assertNotEqual(CategoryResolver().resolve([('ГКЛ', 'Влагостойкий')]), resolved)
+
+    def test_stale_ids_from_other_process_are_dropped(self):
+        cache = CategoryCache()
+        with self.captureOnCommitCallbacks(execute=True):
+            resolved = CategoryResolver(cache).resolve(['ГКЛ', ('ГКЛ', 'Влагостойкий'), 'Профили'])
+        root_id = resolved[('ГКЛ',)]
+
+        # Другой процесс удалил подкатегорию и переименовал корень: сигналы здесь не срабатывают
+        Category.objects.filter(id=resolved[('ГКЛ', 'Влагостойкий')])._raw_delete(using='default')
+        Category.objects.filter(id=resolved[('Профили',)]).update(name='Профили (архив)')
+
+        fresh = CategoryResolver(cache).resolve(['ГКЛ', ('ГКЛ', 'Влагостойкий'), 'Профили'])
+        self.assertEqual(fresh[('ГКЛ',)], root_id)
+        self.assertTrue(Category.objects.filter(id=fresh[('ГКЛ', 'Влагостойкий')], parent_id=root_id).exists())
+        self.assertEqual(Category.objects.get(id=fresh[('Профили',)]).name, 'Профили')
+        self.assertNotEqual(fresh[('Профили',)], resolved[('Профили',)])
@@ -0,0 +1,236 @@
+"""
+Тесты очереди обработки прайс-листов
+"""
+import os
+import tempfile
+import threading
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+import openpyxl
+
+from apps.catalog.models import Category, Product
+from apps.suppliers.jobs import (
+    cancel_price_list, claim_job, enqueue_price_list, recover_stale_jobs, run_job, run_worker,
+)
+from apps.suppliers.management.commands.benchmark_pricelist_parsing import build_sample_workbook
+from apps.suppliers.models import Supplier, PriceList, PriceListJob
+
+
+@override_settings(PRICELIST_JOB_MAX_ATTEMPTS=2, PRICELIST_JOB_RETRY_BACKOFF=10)
+class PriceListJobQueueTestCase(TestCase):
+    """Постановка в очередь, выдача заданий, повторы"""
+
+    def setUp(self):
+        self.supplier = Supplier.objects.create(name='ЕвроГипс', internal_code='EG')
+        self.other_supplier = Supplier.objects.create(name='Стройдвор', internal_code='SD')
+
+    def _price_list(self, supplier=None, file='pricelists/missing.xlsx'):
+        return PriceList.objects.create(supplier=supplier or self.supplier, file=file)
+
+    def test_enqueue_is_idempotent_and_marks_processing(self):
+        price_list = self._price_list()
+        job = enqueue_price_list(price_list)
+
+        self.assertEqual(enqueue_price_list(price_list), job)
+        price_list.refresh_from_db()
+        self.assertEqual(price_list.status, 'PROCESSING')
+        self.assertEqual(job.status, PriceListJob.STATUS_QUEUED)
+
+    def test_one_running_job_per_supplier(self):
+        first = enqueue_price_list(self._price_list())
+        enqueue_price_list(self._price_list())
+        other = enqueue_price_list(self._price_list(self.other_supplier))
+
+        self.assertEqual(claim_job('w1'), first)
+        # Второй прайс-лист того же поставщика ждет, пока выполняется первый
+        self.assertEqual(claim_job('w2'), other)
+        self.assertIsNone(claim_job('w3'))
+
+    def test_retry_with_backoff_then_fail(self):
+        price_list = self._price_list()
+        enqueue_price_list(price_list)
+
+        job = claim_job('w1')
+        run_job(job)  # файла нет - ошибка
+        job.refresh_from_db()
+        self.assertEqual(job.status, PriceListJob.STATUS_QUEUED)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=5))
+        self.assertIsNone(claim_job('w1'))
+
+        PriceListJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        job = claim_job('w1')
+        self.assertEqual(job.attempts, 2)
+        run_job(job)
+        job.refresh_from_db()
+        price_list.refresh_from_db()
+        self.assertEqual(job.status, PriceListJob.STATUS_FAILED)
+        self.assertEqual(price_list.status, 'FAILED')
+
+    @override_settings(PRICELIST_JOB_STALE_SECONDS=60)
+    def test_stale_job_is_requeued(self):
+        enqueue_price_list(self._price_list())
+        job = claim_job('dead-worker')
+        PriceListJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+
+        self.assertEqual(recover_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PriceListJob.STATUS_QUEUED)
+        self.assertIn('dead-worker', job.last_error)
+
+    def test_cancel_queued_job(self):
+        price_list = self._price_list()
+        job = enqueue_price_list(price_list)
+        admin = get_user_model().objects.create_user(
+            email='admin@example.com', password='testpass123', full_name='Admin', role='ADMIN'
+        )
+        client = APIClient()
+        client.force_authenticate(user=admin)
+
+        response = client.post(f'/api/admin/pricelists/{price_list.id}/cancel/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['job_id'], response.data['job_status']), (job.id, 'CANCELLED'))
+        self.assertEqual(response.data['status'], 'CANCELLED')
+        self.assertIsNone(claim_job('w1'))
+        # Отменять больше нечего
+        response = client.post(f'/api/admin/pricelists/{price_list.id}/cancel/')
+        self.assertEqual(response.status_code, 409)
+
+    def test_cancel_running_job_stops_at_batch_boundary(self):
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, PRICELIST_IMPORT_BATCH_SIZE=50):
+            os.makedirs(os.path.join(media_root, 'pricelists'))
+            build_sample_workbook(os.path.join(media_root, 'pricelists', 'sample.xlsx'), 200)
+            price_list = self._price_list(file='pricelists/sample.xlsx')
+            enqueue_price_list(price_list)
+            job = claim_job('w1')
+            self.assertEqual(cancel_price_list(price_list), job)
+            job.refresh_from_db()
+            self.assertTrue(job.cancel_requested)
+            self.assertEqual(job.status, PriceListJob.STATUS_RUNNING)
+
+            run_job(job)
+
+        job.refresh_from_db()
+        price_list.refresh_from_db()
+        self.assertEqual(job.status, PriceListJob.STATUS_CANCELLED)
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(price_list.status, 'CANCELLED')
+        self.assertIn('Уже записано строк: 0', price_list.log)
+        self.assertFalse(Product.objects.filter(price_list=price_list).exists())
+
+    @override_settings(PRICELIST_JOB_STALE_SECONDS=60)
+    def test_stale_cancelled_job_is_not_retried(self):
+        price_list = self._price_list()
+        enqueue_price_list(price_list)
+        job = claim_job('dead-worker')
+        cancel_price_list(price_list)
+        PriceListJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(minutes=5))
+
+        self.assertEqual(recover_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, PriceListJob.STATUS_CANCELLED)
+
+    def test_worker_processes_queue(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            os.makedirs(os.path.join(media_root, 'pricelists'))
+            build_sample_workbook(os.path.join(media_root, 'pricelists', 'sample.xlsx'), 200)
+            price_list = self._price_list(file='pricelists/sample.xlsx')
+            job = enqueue_price_list(price_list)
+
+            run_worker(threading.Event(), once=True)
+
+        job.refresh_from_db()
+        price_list.refresh_from_db()
+        self.assertEqual(job.status, PriceListJob.STATUS_DONE)
+        self.assertEqual(price_list.status, 'PROCESSED')
+        self.assertEqual(Product.objects.filter(price_list=price_list).count(), price_list.products_count)
+        self.assertGreater(price_list.products_count, 0)
+        self.assertTrue(price_list.file_hash)
+        self.supplier.refresh_from_db()
+        self.assertEqual(self.supplier.parsing_config['layout']['header_row'], 1)
+        self.assertIn('Кэш парсинга: промах', price_list.log)
+        progress = price_list.progress
+        self.assertEqual(progress['phase'], 'done')
+        self.assertEqual(progress['rows_written'], progress['rows_parsed'])
+        self.assertEqual(progress['rows_total'], progress['rows_parsed'])
+        self.assertEqual(set(progress['durations']), {'read', 'classify', 'diff', 'write'})
+        self.assertGreater(progress['durations']['read'], 0)
+        self.assertEqual(set(progress['phases']), {'parse', 'import', 'sweep'})
+
+        admin = get_user_model().objects.create_user(
+            email='admin@example.com', password='testpass123', full_name='Admin', role='ADMIN'
+        )
+        client = APIClient()
+        client.force_authenticate(user=admin)
+        response = client.get(f'/api/admin/pricelists/{price_list.id}/progress/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['progress'], progress)
+        self.assertEqual((response.data['job']['id'], response.data['job']['status']), (job.id, 'DONE'))
+
+    def test_worker_processes_csv(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            os.makedirs(os.path.join(media_root, 'pricelists'))
+            with open(os.path.join(media_root, 'pricelists', 'sample.csv'), 'w', encoding='cp1251') as f:
+                f.write('Товар;Ед.изм;Цена\nКровля;;\nПрофнастил С8;м2;450,5\nСаморез;шт;2\n')
+            price_list = self._price_list(file='pricelists/sample.csv')
+            price_list.parsing_method = 'CSV'
+            price_list.save()
+            enqueue_price_list(price_list)
+
+            run_worker(threading.Event(), once=True)
+
+        price_list.refresh_from_db()
+        self.assertEqual(price_list.status, 'PROCESSED')
+        self.assertEqual(price_list.products_count, 2)
+        self.assertEqual(Product.objects.get(name='Профнастил С8').category.name, 'Кровля')
+
+    def test_reprocess_uses_parse_cache(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            os.makedirs(os.path.join(media_root, 'pricelists'))
+            build_sample_workbook(os.path.join(media_root, 'pricelists', 'sample.xlsx'), 50)
+            price_list = self._price_list(file='pricelists/sample.xlsx')
+            # Первый импорт сохраняет раскладку поставщика, а она входит в ключ кэша:
+            # попадание - со второго повтора с той же раскладкой
+            for expected in ('промах', 'промах', 'попадание'):
+                enqueue_price_list(price_list)
+                run_worker(threading.Event(), once=True)
+                price_list.refresh_from_db()
+                self.assertEqual(price_list.status, 'PROCESSED')
+                self.assertIn(f'Кэш парсинга: {expected}', price_list.log)
+
+    def test_worker_parses_selected_sheets(self):
+        self.supplier.parsing_config = {'sheets': ['Кровля', 'Крепеж']}
+        self.supplier.save()
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            os.makedirs(os.path.join(media_root, 'pricelists'))
+            workbook = openpyxl.Workbook()
+            workbook.active.title = 'Крепеж'
+            workbook.active.append(['Товар', 'Ед.изм', 'Цена'])
+            workbook.active.append(['Саморез', 'шт', 2.5])
+            for title, name in (('Кровля', 'Профнастил С8'), ('Архив', 'Шифер')):
+                worksheet = workbook.create_sheet(title)
+                worksheet.append(['Товар', 'Ед.изм', 'Цена'])
+                worksheet.append(['Листы'])
+                worksheet.append([name, 'м2', 450])
+            workbook.save(os.path.join(media_root, 'pricelists', 'sheets.xlsx'))
+            price_list = self._price_list(file='pricelists/sheets.xlsx')
+            enqueue_price_list(price_list)
+
+            run_worker(threading.Event(), once=True)
+
+        price_list.refresh_from_db()
+        self.assertEqual(price_list.status, 'PROCESSED')
+        self.assertEqual(
+            [(sheet['name'], sheet['status'], sheet['products']) for sheet in price_list.parse_progress['sheets']],
+            [('Крепеж', 'parsed', 1), ('Кровля', 'parsed', 1)],
+        )
+        products = {product.name: product.category for product in Product.objects.select_related('category__parent')}
+        self.assertEqual(set(products), {'Саморез', 'Профнастил С8'})
+        self.assertEqual(products['Саморез'].name, 'Крепеж')
+        self.assertEqual((products['Профнастил С8'].parent.name, products['Профнастил С8'].name), ('Кровля', 'Листы'))
+        self.assertTrue(Category.objects.filter(name='Кровля', parent=None).exists())
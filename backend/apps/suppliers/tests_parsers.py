@@ -0,0 +1,359 @@
+"""
+Тесты парсера Excel прайс-листов
+"""
+import os
+import tempfile
+import time
+from unittest import mock
+
+import openpyxl
+import pandas as pd
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, override_settings
+
+from apps.suppliers.batches import ProductBatch
+from apps.suppliers.management.commands.benchmark_pricelist_parsing import build_sample_pdf, find_cyrillic_font
+from apps.suppliers.parse_pool import ParseProcessError, _parse_in_child, parse_isolated, parse_sheets, shutdown_executor
+from apps.suppliers.parse_cache import CacheTail, CacheWriter, ParseCache, ParseStream, file_sha256, parse_cached
+from apps.suppliers.parsers import (
+    CsvPriceListParser, ExcelPriceListParser, PdfPriceListParser,
+)
+
+
+class ExcelPriceListParserTestCase(SimpleTestCase):
+    """Потоковый режим должен давать тот же результат, что и чтение через DataFrame"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_path = os.path.join(self.tmp_dir.name, 'pricelist.xlsx')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _write_workbook(self, rows):
+        workbook = openpyxl.Workbook()
+        worksheet = workbook.active
+        for row in rows:
+            worksheet.append(row)
+        workbook.save(self.file_path)
+
+    def _parse_both(self):
+        legacy = ExcelPriceListParser(self.file_path, streaming=False).parse()
+        streaming = ExcelPriceListParser(self.file_path, streaming=True).parse()
+        return legacy, streaming
+
+    def test_streaming_matches_dataframe(self):
+        self._write_workbook([
+            ['Прайс-лист'],
+            ['№', 'Товар', 'Ед.изм', 'Цена'],
+            [None, 'Гипсокартон'],
+            [1, 'ГКЛ 12.5 мм', 'шт', 450],
+            [2, 'ГКЛВ 12.5 мм', 'шт', '520,50'],
+            [],
+            [None, 'Профили'],
+            [3, 'Профиль ПП 60x27', 'м', 95.5],
+            [4, 'Профиль без цены', 'м', 'договорная'],
+            [None, 'Итого'],
+        ])
+        legacy, streaming = self._parse_both()
+
+        self.assertEqual(streaming, legacy)
+        self.assertEqual(streaming['total_products'], 3)
+        self.assertEqual(streaming['categories'], ['Гипсокартон', 'Профили'])
+        self.assertEqual(streaming['products'][1]['price'], 520.5)
+        self.assertEqual(streaming['products'][2]['category'], 'Профили')
+
+    def test_streaming_without_header_uses_smart_columns(self):
+        rows = [['Наш прайс'], ['', '', '']]
+        for i in range(30):
+            rows.append([f'Изделие номер {i}', 'шт', 100 + i])
+        self._write_workbook(rows)
+        legacy, streaming = self._parse_both()
+
+        self.assertEqual(streaming, legacy)
+        self.assertEqual(streaming['total_products'], 30)
+
+    def test_iter_products_matches_parse(self):
+        rows = [['Товар', 'Ед.изм', 'Цена'], ['Кровля']]
+        rows += [[f'Лист {i}', 'шт', 100 + i] for i in range(25)]
+        self._write_workbook(rows)
+        expected = ExcelPriceListParser(self.file_path).parse()
+
+        for streaming in (True, False):
+            parser = ExcelPriceListParser(self.file_path, streaming=streaming)
+            chunks = list(parser.iter_products(chunk_size=10))
+            self.assertEqual([len(chunk) for chunk in chunks], [10, 10, 5])
+            self.assertEqual([product for chunk in chunks for product in chunk.to_dicts()], expected['products'])
+            self.assertEqual(parser.categories, expected['categories'])
+
+    def test_product_batch_round_trip(self):
+        products = [
+            {'name': f'Товар {i}', 'article': f'A{i}', 'unit': 'шт' if i % 2 else 'м', 'price': i + 0.5,
+             'category': 'Кровля' if i < 3 else None}
+            for i in range(5)
+        ]
+        batch = ProductBatch.from_dicts(products)
+
+        self.assertEqual(batch.to_dicts(), products)
+        self.assertEqual(batch.units.values, ['м', 'шт'])
+        self.assertEqual(batch[1:3].to_dicts(), products[1:3])
+        self.assertEqual(ProductBatch.from_columns(batch.to_columns()).to_dicts(), products)
+
+        merged = batch[:2]
+        merged.extend(ProductBatch.from_dicts(products[2:]))
+        self.assertEqual(merged.to_dicts(), products)
+        self.assertEqual(batch.category_names(), ['Кровля'])
+
+    def test_saved_layout_skips_detection(self):
+        self._write_workbook([['Прайс'], ['Наименование', 'Цена', 'Ед.изм'], ['ГКЛ 12.5 мм', 450, 'шт'], ['Профиль', 95.5, 'м']])
+        first = ExcelPriceListParser(self.file_path)
+        expected = first.parse()
+        layout = first.detected_layout
+        self.assertEqual((layout['header_row'], layout['product_col'], layout['unit_col'], layout['price_col']), (1, 0, 2, 1))
+
+        for streaming in (True, False):
+            parser = ExcelPriceListParser(self.file_path, streaming=streaming, layout=layout)
+            with mock.patch.object(parser, '_find_header_row_new', side_effect=AssertionError('поиск заголовка')), \
+                    mock.patch.object(parser, '_find_columns_by_header', side_effect=AssertionError('поиск колонок')):
+                self.assertEqual(parser.parse(), expected)
+            self.assertEqual(parser.detected_layout, layout)
+
+        # Заголовок изменился - раскладка не подходит, работает полный поиск
+        stale = {**layout, 'header': ['Товар', 'Цена', 'Ед.изм']}
+        parser = ExcelPriceListParser(self.file_path, layout=stale)
+        self.assertEqual(parser.parse(), expected)
+        self.assertEqual(parser.detected_layout, layout)
+
+    def test_classify_frame_matches_row_rules(self):
+        parser = ExcelPriceListParser(self.file_path)
+        data = pd.DataFrame({
+            0: ['Кровля', ' Профнастил С8 ', None, 'Без цены', 'Труба', 5],
+            1: [None, 'м2', None, 'шт', 'м', 'кг'],
+            2: [None, '1 250,50', None, None, 'договорная', 10],
+        })
+        frame = parser._classify_frame(data, 0, 1, 2)
+
+        for (_, row), values in zip(frame.iterrows(), data.itertuples(index=False, name=None)):
+            name = parser._to_str_or_none(values[0])
+            unit = parser._to_str_or_none(values[1])
+            price = parser._to_float_or_nan(values[2])
+            kind = parser._classify_row(name, unit, price)
+            self.assertEqual(row['is_category'], kind == 'category')
+            self.assertEqual(row['is_product'], kind == 'product')
+
+        self.assertEqual(frame.loc[1, 'price'], 1250.5)
+        self.assertEqual(frame.loc[5, 'category'], 'Кровля')
+
+    def test_unit_dictionary(self):
+        parser = ExcelPriceListParser(self.file_path)
+        for raw, expected in [('ШТ.', 'шт'), ('м. кв.', 'м²'), ('тн', 'т'), ('т.', 'т'), ('пог.м', 'м'), ('мл', 'мл')]:
+            self.assertTrue(parser._is_unit_measurement(raw), raw)
+            self.assertEqual(parser._normalize_unit(raw), expected)
+        self.assertFalse(parser._is_unit_measurement('упак'))
+        self.assertFalse(parser._is_unit_measurement('125'))
+
+        parser = ExcelPriceListParser(self.file_path, unit_aliases={'упак': 'упак', 'Рулон': 'рул'})
+        self.assertTrue(parser._is_unit_measurement('Упак.'))
+        self.assertEqual(parser._normalize_unit('рулон'), 'рул')
+
+    def test_parse_cache_hit_skips_parsing(self):
+        self._write_workbook([['Товар', 'Ед.изм', 'Цена'], ['ГКЛ 12.5 мм', 'шт', 450], ['Профиль ПП 60x27', 'м', 95.5]])
+        cache = ParseCache(os.path.join(self.tmp_dir.name, 'cache'))
+        file_hash = file_sha256(self.file_path)
+
+        parsed, hit = parse_cached(ExcelPriceListParser(self.file_path), file_hash, cache=cache)
+        self.assertFalse(hit)
+
+        parser = ExcelPriceListParser(self.file_path)
+        with mock.patch.object(parser, 'parse', side_effect=AssertionError('парсинг при попадании в кэш')):
+            cached, hit = parse_cached(parser, file_hash, cache=cache)
+        self.assertTrue(hit)
+        self.assertEqual(cached, parsed)
+
+        # Другие настройки парсера - другой ключ
+        _, hit = parse_cached(ExcelPriceListParser(self.file_path, unit_aliases={'упак': 'упак'}), file_hash, cache=cache)
+        self.assertFalse(hit)
+
+    def test_saved_layout_is_part_of_cache_key(self):
+        # Шапка повторяется ниже по листу: сохраненная раскладка совпадает с ней, а не с первой
+        self._write_workbook([['Товар', 'Ед.изм', 'Цена'], ['ГКЛ 12.5 мм', 'шт', 450], ['Товар', 'Ед.изм', 'Цена'], ['Профиль', 'м', 95.5]])
+        detected = ExcelPriceListParser(self.file_path)
+        full = detected.parse()
+        layout = {**detected.detected_layout, 'header_row': 2}
+        with_layout = ExcelPriceListParser(self.file_path, layout=layout)
+
+        self.assertNotEqual(with_layout.parse()['products'], full['products'])
+        self.assertNotEqual(ParseCache.key('ab12', with_layout), ParseCache.key('ab12', detected))
+
+    def test_parse_cache_prune_by_age_and_size(self):
+        cache = ParseCache(os.path.join(self.tmp_dir.name, 'cache'))
+        day = 24 * 60 * 60
+        now = time.time()
+        paths = {}
+        for name, age in (('old', 40 * day), ('used', 2 * day), ('recent', 0)):
+            paths[name] = cache.path(f'ExcelPriceListParser-v1-ab{name}-options')
+            writer = CacheWriter(paths[name])
+            writer.write(ProductBatch.from_dicts([{'name': name, 'article': name, 'unit': 'шт', 'price': 1, 'category': None}]))
+            writer.commit([], 1)
+            os.utime(paths[name], (now - age, now - age))
+        abandoned = CacheTail(paths['recent'])
+        os.utime(abandoned.tmp_path, (now - 2 * day, now - 2 * day))
+
+        self.assertEqual(cache.prune(max_age=30 * day, max_bytes=0)[0], 2)
+        self.assertFalse(os.path.exists(paths['old']))
+        self.assertFalse(os.path.exists(abandoned.tmp_path))
+        abandoned._file.close()
+
+        # Попадание обновляет время использования: сверх размера удаляется самая давно использованная запись
+        cache.open('ExcelPriceListParser-v1-abused-options')._file.close()
+        size = os.path.getsize(paths['recent'])
+        self.assertEqual(cache.prune(max_age=0, max_bytes=size)[0], 1)
+        self.assertEqual([os.path.exists(paths[name]) for name in ('used', 'recent')], [True, False])
+
+    @override_settings(PRICELIST_PARSE_IN_SUBPROCESS=True)
+    def test_parse_isolated_matches_in_process(self):
+        self._write_workbook([['Товар', 'Ед.изм', 'Цена'], ['Кровля'], ['Профнастил С8', 'м2', 450], ['Саморез', 'шт', 2.5]])
+        self.addCleanup(shutdown_executor)
+        cache = ParseCache(os.path.join(self.tmp_dir.name, 'cache'))
+        expected = ExcelPriceListParser(self.file_path).parse()
+
+        parser = ExcelPriceListParser(self.file_path)
+        result = parse_isolated(parser, cache=cache)
+        self.assertFalse(result.cache_hit)
+        self.assertEqual([product for batch in result for product in batch.to_dicts()], expected['products'])
+        self.assertEqual((result.categories, result.total_products), (expected['categories'], 2))
+        self.assertEqual(parser.detected_layout['price_col'], 2)
+
+        self.assertTrue(parse_isolated(ExcelPriceListParser(self.file_path), cache=cache).cache_hit)
+
+    def test_cache_tail_reads_batches_while_writer_runs(self):
+        cache = ParseCache(os.path.join(self.tmp_dir.name, 'cache'))
+        path = cache.path('ExcelPriceListParser-v1-ab12-options')
+        tail = CacheTail(path)
+        self.addCleanup(tail.close)
+        writer = CacheWriter(path, tmp_path=tail.tmp_path, sync=True)
+        first = ProductBatch.from_dicts([{'name': 'Саморез', 'article': 'S1', 'unit': 'шт', 'price': 2.5, 'category': None}])
+        second = ProductBatch.from_dicts([{'name': 'ГКЛ', 'article': 'G1', 'unit': 'шт', 'price': 450, 'category': 'Листы'}])
+        # Писатель продолжает, только когда читателю нечего читать
+        steps = iter([lambda: writer.write(second), lambda: writer.commit(['Листы'], 2)])
+
+        def poll():
+            step = next(steps, None)
+            if step is None:
+                return False
+            step()
+            return True
+
+        writer.write(first)
+        batches = tail.read(poll)
+        self.assertEqual(next(batches).to_dicts(), first.to_dicts())
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(next(batches).to_dicts(), second.to_dicts())
+        self.assertEqual(list(batches), [])
+        self.assertEqual((tail.categories, tail.total_products), (['Листы'], 2))
+        # Опубликованная запись остается в кэше
+        tail.close()
+        self.assertEqual(cache.get('ExcelPriceListParser-v1-ab12-options')['total_products'], 2)
+
+    @override_settings(PRICELIST_PARSE_IN_SUBPROCESS=True)
+    def test_unwritable_cache_is_not_sent_through_pipe(self):
+        self._write_workbook([['Товар', 'Ед.изм', 'Цена'], ['Саморез', 'шт', 2.5]])
+        blocker = os.path.join(self.tmp_dir.name, 'file')
+        open(blocker, 'w').close()
+
+        # Дочерний процесс не возвращает товары вместо кэша - задание падает с понятной ошибкой
+        with self.assertRaisesRegex(ParseProcessError, 'Не удалось записать кэш парсинга'):
+            _parse_in_child(ExcelPriceListParser, self.file_path, {}, os.path.join(blocker, 'ab', 'key'), 0)
+        # Кэш недоступен для записи - parse_isolated разбирает файл потоково в текущем процессе
+        with mock.patch('apps.suppliers.parse_pool.CacheTail', side_effect=OSError('Нет места на диске')):
+            stream = parse_isolated(ExcelPriceListParser(self.file_path),
+                                    cache=ParseCache(os.path.join(self.tmp_dir.name, 'cache')))
+        self.assertIsInstance(stream, ParseStream)
+        self.assertEqual([product['name'] for batch in stream for product in batch.to_dicts()], ['Саморез'])
+
+    def test_parse_sheets_merges_in_workbook_order(self):
+        workbook = openpyxl.Workbook()
+        workbook.active.title = 'Крепеж'
+        for title, rows in (('Крепеж', [['Саморез', 'шт', 2.5], ['Дюбель', 'шт', 1]]),
+                            ('Кровля', [['Кровля'], ['Профнастил С8', 'м2', 450]]),
+                            ('Архив', [['Шифер', 'м2', 300]])):
+            worksheet = workbook[title] if title in workbook.sheetnames else workbook.create_sheet(title)
+            worksheet.append(['Товар', 'Ед.изм', 'Цена'])
+            for row in rows:
+                worksheet.append(row)
+        workbook.save(self.file_path)
+        self.addCleanup(shutdown_executor)
+        cache = ParseCache(os.path.join(self.tmp_dir.name, 'cache'))
+
+        for in_subprocess in (True, False):
+            progress = []
+            with override_settings(PRICELIST_PARSE_IN_SUBPROCESS=in_subprocess):
+                stream = parse_sheets(
+                    ExcelPriceListParser(self.file_path, sheets='all'),
+                    cache=ParseCache(os.path.join(self.tmp_dir.name, f'cache-{in_subprocess}')),
+                    on_progress=lambda p: progress.append(p['sheets_done']),
+                )
+            products = [(product['name'], product['category']) for batch in stream for product in batch.to_dicts()]
+            self.assertEqual(products, [
+                ('Саморез', ('Крепеж',)), ('Дюбель', ('Крепеж',)),
+                ('Профнастил С8', ('Кровля', 'Кровля')), ('Шифер', ('Архив',)),
+            ])
+            self.assertEqual(stream.categories, [('Крепеж',), ('Кровля',), ('Кровля', 'Кровля'), ('Архив',)])
+            self.assertEqual((stream.total_products, progress[-1]), (4, 3))
+
+        subset = parse_sheets(ExcelPriceListParser(self.file_path, sheets=['Архив', 'Крепеж', 'Нет']), cache=cache)
+        self.assertEqual([product['name'] for batch in subset for product in batch.to_dicts()], ['Саморез', 'Дюбель', 'Шифер'])
+        self.assertTrue(parse_sheets(ExcelPriceListParser(self.file_path, sheets=['Архив']), cache=cache).cache_hit)
+
+    def test_csv_matches_excel(self):
+        rows = [['Прайс-лист'], ['Товар', 'Ед.изм', 'Цена'], ['Кровля'], ['Профнастил С8', 'м2', 450.5], ['Саморез', 'шт', 2]]
+        self._write_workbook(rows)
+        expected = ExcelPriceListParser(self.file_path, streaming=True).parse()
+
+        csv_path = os.path.join(self.tmp_dir.name, 'pricelist.csv')
+        variants = (
+            ('cp1251', ';', lambda value: str(value).replace('.', ',')),
+            ('utf-8-sig', ',', str),
+            ('utf-8', '\t', str),
+        )
+        for encoding, delimiter, to_text in variants:
+            with open(csv_path, 'w', encoding=encoding, newline='') as f:
+                for row in rows:
+                    f.write(delimiter.join(to_text(value) if isinstance(value, float) else str(value) for value in row) + '\n')
+            parser = CsvPriceListParser(csv_path)
+            self.assertEqual(parser.detect_format(), (encoding, delimiter))
+            self.assertEqual(parser.parse(), expected)
+
+        chunks = list(CsvPriceListParser(csv_path).iter_products(chunk_size=1))
+        self.assertEqual([batch.to_dicts()[0] for batch in chunks], expected['products'])
+
+    def test_pdf_pages_are_stitched(self):
+        header = ['Товар', 'Ед.изм', 'Цена']
+        pages = [
+            [header, ['Кровля', None, None], ['Профнастил С8', 'м2', '450,50'], ['Крепеж', None, None]],
+            [header, ['Саморез', 'шт', '2'], ['Дюбель', 'шт', '1']],
+            [],
+        ]
+        parser = PdfPriceListParser(self.file_path)
+        with mock.patch.object(PdfPriceListParser, '_iter_pages', return_value=iter(pages)):
+            result = parser.parse()
+        # Категория в конце страницы продолжается на следующей, повтор заголовка не становится категорией
+        self.assertEqual(
+            [(product['name'], product['price'], product['category']) for product in result['products']],
+            [('Профнастил С8', 450.5, 'Кровля'), ('Саморез', 2.0, 'Крепеж'), ('Дюбель', 1.0, 'Крепеж')],
+        )
+        self.assertEqual(result['categories'], ['Кровля', 'Крепеж'])
+
+    def test_pdf_parallel_matches_sequential(self):
+        try:
+            font_path = find_cyrillic_font()
+        except CommandError:
+            self.skipTest('Нет TTF шрифта с кириллицей для синтетического PDF')
+        pdf_path = os.path.join(self.tmp_dir.name, 'pricelist.pdf')
+        build_sample_pdf(pdf_path, 6, font_path)
+
+        sequential = PdfPriceListParser(pdf_path, workers=1).parse()
+        parallel = PdfPriceListParser(pdf_path, workers=2, pages_per_task=2).parse()
+        self.assertEqual(parallel, sequential)
+        self.assertGreater(sequential['total_products'], 150)
+        self.assertNotIn('Товар', sequential['categories'])
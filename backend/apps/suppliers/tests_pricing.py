@@ -0,0 +1,264 @@
+"""
+Тесты пересчета цен при смене наценки поставщика
+"""
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import F, Value
+from django.db.backends.utils import format_number
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from apps.catalog.models import Category, Product
+from apps.suppliers.models import PricingRule, Supplier
+from apps.suppliers.pricing import (
+    PricingRules, apply_pricing, preview_pricing, recompute_final_prices, run_pending_recompute,
+)
+from apps.suppliers.services import PriceListImporter
+
+
+class PriceRecomputeTestCase(TestCase):
+    """Пересчет final_price одним UPDATE вместо save() на каждый товар"""
+
+    def setUp(self):
+        self.supplier = Supplier.objects.create(name='ЕвроГипс', internal_code='EG', markup_som=10)
+        self.other = Supplier.objects.create(name='Стройдвор', internal_code='SD', markup_som=10)
+        for i in range(5):
+            Product.objects.create(name=f'ГКЛ {i}', article=f'A{i}', supplier=self.supplier, base_price=100 + i)
+        Product.objects.create(name='Саморез', article='S1', supplier=self.other, base_price=2)
+
+    def _prices(self, supplier):
+        return list(Product.objects.filter(supplier=supplier).order_by('article').values_list('final_price', flat=True))
+
+    def test_markup_change_via_api_updates_prices_once(self):
+        admin = get_user_model().objects.create_user(
+            email='admin@example.com', password='testpass123', full_name='Admin', role='ADMIN'
+        )
+        client = APIClient()
+        client.force_authenticate(user=admin)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.patch(f'/api/admin/suppliers/{self.supplier.id}/', {'markup_som': '25.50'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        product_updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "catalog_product"')]
+        self.assertEqual(len(product_updates), 1)
+        self.assertEqual(self._prices(self.supplier), [Decimal(100 + i) + Decimal('25.50') for i in range(5)])
+        self.assertEqual(self._prices(self.other), [Decimal('12')])
+        self.assertEqual((response.data['price_recompute']['rows'], response.data['price_recompute']['deferred']), (5, False))
+
+        # Повтор с той же наценкой ничего не переписывает
+        self.assertEqual(recompute_final_prices(self.supplier.id)['rows'], 0)
+
+    def test_zero_markup_falls_back_to_percent(self):
+        Product.objects.filter(article='A0').update(markup_percent=10)
+        self.supplier.markup_som = 0
+        self.supplier.save()
+
+        self.assertEqual(self._prices(self.supplier)[:2], [Decimal('110.00'), Decimal('101.00')])
+
+    @override_settings(SUPPLIER_PRICE_RECOMPUTE_SYNC_LIMIT=3, SUPPLIER_PRICE_RECOMPUTE_BATCH_SIZE=2)
+    def test_large_supplier_is_recomputed_by_worker_in_id_ranges(self):
+        self.supplier.markup_som = 30
+        self.supplier.save()
+
+        self.assertTrue(self.supplier.price_recompute['deferred'])
+        self.assertEqual(self._prices(self.supplier)[0], Decimal('110.00'))
+        # Повторная смена до пересчета: пересчет один, с последней наценкой
+        self.supplier.markup_som = 40
+        self.supplier.save()
+
+        summary = run_pending_recompute()
+        self.assertEqual((summary['supplier_id'], summary['rows'], summary['batches']), (self.supplier.id, 5, 3))
+        self.assertEqual(self._prices(self.supplier), [Decimal(140 + i) for i in range(5)])
+        self.assertIsNone(run_pending_recompute())
+        self.supplier.refresh_from_db()
+        self.assertIsNone(self.supplier.prices_recompute_requested_at)
+
+    @override_settings(SUPPLIER_PRICE_RECOMPUTE_SYNC_LIMIT=3)
+    def test_claimed_recompute_is_not_taken_by_other_worker(self):
+        self.supplier.markup_som = 30
+        self.supplier.save()
+        second_worker = []
+
+        def recompute(supplier_id, batch_size=None):
+            # Пока первый обработчик пересчитывает, второй этого поставщика не берет
+            second_worker.append(run_pending_recompute())
+            return {'supplier_id': supplier_id}
+
+        with mock.patch('apps.suppliers.pricing.recompute_final_prices', side_effect=recompute):
+            self.assertEqual(run_pending_recompute(), {'supplier_id': self.supplier.id})
+        self.assertEqual(second_worker, [None])
+        self.supplier.refresh_from_db()
+        self.assertEqual((self.supplier.prices_recompute_requested_at, self.supplier.prices_recompute_run_after), (None, None))
+
+    @override_settings(SUPPLIER_PRICE_RECOMPUTE_SYNC_LIMIT=3, PRICELIST_JOB_MAX_ATTEMPTS=2)
+    def test_failing_recompute_backs_off_then_leaves_queue(self):
+        self.supplier.markup_som = 30
+        self.supplier.save()
+
+        with mock.patch('apps.suppliers.pricing.recompute_final_prices', side_effect=RuntimeError('таймаут')):
+            self.assertEqual(run_pending_recompute()['error'], 'таймаут')
+            # Повтор отложен - очередь не крутит одного и того же поставщика
+            self.assertIsNone(run_pending_recompute())
+            self.supplier.refresh_from_db()
+            self.assertEqual(self.supplier.prices_recompute_attempts, 1)
+            self.assertGreater(self.supplier.prices_recompute_run_after, timezone.now())
+
+            Supplier.objects.filter(pk=self.supplier.pk).update(prices_recompute_run_after=timezone.now())
+            self.assertEqual(run_pending_recompute()['error'], 'таймаут')
+
+        self.supplier.refresh_from_db()
+        self.assertIsNone(self.supplier.prices_recompute_requested_at)
+        self.assertEqual(self.supplier.prices_recompute_error, 'таймаут')
+        self.assertIsNone(run_pending_recompute())
+
+
+class PricingRulesTestCase(TestCase):
+    """Правила наценки: одно выражение CASE в БД и тот же расчет в Python"""
+
+    def setUp(self):
+        self.supplier = Supplier.objects.create(name='ЕвроГипс', internal_code='EG', markup_som=5)
+        self.other = Supplier.objects.create(name='Стройдвор', internal_code='SD')
+        self.roofing = Category.objects.create(name='Кровля')
+        self.sheets = Category.objects.create(name='Листы', parent=self.roofing)
+        PricingRule.objects.create(name='Дорогая кровля', priority=10, category=self.roofing, min_price=1000,
+                                   markup_percent=5, round_to=10, rounding=PricingRule.ROUNDING_UP)
+        PricingRule.objects.create(name='Кровля', priority=20, category=self.roofing, markup_percent=20,
+                                   round_to=Decimal('0.5'))
+        PricingRule.objects.create(name='Стройдвор', priority=30, supplier=self.other, markup_som=15)
+        PricingRule.objects.create(name='Отключено', priority=1, markup_percent=90, is_active=False)
+        self.rows = [
+            # (поставщик, категория, базовая цена, итоговая цена)
+            (self.supplier, self.sheets, Decimal('1234.00'), Decimal('1300.00')),  # 1295.70 вверх до 10
+            (self.supplier, self.sheets, Decimal('101.30'), Decimal('121.50')),  # 121.56 до 0.5
+            (self.other, self.roofing, Decimal('999.99'), Decimal('1200.00')),  # 1199.988 до 0.5
+            (self.other, None, Decimal('100.00'), Decimal('115.00')),
+            (self.supplier, None, Decimal('100.00'), Decimal('105.00')),  # наценка поставщика
+        ]
+        for i, (supplier, category, base_price, _) in enumerate(self.rows):
+            Product.objects.bulk_create([Product(name=f'Товар {i}', article=f'A{i}', supplier=supplier,
+                                                 category=category, base_price=base_price, final_price=base_price)])
+
+    def _expected(self):
+        return [final_price for *_, final_price in self.rows]
+
+    def test_python_and_sql_agree(self):
+        rules = PricingRules.load()
+        self.assertEqual(
+            [rules.final_price(base_price, supplier.id, category.id if category else None)
+             for supplier, category, base_price, _ in self.rows],
+            self._expected(),
+        )
+        with CaptureQueriesContext(connection) as queries:
+            summary = apply_pricing()
+        # Все правила - одним UPDATE
+        self.assertEqual(sum(q['sql'].startswith('UPDATE') for q in queries.captured_queries), 1)
+        self.assertEqual((summary['rows'], summary['rules']), (5, 3))
+        self.assertEqual(list(Product.objects.order_by('article').values_list('final_price', flat=True)),
+                         self._expected())
+        self.assertEqual(apply_pricing()['rows'], 0)
+
+    def test_preview_reports_margin_impact_without_writing(self):
+        preview = preview_pricing()
+
+        self.assertEqual((preview['products'], preview['changed']), (5, 5))
+        self.assertEqual(preview['margin_before'], 0)
+        expected_margin = sum(final - base for _, _, base, final in self.rows)
+        self.assertEqual(preview['margin_delta'], expected_margin)
+        by_rule = {group['rule_name']: (group['products'], group['margin_after']) for group in preview['by_rule']}
+        self.assertEqual(by_rule['Дорогая кровля'], (1, Decimal('66.00')))
+        self.assertEqual(by_rule['Наценка поставщика'], (1, Decimal('5.00')))
+        self.assertEqual(Product.objects.filter(final_price=F('base_price')).count(), 5)
+
+        admin = get_user_model().objects.create_user(
+            email='admin@example.com', password='testpass123', full_name='Admin', role='ADMIN'
+        )
+        client = APIClient()
+        client.force_authenticate(user=admin)
+        self.assertEqual(client.get('/api/admin/pricing-rules/preview/').data['changed'], 5)
+        response = client.post('/api/admin/pricing-rules/apply/')
+        self.assertEqual((response.status_code, response.data['rows']), (200, 5))
+        self.assertEqual(client.get('/api/admin/pricing-rules/preview/').data['changed'], 0)
+
+    def test_import_and_save_use_rules(self):
+        Product.objects.all().delete()
+        PriceListImporter(self.supplier).run({'products': [
+            {'name': 'Металлочерепица', 'article': 'M1', 'unit': 'м2', 'price': 101.3,
+             'category': ('Кровля', 'Листы')},
+            {'name': 'Саморез', 'article': 'S1', 'unit': 'шт', 'price': 100},
+        ]})
+        self.assertEqual(Product.objects.get(article='M1').final_price, Decimal('121.50'))
+        self.assertEqual(Product.objects.get(article='S1').final_price, Decimal('105.00'))
+
+        product = Product(name='Конек', article='K1', supplier=self.other, category=self.sheets, base_price=1234)
+        product.save()
+        self.assertEqual(product.final_price, Decimal('1300.00'))
+
+    def test_save_reads_markup_and_rules_fresh(self):
+        product = Product(name='Гвоздь', article='N1', supplier=self.supplier, base_price=100)
+        product.save()
+        self.assertEqual(product.final_price, Decimal('105.00'))
+
+        # Изменения из другого процесса: сигналы в этом процессе не срабатывают
+        Supplier.objects.filter(pk=self.supplier.pk).update(markup_som=7)
+        product.save()
+        self.assertEqual(product.final_price, Decimal('107.00'))
+        PricingRule.objects.bulk_create([PricingRule(name='Гвозди', priority=1, supplier=self.supplier, markup_percent=50)])
+        product.save()
+        self.assertEqual(product.final_price, Decimal('150.00'))
+
+    def test_save_reuses_rules_until_they_change(self):
+        product = Product(name='Конек', article='K1', supplier=self.supplier, category=self.sheets, base_price=1234)
+        product.save()
+
+        # Наценка и отметка правил - один запрос, плюс сам UPDATE; родители категории уже известны
+        with self.assertNumQueries(2):
+            product.save()
+        self.assertEqual(product.final_price, Decimal('1300.00'))
+
+        PricingRule.objects.filter(name='Кровля').update(markup_percent=30, updated_at=timezone.now())
+        product.base_price = 100
+        product.save()
+        self.assertEqual(product.final_price, Decimal('130.00'))
+
+    def test_fractional_percent_matches_in_python_and_sql(self):
+        PricingRule.objects.all().delete()
+        base_prices = [Decimal('101.30'), Decimal('99.99'), Decimal('1234.00'), Decimal('7.77')]
+        Product.objects.all().delete()
+        Product.objects.bulk_create([
+            Product(name=f'Товар {i}', article=f'F{i}', supplier=self.other, base_price=price, final_price=price)
+            for i, price in enumerate(base_prices)
+        ])
+        variants = [(None, PricingRule.ROUNDING_NEAREST)] + [
+            (Decimal('0.5'), rounding) for rounding, _ in PricingRule.ROUNDING_CHOICES
+        ]
+        for round_to, rounding in variants:
+            with self.subTest(round_to=round_to, rounding=rounding):
+                PricingRule.objects.all().delete()
+                PricingRule.objects.create(name='Дробная', priority=1, markup_percent=Decimal('12.5'),
+                                           round_to=round_to, rounding=rounding)
+                rules = PricingRules.load()
+                in_sql = list(Product.objects.order_by('article').annotate(price=rules.expression())
+                              .values_list('base_price', 'price'))
+                prices = [Decimal(price).quantize(Decimal('0.01')) for _, price in in_sql]
+                self.assertEqual(prices, [rules.final_price(base_price, self.other.id, None) for base_price, _ in in_sql])
+                if round_to is None:
+                    # 101.30 * 1.125 = 113.9625: множитель, округленный до 1.13, дал бы 114.47
+                    self.assertEqual(prices[0], Decimal('113.96'))
+                # Константы выражения помещаются в объявленную точность: при подстановке
+                # по decimal_places множитель 1.125 не округлится до двух знаков
+                for value in self._values(PricingRules._rule_expression(rules.rules[0])):
+                    field = value.output_field
+                    self.assertEqual(format_number(value.value, field.max_digits, field.decimal_places),
+                                     format_number(value.value, None, None))
+
+    def _values(self, expression):
+        if isinstance(expression, Value) and isinstance(expression.value, Decimal):
+            yield expression
+        for source in getattr(expression, 'get_source_expressions', list)():
+            yield from self._values(source)
@@ -0,0 +1,87 @@
+"""
+Справочник единиц измерения для парсеров прайс-листов
+"""
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
+import re
+
+
+# Каноническая единица -> написания, которые встречаются в прайс-листах
+BASE_UNIT_ALIASES: Dict[str, Iterable[str]] = {
+    'шт': ['шт', 'штук', 'штуки', 'штука'],
+    'м': ['м', 'метр', 'метры', 'метров', 'пм', 'п.м', 'м.п', 'пог.м'],
+    'м²': ['м2', 'м²', 'м.кв', 'кв.м', 'квм', 'м кв'],
+    'м³': ['м3', 'м³', 'м.куб', 'куб.м', 'кубм', 'м куб'],
+    'кг': ['кг', 'килограмм', 'килограммы'],
+    'т': ['т', 'тн', 'тонна', 'тонны', 'тонн'],
+    'л': ['л', 'литр', 'литры'],
+    'мл': ['мл', 'миллилитр'],
+}
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_unit_token(value: str) -> str:
+    """Ключ справочника: нижний регистр, без пробелов и точки в конце ('М. кв.' -> 'м.кв')"""
+    return _WHITESPACE_RE.sub('', value.lower()).rstrip('.')
+
+
+class UnitDictionary:
+    """
+    Распознавание и нормализация единиц измерения.
+
+    Сначала значение ищется в словаре нормализованных написаний (базовые + алиасы
+    поставщика из Supplier.parsing_config['unit_aliases']), и только если его там нет -
+    применяются эвристики по подстрокам. Результат для каждой исходной строки
+    кэшируется, так что повторяющиеся единицы в прайс-листе разбираются один раз.
+    """
+
+    def __init__(self, aliases: Optional[Dict[str, str]] = None):
+        self._tokens: Dict[str, str] = {}
+        for canonical, spellings in BASE_UNIT_ALIASES.items():
+            for spelling in spellings:
+                self._tokens[normalize_unit_token(spelling)] = canonical
+        for alias, canonical in (aliases or {}).items():
+            if isinstance(alias, str) and isinstance(canonical, str) and alias.strip() and canonical.strip():
+                self._tokens[normalize_unit_token(alias)] = canonical.strip()
+        self.resolve = lru_cache(maxsize=4096)(self._resolve)
+        self.is_unit = lru_cache(maxsize=4096)(self._is_unit)
+
+    def _resolve(self, value: str) -> Optional[str]:
+        """Каноническая единица для строки или None, если это не единица измерения"""
+        if not value:
+            return None
+
+        canonical = self._tokens.get(normalize_unit_token(value))
+        if canonical is not None:
+            return canonical
+
+        # Эвристики по содержимому (порядок важен: 'мл' содержит 'л' и 'м')
+        value_lower = value.strip().lower()
+        if 'шт' in value_lower:
+            return 'шт'
+        if 'м²' in value_lower or 'м2' in value_lower or ('кв' in value_lower and 'м' in value_lower):
+            return 'м²'
+        if 'м³' in value_lower or 'м3' in value_lower or 'куб' in value_lower:
+            return 'м³'
+        if 'кг' in value_lower:
+            return 'кг'
+        if 'т' in value_lower and ('тонн' in value_lower or len(value_lower) <= 3):
+            return 'т'
+        if 'мл' in value_lower:
+            return 'мл'
+        if 'л' in value_lower:
+            return 'л'
+        if 'м' in value_lower and len(value_lower) <= 5:  # Короткие значения с "м" могут быть единицами
+            return 'м'
+        return None
+
+    def _is_unit(self, value: Optional[str]) -> bool:
+        return bool(value) and self.resolve(value) is not None
+
+    def normalize(self, value: str) -> str:
+        """Каноническая единица; если значение не распознано - строка в нижнем регистре"""
+        return self.resolve(value) or value.lower()
+
+
+DEFAULT_UNITS = UnitDictionary()
@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import SupplierViewSet, PriceListViewSet, PriceListUploadView, AdminStatsView
+from .views import SupplierViewSet, PriceListViewSet, PricingRuleViewSet, PriceListUploadView, AdminStatsView
 
 router = DefaultRouter()
 router.register(r'suppliers', SupplierViewSet, basename='supplier')
 router.register(r'pricelists', PriceListViewSet, basename='pricelist')
+router.register(r'pricing-rules', PricingRuleViewSet, basename='pricing-rule')
 
 app_name = 'suppliers'
 
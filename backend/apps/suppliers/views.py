@@ -4,22 +4,28 @@ from rest_framework.permissions import IsAdminUser
 from apps.users.permissions import IsAdminRole
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.utils import timezone
-from django.db import transaction
 from django.core.files.storage import default_storage
-import threading
 import logging
 import os
-from .models import Supplier, PriceList
-from .parsers import ExcelPriceListParser
+from .models import Supplier, PriceList, PriceListJob, PricingRule
+from .jobs import cancel_price_list, enqueue_price_list
+from .parse_cache import uploaded_file_sha256
+from .pricing import preview_pricing, request_pricing_apply
+from .services import PriceListImporter
 from apps.catalog.models import Product, Category
 
 logger = logging.getLogger(__name__)
 from .serializers import (
     SupplierSerializer, SupplierCreateUpdateSerializer,
-    PriceListSerializer, PriceListCreateSerializer
+    PriceListSerializer, PriceListCreateSerializer, PricingRuleSerializer
 )
 
+# Метод парсинга по расширению файла, если он не указан при загрузке
+FILE_PARSING_METHODS = {
+    '.csv': 'CSV',
+    '.pdf': 'PDF',
+}
+
 
 class SupplierViewSet(viewsets.ModelViewSet):
     queryset = Supplier.objects.all()
@@ -47,25 +53,14 @@ class SupplierViewSet(viewsets.ModelViewSet):
     def update(self, request, *args, **kwargs):
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
-        old_markup = instance.markup_som
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         if serializer.is_valid():
+            # При смене наценки Supplier.save() сам пересчитывает цены товаров (apps/suppliers/pricing.py)
             serializer.save()
-            # Если наценка изменилась, пересчитываем цены всех товаров поставщика
-            instance.refresh_from_db()
-            if old_markup != instance.markup_som:
-                from apps.catalog.models import Product
-                from decimal import Decimal
-                markup = Decimal(str(instance.markup_som or 0))
-                products = Product.objects.filter(supplier=instance)
-                updated_count = 0
-                for product in products:
-                    base = Decimal(str(product.base_price))
-                    product.final_price = base + markup
-                    product.save(update_fields=['final_price'])
-                    updated_count += 1
-                logger.info(f'Пересчитано {updated_count} товаров поставщика {instance.name} с наценкой {markup} сом')
-            return Response(SupplierSerializer(serializer.instance).data)
+            data = SupplierSerializer(serializer.instance).data
+            if serializer.instance.price_recompute is not None:
+                data['price_recompute'] = serializer.instance.price_recompute
+            return Response(data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -139,89 +134,67 @@ class PriceListViewSet(viewsets.ModelViewSet):
         # Удаляем сам прайс-лист
         return super().destroy(request, *args, **kwargs)
 
+    @action(detail=True, methods=['get'])
+    def progress(self, request, pk=None):
+        """Ход обработки для опроса админкой: только нужные поля, без сериализатора и файла"""
+        data = self.get_queryset().filter(pk=pk).values(
+            'id', 'status', 'log', 'products_count', 'processed_at', 'progress', 'parse_progress',
+        ).first()
+        if data is None:
+            return Response({'error': 'Прайс-лист не найден'}, status=status.HTTP_404_NOT_FOUND)
+        data['job'] = PriceListJob.objects.filter(price_list_id=pk).order_by('-created_at').values(
+            'id', 'status', 'attempts', 'max_attempts', 'last_error', 'cancel_requested', 'started_at',
+            'heartbeat_at',
+        ).first()
+        return Response(data)
+
     @action(detail=True, methods=['post'])
     def process(self, request, pk=None):
         """Повторная обработка прайс-листа"""
         price_list = self.get_object()
         try:
-            price_list.status = 'PROCESSING'
-            price_list.save()
-            logger.info(f'Начата повторная обработка прайс-листа {price_list.id}')
-            
-            # Реальный парсинг файла
-            def reprocess_price_list(pl_id):
-                try:
-                    logger.info(f'Поток повторной обработки запущен для прайс-листа {pl_id}')
-                    
-                    with transaction.atomic():
-                        pl = PriceList.objects.select_for_update().get(pk=pl_id)
-                        
-                        # Получаем путь к файлу
-                        try:
-                            file_path = pl.file.path
-                        except:
-                            from django.conf import settings
-                            import os
-                            file_path = os.path.join(settings.MEDIA_ROOT, pl.file.name)
-                        
-                        # Проверяем метод парсинга
-                        parsing_method = pl.parsing_method or 'EXCEL'
-                        
-                        if parsing_method == 'EXCEL':
-                            logger.info(f'Начинаем повторный парсинг файла: {file_path}')
-                            parser = ExcelPriceListParser(file_path)
-                            result = parser.parse()
-                            
-                            found_count = len(result.get("products", []))
-                            logger.info(f'Парсинг завершен. Найдено товаров: {found_count}')
-                            
-                            # Импортируем товары в базу данных
-                            imported_count = import_products_from_parser(
-                                result, 
-                                pl.supplier,
-                                pl
-                            )
-                            
-                            pl.status = 'PROCESSED'
-                            pl.processed_at = timezone.now()
-                            pl.products_count = imported_count
-                            pl.log = f"Импортировано товаров: {found_count}, обработано: {imported_count}"
-                            pl.save()
-                            
-                            logger.info(f'Прайс-лист {pl_id} успешно переимпортирован. Импортировано товаров: {imported_count}')
-                        else:
-                            pl.status = 'PROCESSED'
-                            pl.processed_at = timezone.now()
-                            pl.products_count = 0
-                            pl.log = f"Метод парсинга {parsing_method} пока не реализован"
-                            pl.save()
-                            logger.warning(f'Метод парсинга {parsing_method} не реализован для прайс-листа {pl_id}')
-                except PriceList.DoesNotExist:
-                    logger.error(f'Прайс-лист {pl_id} не найден в базе данных')
-                except Exception as e:
-                    logger.error(f'Ошибка повторной обработки прайс-листа {pl_id}: {str(e)}')
-                    try:
-                        with transaction.atomic():
-                            pl = PriceList.objects.select_for_update().get(pk=pl_id)
-                            pl.status = 'FAILED'
-                            pl.log = str(e)
-                            pl.save()
-                    except Exception as save_error:
-                        logger.error(f'Ошибка сохранения статуса FAILED для прайс-листа {pl_id}: {str(save_error)}')
-            
-            # Запускаем обработку в отдельном потоке
-            thread = threading.Thread(target=reprocess_price_list, args=(price_list.id,))
-            thread.daemon = False
-            thread.start()
-            logger.info(f'Поток повторной обработки запущен для прайс-листа {price_list.id}')
-            
-            return Response(PriceListSerializer(price_list).data)
+            job = enqueue_price_list(price_list)
+            logger.info(f'Прайс-лист {price_list.id} поставлен в очередь на повторную обработку')
+            return Response({**PriceListSerializer(price_list).data, 'job_id': job.id})
         except Exception as e:
             price_list.status = 'FAILED'
             price_list.log = str(e)
             price_list.save()
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """Отмена обработки: задание из очереди снимается сразу, выполняющееся останавливается на границе пачки"""
+        price_list = self.get_object()
+        job = cancel_price_list(price_list)
+        if job is None:
+            return Response({'error': 'Прайс-лист не обрабатывается'}, status=status.HTTP_409_CONFLICT)
+        price_list.refresh_from_db()
+        logger.info(f'Запрошена отмена обработки прайс-листа {price_list.id}, задание {job.id}')
+        return Response({**PriceListSerializer(price_list).data, 'job_id': job.id, 'job_status': job.status})
+
+
+class PricingRuleViewSet(viewsets.ModelViewSet):
+    """
+    Правила наценки. Изменение правил не пересчитывает цены само: сначала preview
+    (пробный прогон с влиянием на наценку), затем apply.
+    """
+    queryset = PricingRule.objects.select_related('supplier', 'category').order_by('priority', 'id')
+    serializer_class = PricingRuleSerializer
+    permission_classes = [IsAdminRole]
+
+    @action(detail=False, methods=['get'])
+    def preview(self, request):
+        """Сколько цен изменится и как изменится суммарная наценка, без записи"""
+        return Response(preview_pricing())
+
+    @action(detail=False, methods=['post'])
+    def apply(self, request):
+        """Пересчет цен каталога по активным правилам (большой каталог - обработчиком очереди)"""
+        summary = request_pricing_apply()
+        logger.info(f'Запрошен пересчет цен каталога по правилам: {summary}')
+        return Response(summary, status=status.HTTP_202_ACCEPTED if summary['deferred'] else status.HTTP_200_OK)
+
 
 class PriceListUploadView(APIView):
     permission_classes = [IsAdminRole]
@@ -261,93 +234,29 @@ class PriceListUploadView(APIView):
             price_list = PriceList.objects.create(
                 supplier=supplier,
                 file=file,
-                parsing_method=parsing_method or supplier.default_parsing_method,
+                # Ключ кэша парсинга: повторная загрузка того же файла не парсится заново
+                file_hash=uploaded_file_sha256(file),
+                # CSV и PDF разбираются своими парсерами, даже если у поставщика по умолчанию Excel
+                parsing_method=parsing_method or FILE_PARSING_METHODS.get(
+                    os.path.splitext(file_name)[1], supplier.default_parsing_method
+                ),
                 parsing_config=parsing_config
             )
             
-                # Автоматически запускаем обработку прайс-листа
+            # Обработка выполняется в очереди (manage.py run_pricelist_worker), ответ возвращается сразу
+            job = None
             try:
-                price_list.status = 'PROCESSING'
-                price_list.save()
-                logger.info(f'Начата обработка прайс-листа {price_list.id}')
-                
-                # Реальный парсинг файла
-                def process_price_list(pl_id):
-                    try:
-                        logger.info(f'Поток обработки запущен для прайс-листа {pl_id}')
-                        
-                        # Получаем объект заново из базы данных
-                        with transaction.atomic():
-                            pl = PriceList.objects.select_for_update().get(pk=pl_id)
-                            
-                            # Получаем путь к файлу
-                            try:
-                                file_path = pl.file.path
-                            except:
-                                # Если .path не работает, используем .name и получаем полный путь
-                                from django.conf import settings
-                                import os
-                                file_path = os.path.join(settings.MEDIA_ROOT, pl.file.name)
-                            
-                            # Проверяем метод парсинга
-                            parsing_method = pl.parsing_method or 'EXCEL'
-                            
-                            if parsing_method == 'EXCEL':
-                                # Парсим Excel файл
-                                logger.info(f'Начинаем парсинг файла: {file_path}')
-                                parser = ExcelPriceListParser(file_path)
-                                result = parser.parse()
-                                
-                                found_count = len(result.get("products", []))
-                                logger.info(f'Парсинг завершен. Найдено товаров: {found_count}, категорий: {len(result.get("categories", []))}')
-                                
-                                # Импортируем товары в базу данных
-                                imported_count = import_products_from_parser(
-                                    result, 
-                                    pl.supplier,
-                                    pl
-                                )
-                                
-                                pl.status = 'PROCESSED'
-                                pl.processed_at = timezone.now()
-                                pl.products_count = imported_count
-                                pl.log = f"Импортировано товаров: {found_count}, обработано: {imported_count}"
-                                pl.save()
-                                
-                                logger.info(f'Прайс-лист {pl_id} успешно обработан. Импортировано товаров: {imported_count}')
-                            else:
-                                # Для других методов парсинга пока не реализовано
-                                pl.status = 'PROCESSED'
-                                pl.processed_at = timezone.now()
-                                pl.products_count = 0
-                                pl.log = f"Метод парсинга {parsing_method} пока не реализован"
-                                pl.save()
-                                logger.warning(f'Метод парсинга {parsing_method} не реализован для прайс-листа {pl_id}')
-                    except PriceList.DoesNotExist:
-                        logger.error(f'Прайс-лист {pl_id} не найден в базе данных')
-                    except Exception as e:
-                        logger.error(f'Ошибка обработки прайс-листа {pl_id}: {str(e)}')
-                        try:
-                            with transaction.atomic():
-                                pl = PriceList.objects.select_for_update().get(pk=pl_id)
-                                pl.status = 'FAILED'
-                                pl.log = str(e)
-                                pl.save()
-                        except Exception as save_error:
-                            logger.error(f'Ошибка сохранения статуса FAILED для прайс-листа {pl_id}: {str(save_error)}')
-                
-                # Запускаем обработку в отдельном потоке (не daemon, чтобы он успел выполниться)
-                thread = threading.Thread(target=process_price_list, args=(price_list.id,))
-                thread.daemon = False  # Не daemon, чтобы поток успел выполниться
-                thread.start()
-                logger.info(f'Поток обработки запущен для прайс-листа {price_list.id}')
+                job = enqueue_price_list(price_list)
             except Exception as e:
-                logger.error(f'Ошибка при запуске обработки прайс-листа: {str(e)}')
+                logger.error(f'Ошибка постановки прайс-листа в очередь: {str(e)}')
                 price_list.status = 'FAILED'
                 price_list.log = str(e)
                 price_list.save()
-            
-            return Response(PriceListSerializer(price_list).data, status=status.HTTP_201_CREATED)
+
+            return Response(
+                {**PriceListSerializer(price_list).data, 'job_id': job.id if job else None},
+                status=status.HTTP_201_CREATED,
+            )
         except Exception as e:
             return Response({
                 'error': f'Ошибка при сохранении прайс-листа: {str(e)}'
@@ -364,72 +273,12 @@ def import_products_from_parser(parser_result: dict, supplier: Supplier, price_l
         price_list: Прайс-лист
     
     Returns:
-        Количество импортированных товаров
+        Количество импортированных товаров (созданных, обновленных и неизмененных).
+        Подробная сводка - PriceListImporter.run()
     """
-    imported_count = 0
-    
     try:
-        from apps.catalog.models import Category, Product
-        
-        # Создаем категории, если их нет
-        category_map = {}
-        for cat_name in parser_result.get('categories', []):
-            if cat_name:
-                category, created = Category.objects.get_or_create(
-                    name=cat_name,
-                    defaults={'name': cat_name}
-                )
-                category_map[cat_name] = category
-        
-        # Импортируем товары
-        products_data = parser_result.get('products', [])
-        
-        for product_data in products_data:
-            try:
-                # Проверяем, существует ли товар с таким артикулом
-                article = product_data.get('article')
-                if not article:
-                    continue
-                
-                # Получаем или создаем категорию
-                category = None
-                if product_data.get('category'):
-                    category = category_map.get(product_data['category'])
-                
-                # Получаем наценку поставщика в сомах
-                markup_som = float(supplier.markup_som or 0)
-                base_price = float(product_data.get('price', 0))
-                final_price = base_price + markup_som
-                
-                # Создаем или обновляем товар (по артикулу и поставщику)
-                product, created = Product.objects.update_or_create(
-                    article=article,
-                    supplier=supplier,
-                    defaults={
-                        'name': product_data.get('name', ''),
-                        'unit': product_data.get('unit', 'шт'),
-                        'category': category,
-                        'base_price': base_price,
-                        'markup_percent': 0,  # Процентная наценка не используется
-                        'final_price': final_price,  # Итоговая цена = цена поставщика + наценка в сомах
-                        'is_active': True,
-                        'price_list': price_list,  # Связываем товар с прайс-листом
-                    }
-                )
-                
-                imported_count += 1  # Считаем и созданные, и обновленные товары
-                if created:
-                    logger.info(f'Создан товар: {product.name} ({product.article})')
-                else:
-                    logger.info(f'Обновлен товар: {product.name} ({product.article})')
-                    
-            except Exception as e:
-                logger.error(f'Ошибка импорта товара {product_data.get("name", "unknown")}: {str(e)}')
-                continue
-        
-        logger.info(f'Импортировано товаров: {imported_count} из {len(products_data)}')
-        return imported_count
-        
+        summary = PriceListImporter(supplier, price_list).run(parser_result)
+        return summary['total']
     except Exception as e:
         logger.error(f'Ошибка импорта товаров: {str(e)}')
         raise
@@ -174,6 +174,53 @@ CSRF_TRUSTED_ORIGINS = [
 CSRF_COOKIE_SECURE = False  # Для разработки
 CSRF_USE_SESSIONS = False
 
+# Импорт прайс-листов
+PRICELIST_IMPORT_BATCH_SIZE = int(os.getenv('PRICELIST_IMPORT_BATCH_SIZE', '1000'))
+# Сколько импортов подряд товар может отсутствовать в прайс-листе, прежде чем станет неактивным
+PRICELIST_SWEEP_GRACE_IMPORTS = int(os.getenv('PRICELIST_SWEEP_GRACE_IMPORTS', '0'))
+# Снятие с продажи пропускается, если в прайс-листе нет товаров или встречено меньше этой доли
+# активных товаров поставщика (файл обрезан или разобран не той разметкой)
+PRICELIST_SWEEP_MIN_SHARE = float(os.getenv('PRICELIST_SWEEP_MIN_SHARE', '0.5'))
+# Кэш результатов парсинга по SHA-256 файла (apps/suppliers/parse_cache.py); пусто - MEDIA_ROOT/pricelist_cache
+PRICELIST_PARSE_CACHE_DIR = os.getenv('PRICELIST_PARSE_CACHE_DIR', '')
+# Очистка кэша парсинга: записи, не использованные дольше N дней, и самые старые сверх размера (0 - без ограничения)
+PRICELIST_PARSE_CACHE_MAX_AGE_DAYS = int(os.getenv('PRICELIST_PARSE_CACHE_MAX_AGE_DAYS', '30'))
+PRICELIST_PARSE_CACHE_MAX_MB = int(os.getenv('PRICELIST_PARSE_CACHE_MAX_MB', '5120'))
+# Как часто (с) обработчик очереди чистит кэш между заданиями
+PRICELIST_PARSE_CACHE_PRUNE_INTERVAL = int(os.getenv('PRICELIST_PARSE_CACHE_PRUNE_INTERVAL', '3600'))
+# Сколько пачек товаров парсер может подготовить впрок, пока импорт пишет в БД
+PRICELIST_PIPELINE_QUEUE_CHUNKS = int(os.getenv('PRICELIST_PIPELINE_QUEUE_CHUNKS', '4'))
+# Как часто (с) импорт сохраняет ход обработки в PriceList.progress
+PRICELIST_PROGRESS_INTERVAL = float(os.getenv('PRICELIST_PROGRESS_INTERVAL', '2'))
+# Парсинг в дочернем процессе (apps/suppliers/parse_pool.py): лимиты памяти (МБ) и времени (с), перезапуск после N файлов
+PRICELIST_PARSE_IN_SUBPROCESS = os.getenv('PRICELIST_PARSE_IN_SUBPROCESS', 'True') == 'True'
+PRICELIST_PARSE_MEMORY_LIMIT_MB = int(os.getenv('PRICELIST_PARSE_MEMORY_LIMIT_MB', '2048'))
+PRICELIST_PARSE_TIMEOUT = int(os.getenv('PRICELIST_PARSE_TIMEOUT', '600'))
+PRICELIST_PARSE_MAX_TASKS_PER_CHILD = int(os.getenv('PRICELIST_PARSE_MAX_TASKS_PER_CHILD', '20'))
+# Сколько листов многолистовой книги (parsing_config['sheets']) разбирается одновременно;
+# лимит памяти действует на каждый дочерний процесс
+PRICELIST_PARSE_SHEET_WORKERS = int(os.getenv('PRICELIST_PARSE_SHEET_WORKERS', '4'))
+
+# Очередь обработки прайс-листов (manage.py run_pricelist_worker)
+PRICELIST_WORKER_PROCESSES = int(os.getenv('PRICELIST_WORKER_PROCESSES', '2'))
+PRICELIST_WORKER_POLL_INTERVAL = float(os.getenv('PRICELIST_WORKER_POLL_INTERVAL', '2'))
+PRICELIST_JOB_MAX_ATTEMPTS = int(os.getenv('PRICELIST_JOB_MAX_ATTEMPTS', '3'))
+PRICELIST_JOB_RETRY_BACKOFF = int(os.getenv('PRICELIST_JOB_RETRY_BACKOFF', '30'))  # секунды, удваивается с каждой попыткой
+PRICELIST_JOB_HEARTBEAT_INTERVAL = int(os.getenv('PRICELIST_JOB_HEARTBEAT_INTERVAL', '30'))
+PRICELIST_JOB_STALE_SECONDS = int(os.getenv('PRICELIST_JOB_STALE_SECONDS', '300'))
+
+# Пересчет цен при смене наценки поставщика (apps/suppliers/pricing.py): до SYNC_LIMIT товаров - сразу,
+# больше - обработчиком очереди диапазонами id по BATCH_SIZE
+SUPPLIER_PRICE_RECOMPUTE_SYNC_LIMIT = int(os.getenv('SUPPLIER_PRICE_RECOMPUTE_SYNC_LIMIT', '5000'))
+SUPPLIER_PRICE_RECOMPUTE_BATCH_SIZE = int(os.getenv('SUPPLIER_PRICE_RECOMPUTE_BATCH_SIZE', '5000'))
+# Сколько секунд забранный пересчет закреплен за обработчиком: упавший обработчик не держит его дольше
+SUPPLIER_PRICE_RECOMPUTE_LEASE_SECONDS = int(os.getenv('SUPPLIER_PRICE_RECOMPUTE_LEASE_SECONDS', '1800'))
+
+# Массовое обновление товаров из админки (apps/catalog/services.py): больше SYNC_LIMIT товаров -
+# обработчиком очереди; пачки по CHUNK_SIZE товаров в отдельных транзакциях
+PRODUCT_BATCH_UPDATE_SYNC_LIMIT = int(os.getenv('PRODUCT_BATCH_UPDATE_SYNC_LIMIT', '2000'))
+PRODUCT_BATCH_UPDATE_CHUNK_SIZE = int(os.getenv('PRODUCT_BATCH_UPDATE_CHUNK_SIZE', '2000'))
+
 # Elasticsearch settings
 ELASTICSEARCH_HOST = os.getenv('ELASTICSEARCH_HOST', 'http://search:9200')
 ELASTICSEARCH_INDEX_NAME = 'products'
@@ -74,7 +74,8 @@ export default function ProductsPage() {
   const [loading, setLoading] = useState(true)
   const [loadingMore, setLoadingMore] = useState(false)
   const [hasMore, setHasMore] = useState(true)
-  const [currentPage, setCurrentPage] = useState(1)
+  // Курсор следующей страницы каталога (keyset-пагинация API, без OFFSET и COUNT на каждую страницу)
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
   const [totalCount, setTotalCount] = useState(0)
   const [sortOption, setSortOption] = useState<SortOption>('name_asc')
   const [showSortDropdown, setShowSortDropdown] = useState(false)
@@ -105,24 +106,28 @@ export default function ProductsPage() {
   }, [])
 
   // Загрузка товаров
-  const loadProducts = useCallback(async (page = 1, reset = false, query = '') => {
+  const loadProducts = useCallback(async (cursor: string | null = null, reset = false, query = '') => {
     try {
       if (reset) {
         setLoading(true)
         setError(null)
         setProducts([])
-        setCurrentPage(1)
+        setNextCursor(null)
         setHasMore(true)
       }
 
+      // Общее число (приближенное) запрашиваем только с первой страницей
       const url = query.trim()
-        ? `/api/catalog/search/?q=${encodeURIComponent(query)}&page=${page}`
-        : `/api/catalog/products/?page=${page}`
+        ? `/api/catalog/search/?q=${encodeURIComponent(query)}`
+        : cursor
+          ? `/api/catalog/products/?cursor=${encodeURIComponent(cursor)}`
+          : '/api/catalog/products/?with_count=true'
 
       setSearchLoading(query.trim().length > 0)
       const response = await apiClient.get(url)
       const productsData = response.data.results || response.data || []
-      const nextPage = response.data.next
+      const next: string | null = response.data.next || null
+      const cursorParam = next ? new URL(next, window.location.origin).searchParams.get('cursor') : null
 
       if (response.data.count !== undefined) {
         setTotalCount(response.data.count)
@@ -137,8 +142,8 @@ export default function ProductsPage() {
         setProducts(prev => sortProducts([...prev, ...sortedProducts], sortOption))
       }
 
-      setHasMore(!!nextPage)
-      setCurrentPage(page)
+      setHasMore(!!cursorParam)
+      setNextCursor(cursorParam)
     } catch (err: any) {
       console.error('Ошибка загрузки товаров:', err)
       setError(err.response?.data?.detail || 'Не удалось загрузить товары. Попробуйте обновить страницу.')
@@ -173,9 +178,9 @@ export default function ProductsPage() {
     if (debouncedQuery !== searchQuery) return
 
     if (debouncedQuery.trim()) {
-      loadProducts(1, true, debouncedQuery)
+      loadProducts(null, true, debouncedQuery)
     } else {
-      loadProducts(1, true)
+      loadProducts(null, true)
     }
   }, [debouncedQuery, loadProducts])
 
@@ -193,7 +198,7 @@ export default function ProductsPage() {
       setSearchQuery(searchParam)
       setDebouncedQuery(searchParam)
     } else {
-      loadProducts(1, true)
+      loadProducts(null, true)
     }
   }, [])
 
@@ -215,13 +220,12 @@ export default function ProductsPage() {
 
     window.addEventListener('scroll', handleScroll)
     return () => window.removeEventListener('scroll', handleScroll)
-  }, [loadingMore, hasMore, searchQuery, currentPage])
+  }, [loadingMore, hasMore, searchQuery, nextCursor])
 
   const loadMoreProducts = async () => {
-    if (loadingMore || !hasMore) return
+    if (loadingMore || !hasMore || !nextCursor) return
     setLoadingMore(true)
-    const nextPage = currentPage + 1
-    await loadProducts(nextPage, false, debouncedQuery)
+    await loadProducts(nextCursor, false, debouncedQuery)
   }
 
   const handleAddToCart = (product: Product) => {